@@ -0,0 +1,24 @@
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def inline_image_workers(settings):
+    """Картинки обрабатываются прямо в запросе, а не в фоновых пулах."""
+    settings.IMAGE_INGEST_WORKERS = 0
+    settings.THUMBNAIL_WORKERS = 0
+
+
+@pytest.fixture(autouse=True)
+def temp_kvstore(settings, tmp_path):
+    """Записи о превью пишутся во временный файл, а не в BASE_DIR."""
+    settings.THUMBNAIL_KVSTORE_PATH = str(tmp_path / 'thumbnails.sqlite3')
+
+
+@pytest.fixture(autouse=True)
+def temp_cache(settings, tmp_path):
+    """Общий кэш живет во временной папке, а не в BASE_DIR."""
+    caches = {
+        alias: dict(cache) for alias, cache in settings.CACHES.items()
+    }
+    caches['default']['LOCATION'] = str(tmp_path / 'cache.sqlite3')
+    settings.CACHES = caches
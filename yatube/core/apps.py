@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     name = 'core'
     verbose_name = 'Сущности проекта'
+
+    def ready(self):
+        from . import db  # noqa: F401
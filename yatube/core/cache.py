@@ -0,0 +1,92 @@
+import hashlib
+import time
+from functools import wraps
+
+from core import routers
+from django.core.cache import cache, caches
+from django.utils.cache import patch_cache_control
+
+# Страницы целиком читаются сначала из памяти воркера: в ключе страницы
+# есть версия из общего кэша, поэтому копии в L1 не устаревают
+PAGE_CACHE_L1 = 'local'
+
+
+def _version_key(key_prefix):
+    return f'{key_prefix}.version'
+
+
+def get_cache_version(key_prefix):
+    """Текущая версия закэшированных страниц с префиксом key_prefix."""
+    version = cache.get(_version_key(key_prefix))
+    if version is None:
+        # Версия могла быть вытеснена из кэша: начинаем с новой, чтобы
+        # не отдать страницы, закэшированные под старым номером.
+        cache.add(_version_key(key_prefix), time.time_ns(), None)
+        version = cache.get(_version_key(key_prefix))
+    return version
+
+
+def bump_cache_version(key_prefix):
+    """Делает недействительными все страницы с префиксом key_prefix."""
+    cache.set(_version_key(key_prefix), time.time_ns(), None)
+
+
+def page_cache_key(key_prefix, request):
+    url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return f'{key_prefix}.{get_cache_version(key_prefix)}.{url}'
+
+
+def get_page(key):
+    """Страница из L1 воркера, а при промахе — из общего кэша."""
+    local_cache = caches[PAGE_CACHE_L1]
+    response = local_cache.get(key)
+    if response is None:
+        response = cache.get(key)
+        if response is not None:
+            local_cache.set(key, response)
+    return response
+
+
+def set_page(key, response, timeout):
+    cache.set(key, response, timeout)
+    caches[PAGE_CACHE_L1].set(key, response, timeout)
+
+
+def anonymous_cache_page(timeout, key_prefix, browser_timeout=0):
+    """Кэширует страницу целиком, но только для анонимных пользователей.
+
+    Все анонимы получают один общий вариант страницы независимо от cookie,
+    ключи сбрасываются bump_cache_version. Авторизованным страница
+    рендерится заново с их шапкой, а общие части кэширует сам шаблон.
+    Браузеру разрешено хранить страницу не дольше browser_timeout, иначе
+    сброс версии не дойдет до пользователя.
+    """
+
+    def decorator(view_func):
+        @wraps(view_func)
+        def _wrapped_view(request, *args, **kwargs):
+            # то, что ляжет в кэш под текущей версией, читается из
+            # основной базы: реплика могла еще не получить изменение,
+            # которое эту версию сбросило
+            routers.read_primary()
+            if (
+                request.method not in ('GET', 'HEAD')
+                or request.user.is_authenticated
+            ):
+                return view_func(request, *args, **kwargs)
+            key = page_cache_key(key_prefix, request)
+            response = get_page(key)
+            if response is None:
+                response = view_func(request, *args, **kwargs)
+                if (
+                    response.status_code == 200
+                    and not response.streaming
+                    and not response.cookies
+                ):
+                    set_page(key, response, timeout)
+            patch_cache_control(response, max_age=browser_timeout)
+            return response
+
+        return _wrapped_view
+
+    return decorator
@@ -0,0 +1,431 @@
+"""Бэкенды кэша: общий для процессов SQLite и L1 в памяти процесса.
+
+LocMemCache у каждого воркера gunicorn свой: главная считается в каждом
+заново, а сброс версии кэша до соседних воркеров не доходит. SQLiteCache
+держит записи в одном файле SQLite в режиме WAL: читатели не ждут
+писателя, а каждая запись атомарна. Просроченные записи не отдаются и
+удаляются при чистке, лишние вытесняются по времени последнего чтения.
+Чистка с подсчетом записей идет не на каждой записи, а раз в
+MAX_ENTRIES / CULL_CHECKS записей потока, так что кэш может ненадолго
+превысить MAX_ENTRIES на эту долю в каждом потоке.
+
+MemoryCache — L1 в памяти воркера с бюджетом в байтах. В нем лежат целые
+страницы: их ключи содержат версию из общего кэша, так что копия в
+воркере не может пережить сброс версии.
+"""
+import pickle
+import re
+import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter, OrderedDict, defaultdict
+from contextlib import contextmanager
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, '
+    'value BLOB NOT NULL, expires REAL, accessed REAL NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)',
+    'CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires)',
+)
+# Время чтения обновляется не чаще раза в столько секунд, иначе каждое
+# попадание в кэш превращалось бы в запись
+ACCESS_RESOLUTION = 60
+# Сколько раз на MAX_ENTRIES записей поток проверяет переполнение
+CULL_CHECKS = 100
+# Сколько секунд запись ждет чужую блокировку, прежде чем упасть
+BUSY_TIMEOUT = 5
+# Префикс для статистики — часть ключа до первой точки или двоеточия
+KEY_PREFIX = re.compile(r'[.:]')
+
+
+class SQLiteCache(BaseCache):
+    """Бэкенд для CACHES: LOCATION — путь к файлу базы."""
+
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = location
+        # у каждого потока свое соединение: sqlite3 не делит их
+        self._local = threading.local()
+        self._cull_every = max(1, self._max_entries // CULL_CHECKS)
+
+    @property
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self._path, timeout=BUSY_TIMEOUT, isolation_level=None
+            )
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            for statement in SCHEMA:
+                connection.execute(statement)
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def _write(self):
+        """Транзакция, которая сразу берет блокировку записи."""
+        connection = self._connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _fresh(self, expires, now):
+        return expires is None or expires > now
+
+    def _touch_accessed(self, keys, now):
+        """Обновляет время чтения, только если база не занята.
+
+        Попадание в кэш не ждет чужую запись: если база занята писателем,
+        LRU подождет до следующего чтения.
+        """
+        connection = self._connection
+        connection.execute('PRAGMA busy_timeout = 0')
+        try:
+            connection.executemany(
+                'UPDATE cache SET accessed = ? WHERE key = ?',
+                [(now, key) for key in keys],
+            )
+        except sqlite3.OperationalError:
+            pass
+        finally:
+            connection.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT * 1000}')
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        row = self._connection.execute(
+            'SELECT value, expires, accessed FROM cache WHERE key = ?', (key,)
+        ).fetchone()
+        now = time.time()
+        if row is None or not self._fresh(row[1], now):
+            return default
+        if row[2] < now - ACCESS_RESOLUTION:
+            self._touch_accessed([key], now)
+        return pickle.loads(row[0])
+
+    def get_many(self, keys, version=None):
+        keys = {self._key(key, version): key for key in keys}
+        if not keys:
+            return {}
+        rows = self._connection.execute(
+            'SELECT key, value, expires, accessed FROM cache '
+            'WHERE key IN ({})'.format(', '.join('?' * len(keys))),
+            list(keys),
+        ).fetchall()
+        now = time.time()
+        values, stale = {}, []
+        for key, value, expires, accessed in rows:
+            if not self._fresh(expires, now):
+                continue
+            values[keys[key]] = pickle.loads(value)
+            if accessed < now - ACCESS_RESOLUTION:
+                stale.append(key)
+        if stale:
+            self._touch_accessed(stale, now)
+        return values
+
+    def _rows(self, data, timeout, version):
+        expires = self.get_backend_timeout(timeout)
+        now = time.time()
+        return [
+            (
+                self._key(key, version),
+                pickle.dumps(value, self.pickle_protocol),
+                expires,
+                now,
+            )
+            for key, value in data.items()
+        ]
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        rows = self._rows(data, timeout, version)
+        with self._write() as connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO cache (key, value, expires, accessed) '
+                'VALUES (?, ?, ?, ?)',
+                rows,
+            )
+            self._cull(connection, len(rows))
+        return []
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        ((key, value, expires, now),) = self._rows(
+            {key: value}, timeout, version
+        )
+        with self._write() as connection:
+            connection.execute(
+                'DELETE FROM cache WHERE key = ? AND expires <= ?',
+                (key, now),
+            )
+            added = connection.execute(
+                'INSERT OR IGNORE INTO cache (key, value, expires, accessed) '
+                'VALUES (?, ?, ?, ?)',
+                (key, value, expires, now),
+            ).rowcount
+            if added:
+                self._cull(connection, added)
+        return bool(added)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        with self._write() as connection:
+            return bool(
+                connection.execute(
+                    'UPDATE cache SET expires = ? WHERE key = ? '
+                    'AND (expires IS NULL OR expires > ?)',
+                    (self.get_backend_timeout(timeout), key, time.time()),
+                ).rowcount
+            )
+
+    def incr(self, key, delta=1, version=None):
+        # чтение и запись в одной транзакции, чтобы процессы
+        # не теряли прибавки друг друга
+        cache_key = self._key(key, version)
+        with self._write() as connection:
+            row = connection.execute(
+                'SELECT value, expires FROM cache WHERE key = ?',
+                (cache_key,),
+            ).fetchone()
+            if row is None or not self._fresh(row[1], time.time()):
+                raise ValueError(f"Key '{key}' not found")
+            value = pickle.loads(row[0]) + delta
+            connection.execute(
+                'UPDATE cache SET value = ? WHERE key = ?',
+                (pickle.dumps(value, self.pickle_protocol), cache_key),
+            )
+        return value
+
+    def has_key(self, key, version=None):
+        row = self._connection.execute(
+            'SELECT expires FROM cache WHERE key = ?',
+            (self._key(key, version),),
+        ).fetchone()
+        return row is not None and self._fresh(row[0], time.time())
+
+    def delete(self, key, version=None):
+        self.delete_many([key], version)
+
+    def delete_many(self, keys, version=None):
+        keys = [(self._key(key, version),) for key in keys]
+        with self._write() as connection:
+            connection.executemany('DELETE FROM cache WHERE key = ?', keys)
+
+    def clear(self):
+        with self._write() as connection:
+            connection.execute('DELETE FROM cache')
+
+    def _cull(self, connection, written):
+        """Удаляет просроченное, а при переполнении — давно не читанное.
+
+        COUNT(*) проходит всю таблицу, поэтому чистка идет раз в
+        _cull_every записей этого потока, а не на каждой.
+        """
+        writes = getattr(self._local, 'writes', 0) + written
+        if writes < self._cull_every:
+            self._local.writes = writes
+            return
+        self._local.writes = 0
+        connection.execute(
+            'DELETE FROM cache WHERE expires <= ?', (time.time(),)
+        )
+        (count,) = connection.execute('SELECT COUNT(*) FROM cache').fetchone()
+        if count <= self._max_entries:
+            return
+        if self._cull_frequency == 0:
+            connection.execute('DELETE FROM cache')
+            return
+        connection.execute(
+            'DELETE FROM cache WHERE key IN '
+            '(SELECT key FROM cache ORDER BY accessed LIMIT ?)',
+            (count // self._cull_frequency,),
+        )
+
+
+class _MemoryStore:
+    """Данные одного MemoryCache, общие для всех потоков процесса."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # ключ -> (байты, сжато ли, срок, размер, префикс)
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.stats = defaultdict(Counter)
+
+
+_memory_stores = {}
+
+
+def key_prefix(key):
+    """index_page.1.abc -> index_page, template.cache.x -> template"""
+    return KEY_PREFIX.split(key, 1)[0]
+
+
+class MemoryCache(BaseCache):
+    """Кэш в памяти процесса с бюджетом в байтах вместо числа записей.
+
+    Размер записи — длина сериализованного значения; при превышении
+    MAX_BYTES вытесняются давно не читанные записи. Значения от
+    COMPRESS_MIN_SIZE байт сжимаются zlib, если это их уменьшает (0 — не
+    сжимать). Попадания, промахи, вытеснения и байты считаются по
+    префиксу ключа, см. stats().
+    """
+
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, name, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._max_bytes = options.get('MAX_BYTES', 32 * 1024 * 1024)
+        self._compress_min_size = options.get('COMPRESS_MIN_SIZE', 0)
+        # Django создает бэкенд в каждом потоке, данные у них общие
+        self._store = _memory_stores.setdefault(name, _MemoryStore())
+
+    def _key(self, key, version):
+        cache_key = self.make_key(key, version=version)
+        self.validate_key(cache_key)
+        return cache_key, key_prefix(key)
+
+    def _pack(self, value):
+        data = pickle.dumps(value, self.pickle_protocol)
+        if self._compress_min_size and len(data) >= self._compress_min_size:
+            compressed = zlib.compress(data, 1)
+            if len(compressed) < len(data):
+                return compressed, True
+        return data, False
+
+    def _unpack(self, entry):
+        data, compressed = entry[:2]
+        return pickle.loads(zlib.decompress(data) if compressed else data)
+
+    def _live(self, key, now):
+        """Запись по ключу, если она есть и не просрочена; под блокировкой."""
+        entry = self._store.entries.get(key)
+        if entry is None:
+            return None
+        if entry[2] is not None and entry[2] <= now:
+            self._remove(key)
+            return None
+        return entry
+
+    def _remove(self, key):
+        data, compressed, expires, size, prefix = self._store.entries.pop(key)
+        self._store.bytes -= size
+        stats = self._store.stats[prefix]
+        stats['bytes'] -= size
+        stats['entries'] -= 1
+
+    def _put(self, key, prefix, value, expires):
+        data, compressed = self._pack(value)
+        size = len(data) + len(key)
+        store = self._store
+        if key in store.entries:
+            self._remove(key)
+        if size > self._max_bytes:
+            store.stats[prefix]['rejected'] += 1
+            return
+        while store.bytes + size > self._max_bytes:
+            evicted = next(iter(store.entries))
+            store.stats[store.entries[evicted][4]]['evictions'] += 1
+            self._remove(evicted)
+        store.entries[key] = (data, compressed, expires, size, prefix)
+        store.bytes += size
+        store.stats[prefix]['bytes'] += size
+        store.stats[prefix]['entries'] += 1
+
+    def get(self, key, default=None, version=None):
+        key, prefix = self._key(key, version)
+        store = self._store
+        with store.lock:
+            entry = self._live(key, time.time())
+            if entry is None:
+                store.stats[prefix]['misses'] += 1
+                return default
+            store.entries.move_to_end(key)
+            store.stats[prefix]['hits'] += 1
+        return self._unpack(entry)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key, prefix = self._key(key, version)
+        with self._store.lock:
+            self._put(key, prefix, value, self.get_backend_timeout(timeout))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key, prefix = self._key(key, version)
+        with self._store.lock:
+            if self._live(key, time.time()) is not None:
+                return False
+            self._put(key, prefix, value, self.get_backend_timeout(timeout))
+            return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key, prefix = self._key(key, version)
+        with self._store.lock:
+            entry = self._live(key, time.time())
+            if entry is None:
+                return False
+            self._store.entries[key] = (
+                entry[:2] + (self.get_backend_timeout(timeout),) + entry[3:]
+            )
+            return True
+
+    def incr(self, key, delta=1, version=None):
+        cache_key, prefix = self._key(key, version)
+        with self._store.lock:
+            entry = self._live(cache_key, time.time())
+            if entry is None:
+                raise ValueError(f"Key '{key}' not found")
+            value = self._unpack(entry) + delta
+            self._put(cache_key, prefix, value, entry[2])
+        return value
+
+    def has_key(self, key, version=None):
+        key, prefix = self._key(key, version)
+        with self._store.lock:
+            return self._live(key, time.time()) is not None
+
+    def delete(self, key, version=None):
+        key, prefix = self._key(key, version)
+        with self._store.lock:
+            if key in self._store.entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._store.lock:
+            self._store.entries.clear()
+            self._store.bytes = 0
+            for stats in self._store.stats.values():
+                stats['bytes'] = stats['entries'] = 0
+
+    def stats(self):
+        """Счетчики по префиксам ключей: {префикс: {счетчик: значение}}."""
+        with self._store.lock:
+            result = {}
+            for prefix, stats in self._store.stats.items():
+                requests = stats['hits'] + stats['misses']
+                result[prefix] = {
+                    'hits': stats['hits'],
+                    'misses': stats['misses'],
+                    'hit_rate': stats['hits'] / requests if requests else None,
+                    'evictions': stats['evictions'],
+                    'rejected': stats['rejected'],
+                    'entries': stats['entries'],
+                    'bytes': stats['bytes'],
+                }
+            return result
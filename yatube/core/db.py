@@ -0,0 +1,23 @@
+"""Настройка соединений с SQLite сразу после открытия.
+
+PRAGMA из SQLITE_PRAGMAS действуют на одно соединение, поэтому ставятся
+на каждое новое по сигналу connection_created. С журналом WAL читатели не
+ждут писателя, а busy_timeout заставляет писателей ждать друг друга
+вместо ошибки "database is locked".
+"""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+def apply_pragmas(cursor, pragmas):
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        apply_pragmas(cursor, settings.SQLITE_PRAGMAS)
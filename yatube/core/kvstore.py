@@ -0,0 +1,159 @@
+"""kvstore sorl-thumbnail в отдельном файле SQLite с LRU в памяти.
+
+Стандартный kvstore держит записи о превью в основной базе, а кэш
+LocMemCache у каждого процесса свой, так что после перезапуска каждый
+воркер заново спрашивает базу о каждой картинке. Здесь записи лежат в
+файле SQLite в режиме WAL, который делят все процессы, а частые ключи
+(и промахи) живут в LRU процесса. Чужие записи сбрасывают LRU: раз в
+THUMBNAIL_KVSTORE_RECHECK секунд сверяется PRAGMA data_version.
+
+Файл задает THUMBNAIL_KVSTORE_PATH. Он лежит вне MEDIA_ROOT, чтобы его
+не раздавал веб-сервер; хранилищу с другим MEDIA_ROOT (как в тестах)
+нужен и свой файл kvstore.
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.kvstores.base import KVStoreBase
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS kvstore '
+    '(key TEXT PRIMARY KEY, value TEXT NOT NULL) WITHOUT ROWID'
+)
+# ключи sorl — ASCII, так что этот символ больше любого из них
+KEY_END = '\uffff'
+
+
+def kvstore_path():
+    return settings.THUMBNAIL_KVSTORE_PATH
+
+
+class KVStore(KVStoreBase):
+    """kvstore для THUMBNAIL_KVSTORE = 'core.kvstore.KVStore'."""
+
+    def __init__(self):
+        super().__init__()
+        # у каждого потока свое соединение: sqlite3 не делит их
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._lru = OrderedDict()
+
+    def _connect(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        connection = sqlite3.connect(path, timeout=5, isolation_level=None)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.execute(SCHEMA)
+        return connection
+
+    def _connection(self):
+        """Соединение потока с текущим файлом kvstore.
+
+        Если файл удалили или подменили (у открытого файла не осталось
+        ссылок), соединение открывается заново, а LRU сбрасывается.
+        """
+        local = self._local
+        path = kvstore_path()
+        if getattr(local, 'path', None) != path or (
+            os.fstat(local.fd).st_nlink == 0
+        ):
+            self._close()
+            local.connection = self._connect(path)
+            local.fd = os.open(path, os.O_RDONLY)
+            local.path = path
+            local.checked_at = 0
+            local.version = None
+            self._forget_all()
+        if time.monotonic() - local.checked_at >= (
+            settings.THUMBNAIL_KVSTORE_RECHECK
+        ):
+            local.checked_at = time.monotonic()
+            (version,) = local.connection.execute(
+                'PRAGMA data_version'
+            ).fetchone()
+            if local.version is not None and version != local.version:
+                self._forget_all()
+            local.version = version
+        return local.connection
+
+    def _close(self):
+        local = self._local
+        if getattr(local, 'path', None) is not None:
+            local.connection.close()
+            os.close(local.fd)
+            local.path = None
+
+    def _forget_all(self):
+        with self._lock:
+            self._lru.clear()
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._lru[key] = value
+            self._lru.move_to_end(key)
+            while len(self._lru) > settings.THUMBNAIL_KVSTORE_LRU_SIZE:
+                self._lru.popitem(last=False)
+
+    def _get_raw(self, key):
+        connection = self._connection()
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                return self._lru[key]
+        row = connection.execute(
+            'SELECT value FROM kvstore WHERE key = ?', (key,)
+        ).fetchone()
+        # промахи тоже запоминаются: превью еще не нарезано
+        value = row[0] if row else None
+        self._remember(key, value)
+        return value
+
+    def _set_raw(self, key, value):
+        self._connection().execute(
+            'INSERT OR REPLACE INTO kvstore (key, value) VALUES (?, ?)',
+            (key, value),
+        )
+        self._remember(key, value)
+
+    def _delete_raw(self, *keys):
+        connection = self._connection()
+        connection.executemany(
+            'DELETE FROM kvstore WHERE key = ?', [(key,) for key in keys]
+        )
+        with self._lock:
+            for key in keys:
+                self._lru.pop(key, None)
+
+    def _find_keys_raw(self, prefix, batch_size=1000):
+        """Ключи с префиксом по возрастанию, пачками по ключу.
+
+        Между пачками курсор не держится, поэтому ключи можно удалять,
+        не дожидаясь конца обхода.
+        """
+        last_key = prefix
+        while True:
+            keys = [
+                key
+                for key, in self._connection().execute(
+                    'SELECT key FROM kvstore WHERE key > ? AND key < ? '
+                    'ORDER BY key LIMIT ?',
+                    (last_key, prefix + KEY_END, batch_size),
+                )
+            ]
+            if not keys:
+                return
+            last_key = keys[-1]
+            yield from keys
+
+    def clear(self):
+        prefix = thumbnail_settings.THUMBNAIL_KEY_PREFIX
+        self._connection().execute(
+            'DELETE FROM kvstore WHERE key >= ? AND key < ?',
+            (prefix, prefix + KEY_END),
+        )
+        self._forget_all()
@@ -0,0 +1,68 @@
+import os
+import tempfile
+import time
+
+from core.cache_backends import SQLiteCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает задержку попадания в кэш: LocMemCache, файловый кэш '
+        'и общий кэш в SQLite'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=5000)
+        parser.add_argument(
+            '--size',
+            type=int,
+            default=30 * 1024,
+            help='Размер закэшированной страницы в байтах',
+        )
+
+    def measure(self, operation, iterations):
+        """Средняя задержка операции в микросекундах."""
+        started = time.perf_counter()
+        for _ in range(iterations):
+            operation()
+        return (time.perf_counter() - started) / iterations * 10 ** 6
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        page = HttpResponse(b'x' * options['size'])
+        with tempfile.TemporaryDirectory() as directory:
+            backends = (
+                ('LocMemCache', LocMemCache('benchmark', {})),
+                (
+                    'FileBasedCache',
+                    FileBasedCache(os.path.join(directory, 'files'), {}),
+                ),
+                (
+                    'SQLiteCache',
+                    SQLiteCache(os.path.join(directory, 'cache.sqlite3'), {}),
+                ),
+            )
+            self.stdout.write(
+                f'Страница {options["size"]} байт, {iterations} повторов, '
+                'мкс на операцию:'
+            )
+            for name, cache in backends:
+                cache.set('page', page, None)
+                cache.set('version', time.time_ns(), None)
+                hit = self.measure(lambda: cache.get('page'), iterations)
+                version = self.measure(
+                    lambda: cache.get('version'), iterations
+                )
+                miss = self.measure(lambda: cache.get('missing'), iterations)
+                write = self.measure(
+                    lambda: cache.set('page', page, 60), iterations // 10
+                )
+                self.stdout.write(
+                    f'{name:>15}: страница {hit:8.1f}, '
+                    f'версия {version:8.1f}, промах {miss:8.1f}, '
+                    f'запись {write:8.1f}'
+                )
@@ -0,0 +1,134 @@
+import os
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from core.db import apply_pragmas
+from core.sqlite.base import BEGIN
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+SCHEMA = (
+    'CREATE TABLE post (id INTEGER PRIMARY KEY, text TEXT NOT NULL, '
+    'author_id INTEGER NOT NULL, pub_date REAL NOT NULL)',
+    'CREATE INDEX post_author ON post (author_id, pub_date)',
+)
+
+
+def connect(path, pragmas):
+    # как у Django: автокоммит, транзакции открываются явным BEGIN
+    connection = sqlite3.connect(path, isolation_level=None)
+    apply_pragmas(connection.cursor(), pragmas)
+    return connection
+
+
+def run_worker(path, pragmas, persistent, begin, writer, seconds):
+    """Крутит запросы, как post_create или index, и считает их.
+
+    Без persistent соединение открывается на каждый запрос, как при
+    CONN_MAX_AGE = 0. Возвращает (выполнено, ошибок блокировки).
+    """
+    connection = connect(path, pragmas) if persistent else None
+    done = locked = 0
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        current = connection or connect(path, pragmas)
+        try:
+            if writer:
+                current.execute(begin)
+                current.execute(
+                    'SELECT COUNT(*) FROM post WHERE author_id = ?',
+                    (os.getpid(),),
+                ).fetchone()
+                current.execute(
+                    'INSERT INTO post (text, author_id, pub_date) '
+                    'VALUES (?, ?, ?)',
+                    ('Текст поста ' * 20, os.getpid(), time.time()),
+                )
+                current.execute('COMMIT')
+            else:
+                current.execute(
+                    'SELECT id, text FROM post ORDER BY id DESC LIMIT 10'
+                ).fetchall()
+            done += 1
+        except sqlite3.OperationalError:
+            locked += 1
+            if current.in_transaction:
+                current.execute('ROLLBACK')
+        finally:
+            if not persistent:
+                current.close()
+    return done, locked
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает пропускную способность SQLite на конкурентной нагрузке: '
+        'настройки по умолчанию против SQLITE_PRAGMAS, постоянных '
+        'соединений и BEGIN IMMEDIATE'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--seconds', type=float, default=3)
+
+    def run(self, pragmas, persistent, begin, options):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'benchmark.sqlite3')
+            with connect(path, pragmas) as connection:
+                for statement in SCHEMA:
+                    connection.execute(statement)
+            roles = [True] * options['writers'] + [False] * options['readers']
+            with ProcessPoolExecutor(
+                max_workers=len(roles), mp_context=get_context('spawn')
+            ) as pool:
+                futures = [
+                    (
+                        writer,
+                        pool.submit(
+                            run_worker,
+                            path,
+                            pragmas,
+                            persistent,
+                            begin,
+                            writer,
+                            options['seconds'],
+                        ),
+                    )
+                    for writer in roles
+                ]
+                totals = {True: [0, 0], False: [0, 0]}
+                for writer, future in futures:
+                    done, locked = future.result()
+                    totals[writer][0] += done
+                    totals[writer][1] += locked
+        return totals
+
+    def handle(self, *args, **options):
+        seconds = options['seconds']
+        self.stdout.write(
+            f'Писателей: {options["writers"]}, читателей: '
+            f'{options["readers"]}, {seconds} с на вариант'
+        )
+        tuned = settings.SQLITE_PRAGMAS
+        variants = (
+            ('По умолчанию, соединение на запрос', {}, False, 'BEGIN'),
+            ('PRAGMA, соединение на запрос', tuned, False, 'BEGIN'),
+            ('PRAGMA, постоянное соединение', tuned, True, 'BEGIN'),
+            (f'PRAGMA, постоянное соединение, {BEGIN}', tuned, True, BEGIN),
+        )
+        for title, pragmas, persistent, begin in variants:
+            totals = self.run(pragmas, persistent, begin, options)
+            (writes, write_errors), (reads, read_errors) = (
+                totals[True],
+                totals[False],
+            )
+            self.stdout.write(
+                f'{title}: запись {writes / seconds:.0f}/с '
+                f'(ошибок блокировки {write_errors}), '
+                f'чтение {reads / seconds:.0f}/с '
+                f'(ошибок {read_errors})'
+            )
@@ -0,0 +1,36 @@
+from core import routers
+from django.conf import settings
+
+STICKY_COOKIE = 'primary'
+SAFE_METHODS = ('GET', 'HEAD')
+
+
+class ReplicaMiddleware:
+    """Пускает безопасные запросы читать из реплики.
+
+    После запроса, который что-то записал, ставит cookie: пока она жива,
+    запросы этого браузера читают из основной базы.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        routers.use_replica(
+            request.method in SAFE_METHODS
+            and STICKY_COOKIE not in request.COOKIES
+        )
+        try:
+            response = self.get_response(request)
+            wrote = routers.wrote()
+        finally:
+            routers.use_replica(False)
+        if wrote and settings.DATABASE_READ_REPLICA:
+            response.set_cookie(
+                STICKY_COOKIE,
+                '1',
+                max_age=settings.REPLICA_STICKY_SECONDS,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
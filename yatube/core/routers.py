@@ -0,0 +1,53 @@
+"""Чтение из реплики SQLite, запись — в основную базу.
+
+Реплику читают только безопасные запросы (GET, HEAD), которые пропустил
+ReplicaMiddleware: команды, фоновые потоки и запросы на запись всегда
+работают с основной базой, и устаревшие данные реплики не попадают туда,
+где по ним что-то меняют. Первая же запись в запросе переключает его
+остаток на основную базу, а пользователь еще REPLICA_STICKY_SECONDS
+читает только из нее, чтобы видеть свои изменения, пока реплика отстает.
+"""
+import threading
+
+from django.conf import settings
+
+_state = threading.local()
+
+
+def use_replica(enabled):
+    """Разрешает или запрещает текущему потоку читать из реплики."""
+    _state.replica = enabled
+    _state.wrote = False
+
+
+def read_primary():
+    """Остаток запроса читает из основной базы."""
+    _state.replica = False
+
+
+def mark_write():
+    """Запрос что-то записал: дальше и в ближайшие секунды — только default."""
+    read_primary()
+    _state.wrote = True
+
+
+def wrote():
+    """Писал ли текущий поток в базу с последнего use_replica."""
+    return getattr(_state, 'wrote', False)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if settings.DATABASE_READ_REPLICA and getattr(
+            _state, 'replica', False
+        ):
+            return settings.DATABASE_READ_REPLICA
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        mark_write()
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # реплика — копия основной базы, объекты из них связываются
+        return True
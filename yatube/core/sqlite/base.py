@@ -0,0 +1,39 @@
+"""Бэкенд SQLite, который открывает транзакции через BEGIN IMMEDIATE.
+
+Обычный BEGIN откладывает блокировку до первой записи. Если к этому
+времени базу успел изменить другой процесс, SQLite не может поднять
+блокировку чтения до записи и сразу отвечает "database is locked", не
+дожидаясь busy_timeout. BEGIN IMMEDIATE берет блокировку записи в начале
+транзакции, так что писатели просто ждут друг друга в очереди.
+
+В базе с 'FOREIGN_KEYS': False внешние ключи не проверяются: так
+устроены шарды постов, где строки ссылаются на пользователей и группы
+из default (см. posts.shards).
+"""
+from django.db.backends.sqlite3 import base
+
+BEGIN = 'BEGIN IMMEDIATE'
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    @property
+    def foreign_keys(self):
+        return self.settings_dict.get('FOREIGN_KEYS', True)
+
+    def get_new_connection(self, conn_params):
+        conn = super().get_new_connection(conn_params)
+        if not self.foreign_keys:
+            conn.execute('PRAGMA foreign_keys = OFF')
+        return conn
+
+    def enable_constraint_checking(self):
+        # миграции включают проверку обратно после пересборки таблиц
+        if self.foreign_keys:
+            super().enable_constraint_checking()
+
+    def check_constraints(self, table_names=None):
+        if self.foreign_keys:
+            super().check_constraints(table_names)
+
+    def _start_transaction_under_autocommit(self):
+        self.cursor().execute(BEGIN)
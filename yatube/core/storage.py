@@ -0,0 +1,63 @@
+"""Файловое хранилище с раскладкой по хешу содержимого."""
+import hashlib
+import os
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+# get_available_name дописывает к занятому имени суффикс _XXXXXXX
+SHARDED_NAME = re.compile(
+    r'(^|/)[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{64}(_\w+)?\.\w+$'
+)
+
+
+def file_hash(content):
+    """sha256 содержимого файла, посчитанный по чанкам."""
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    content.seek(0)
+    return digest.hexdigest()
+
+
+def shard_name(name, content_hash):
+    """posts/photo.JPG -> posts/ab/cd/abcd….jpg"""
+    directory, filename = os.path.split(name)
+    extension = os.path.splitext(filename)[1].lower()
+    return os.path.join(
+        directory,
+        content_hash[:2],
+        content_hash[2:4],
+        f'{content_hash}{extension}',
+    )
+
+
+def is_sharded(name):
+    return bool(SHARDED_NAME.search(name))
+
+
+@deconstructible
+class HashShardedStorage(FileSystemStorage):
+    """Кладет файлы в каталоги по префиксу sha256 содержимого.
+
+    В одном каталоге оказывается не больше 1/65536 всех файлов, поэтому
+    поиск по каталогу, очистка и бэкапы не упираются в плоскую папку.
+    Имя файла определяется содержимым, так что повторная загрузка того же
+    файла не пишет копию, а возвращает уже сохраненное имя. Хеш,
+    посчитанный заранее, можно передать в content.content_hash.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        content_hash = getattr(content, 'content_hash', None)
+        if not content_hash:
+            content_hash = file_hash(content)
+        name = shard_name(name, content_hash)
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length)
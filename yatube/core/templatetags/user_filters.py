@@ -1,8 +1,29 @@
+from core.utils import page_window as get_page_window
 from django import template
+from django.conf import settings
 
 register = template.Library()
 
+# GET-параметры пагинации: ссылки на страницы заменяют их, а не копят
+PAGE_PARAMS = ('page', 'after', 'before')
+
 
 @register.filter
 def addclass(field, css):
     return field.as_widget(attrs={'class': css})
+
+
+@register.filter
+def page_window(page):
+    return get_page_window(page, settings.PAGINATE_WINDOW)
+
+
+@register.simple_tag(takes_context=True)
+def page_url(context, **params):
+    """?-ссылка на страницу с остальными GET-параметрами запроса."""
+    query = context['request'].GET.copy()
+    for name in PAGE_PARAMS:
+        query.pop(name, None)
+    for name, value in params.items():
+        query[name] = value
+    return f'?{query.urlencode()}'
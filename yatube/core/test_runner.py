@@ -0,0 +1,28 @@
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test import override_settings
+from django.test.runner import DiscoverRunner
+
+
+class TempCacheRunner(DiscoverRunner):
+    """Тесты пишут общий кэш во временную папку, а не в BASE_DIR."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._cache_directory = tempfile.mkdtemp()
+        caches = {
+            alias: dict(cache) for alias, cache in settings.CACHES.items()
+        }
+        caches['default']['LOCATION'] = os.path.join(
+            self._cache_directory, 'cache.sqlite3'
+        )
+        self._cache_settings = override_settings(CACHES=caches)
+        self._cache_settings.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._cache_settings.disable()
+        shutil.rmtree(self._cache_directory, ignore_errors=True)
+        super().teardown_test_environment(**kwargs)
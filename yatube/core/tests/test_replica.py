@@ -0,0 +1,88 @@
+import os
+import sqlite3
+import tempfile
+from io import StringIO
+
+from core import routers
+from core.middleware import STICKY_COOKIE, ReplicaMiddleware
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import router
+from django.http import HttpResponse
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from posts.models import Post
+
+User = get_user_model()
+
+
+@override_settings(DATABASE_READ_REPLICA='replica')
+class ReplicaRouterTest(SimpleTestCase):
+    def setUp(self):
+        self.used = []
+
+    def request(self, method='get', write=False, **cookies):
+        """Прогоняет запрос через ReplicaMiddleware и запоминает, откуда
+        view читал до и после записи."""
+
+        def view(request):
+            self.used.append(router.db_for_read(Post))
+            if write:
+                router.db_for_write(Post)
+                self.used.append(router.db_for_read(Post))
+            return HttpResponse()
+
+        factory = RequestFactory()
+        for name, value in cookies.items():
+            factory.cookies[name] = value
+        return ReplicaMiddleware(view)(getattr(factory, method)('/'))
+
+    def test_safe_requests_read_replica(self):
+        """GET читает из реплики, пока в запросе ничего не записано"""
+        response = self.request()
+        self.assertEqual(self.used, ['replica'])
+        self.assertNotIn(STICKY_COOKIE, response.cookies)
+
+    def test_write_switches_to_primary(self):
+        """После записи запрос и следующие читают из основной базы"""
+        response = self.request(write=True)
+        self.assertEqual(self.used, ['replica', 'default'])
+        self.assertEqual(
+            response.cookies[STICKY_COOKIE]['max-age'],
+            settings.REPLICA_STICKY_SECONDS,
+        )
+        self.request(**{STICKY_COOKIE: '1'})
+        self.request('post')
+        self.assertEqual(self.used[2:], ['default', 'default'])
+
+    def test_outside_requests_read_primary(self):
+        """Команды и фоновые потоки читают из основной базы"""
+        self.request()
+        self.assertEqual(router.db_for_read(Post), 'default')
+        routers.use_replica(True)
+        with override_settings(DATABASE_READ_REPLICA=None):
+            self.assertEqual(router.db_for_read(Post), 'default')
+        routers.use_replica(False)
+
+
+class SyncReplicaTest(TransactionTestCase):
+    def test_sync_copies_primary(self):
+        """sync_replica переносит в реплику текущие данные"""
+        user = User.objects.create_user(username='auth')
+        Post.objects.create(author=user, text='Первый пост')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'replica.sqlite3')
+            call_command('sync_replica', target=path, stdout=StringIO())
+            Post.objects.create(author=user, text='Второй пост')
+            replica = sqlite3.connect(path)
+            count = replica.execute('SELECT COUNT(*) FROM posts_post')
+            self.assertEqual(count.fetchone()[0], 1)
+            call_command('sync_replica', target=path, stdout=StringIO())
+            count = replica.execute('SELECT COUNT(*) FROM posts_post')
+            self.assertEqual(count.fetchone()[0], 2)
+            replica.close()
@@ -0,0 +1,29 @@
+from core.sqlite.base import BEGIN
+from django.conf import settings
+from django.db import connection, transaction
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from posts.models import Group
+
+
+class SQLiteSettingsTest(TransactionTestCase):
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_pragmas_applied(self):
+        """Каждое соединение получает PRAGMA из настроек"""
+        self.assertEqual(self.pragma('busy_timeout'), 5000)
+        self.assertEqual(self.pragma('synchronous'), 1)
+        self.assertEqual(
+            self.pragma('cache_size'),
+            settings.SQLITE_PRAGMAS['cache_size'],
+        )
+
+    def test_transactions_begin_immediate(self):
+        """Транзакция сразу берет блокировку записи"""
+        with CaptureQueriesContext(connection) as queries:
+            with transaction.atomic():
+                Group.objects.create(title='Группа', slug='group')
+        self.assertEqual(queries.captured_queries[0]['sql'], BEGIN)
@@ -1,8 +1,159 @@
+import base64
+import binascii
+
 from django.conf import settings
-from django.core.paginator import Paginator
+from django.core.paginator import Page, Paginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+def encode_cursor(obj):
+    """Кодирует ключ (pub_date, id) записи в непрозрачный токен."""
+    raw = f'{obj.pub_date.isoformat()}|{obj.pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Разбирает токен курсора, для битого токена возвращает None."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        pub_date, pk = raw.decode().split('|')
+        pub_date = parse_datetime(pub_date)
+        pk = int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+    if pub_date is None:
+        return None
+    return pub_date, pk
+
+
+class CursorPage(Page):
+    """Страница курсорной пагинации: знает только соседей, без номеров.
+
+    encode строит токен курсора по записи на границе страницы.
+    """
+
+    def __init__(
+        self,
+        object_list,
+        paginator,
+        has_next,
+        has_previous,
+        encode=encode_cursor,
+    ):
+        super().__init__(object_list, None, paginator)
+        self._has_next = has_next
+        self._has_previous = has_previous
+        self._encode = encode
+
+    def __repr__(self):
+        return '<Cursor page>'
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def next_cursor(self):
+        if self._has_next and self.object_list:
+            return self._encode(self.object_list[-1])
+        return None
+
+    def previous_cursor(self):
+        if self._has_previous and self.object_list:
+            return self._encode(self.object_list[0])
+        return None
+
+
+class CursorPaginator(Paginator):
+    """Пагинатор по ключу (pub_date, id) для наследников CreatedModel.
+
+    Не выполняет ни COUNT(*), ни OFFSET: каждая страница — это один запрос
+    с условием по ключу и LIMIT на одну запись больше размера страницы.
+    key — поля запроса, по которым сортировать и фильтровать; их значения
+    должны совпадать с pub_date и pk записи.
+    """
+
+    cursor = True
+
+    def __init__(self, object_list, per_page, key=('pub_date', 'pk')):
+        super().__init__(object_list, per_page)
+        self.key = key
+
+    def _key_filter(self, cursor, lookup):
+        date_field, pk_field = self.key
+        pub_date, pk = cursor
+        return Q(**{f'{date_field}__{lookup}': pub_date}) | Q(
+            **{date_field: pub_date, f'{pk_field}__{lookup}': pk}
+        )
+
+    def get_cursor_page(self, after=None, before=None):
+        posts = self.object_list
+        date_field, pk_field = self.key
+        if before is not None:
+            rows = list(
+                posts.filter(self._key_filter(before, 'gt')).order_by(
+                    date_field, pk_field
+                )[: self.per_page + 1]
+            )
+            has_previous = len(rows) > self.per_page
+            rows = rows[: self.per_page][::-1]
+            return CursorPage(rows, self, True, has_previous)
+        if after is not None:
+            posts = posts.filter(self._key_filter(after, 'lt'))
+        rows = list(
+            posts.order_by(f'-{date_field}', f'-{pk_field}')[
+                : self.per_page + 1
+            ]
+        )
+        has_next = len(rows) > self.per_page
+        return CursorPage(
+            rows[: self.per_page], self, has_next, after is not None
+        )
+
+
+def page_window(page, window):
+    """Номера страниц вокруг текущей: первая, последняя и ±window.
+
+    Разрывы между ними обозначаются None.
+    """
+    num_pages = page.paginator.num_pages
+    start = max(page.number - window, 1)
+    end = min(page.number + window, num_pages)
+    numbers = [1] if start > 1 else []
+    if start > 2:
+        numbers.append(None)
+    numbers.extend(range(start, end + 1))
+    if end < num_pages - 1:
+        numbers.append(None)
+    if end < num_pages:
+        numbers.append(num_pages)
+    return numbers
+
 
+def paginate(
+    post_list, request, cursor=None, key=('pub_date', 'pk'), per_page=None
+):
+    """Возвращает страницу записей.
 
-def paginate(post_list, request):
+    Курсорный режим включается настройкой PAGINATE_CURSOR, аргументом
+    cursor или наличием в запросе токенов ?after= / ?before=; key
+    передается в CursorPaginator. По умолчанию на странице
+    PAGINATE_LIMIT записей.
+    """
+    per_page = per_page or settings.PAGINATE_LIMIT
+    after = request.GET.get('after')
+    before = request.GET.get('before')
+    if cursor is None:
+        cursor = settings.PAGINATE_CURSOR or bool(after or before)
+    if cursor:
+        paginator = CursorPaginator(post_list, per_page, key=key)
+        return paginator.get_cursor_page(
+            after=decode_cursor(after), before=decode_cursor(before)
+        )
     page_number = request.GET.get('page')
-    paginator = Paginator(post_list, settings.PAGINATE_LIMIT)
+    paginator = Paginator(post_list, per_page)
     return paginator.get_page(page_number)
@@ -1,3 +1,9 @@
+import os
+
+from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.cache import caches
+from django.http import JsonResponse
 from django.shortcuts import render
 
 
@@ -16,3 +22,18 @@ def server_error(request):
 
 def permission_denied(request, exception):
     return render(request, 'core/403.html', status=403)
+
+
+@staff_member_required
+def cache_stats(request):
+    """Статистика кэшей этого воркера: у каждого процесса своя."""
+    return JsonResponse(
+        {
+            'pid': os.getpid(),
+            'caches': {
+                alias: caches[alias].stats()
+                for alias in settings.CACHES
+                if hasattr(caches[alias], 'stats')
+            },
+        }
+    )
@@ -0,0 +1,105 @@
+"""Один поток-писатель в SQLite на процесс с групповым коммитом.
+
+В SQLite пишет только одно соединение за раз, поэтому записи из многих
+потоков воркера выстраиваются в очередь на блокировку, и хвост задержек
+растет. Здесь записи передаются потоку-писателю: он собирает пачку до
+SQLITE_WRITE_BATCH_SIZE записей, подождав соседей не дольше
+SQLITE_WRITE_BATCH_WAIT секунд, выполняет их в одной транзакции и только
+после коммита отдает каждому запросу его результат. Каждая запись идет
+в своей точке сохранения, так что ошибка одной не откатывает соседние.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from core import routers
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+_jobs = None
+_lock = threading.Lock()
+
+
+def write(func, *args, **kwargs):
+    """Выполняет запись func(*args, **kwargs) и возвращает ее результат.
+
+    При SQLITE_WRITE_QUEUE запись уходит потоку-писателю, иначе
+    выполняется сразу. Исключение записи поднимается у вызывающего.
+    Обработчики on_commit записи выполняются в потоке-писателе.
+    """
+    if not settings.SQLITE_WRITE_QUEUE:
+        return func(*args, **kwargs)
+    # пишет другой поток, а свои изменения должен видеть этот запрос
+    routers.mark_write()
+    future = Future()
+    get_jobs().put((future, func, args, kwargs))
+    return future.result()
+
+
+def get_jobs():
+    global _jobs
+    with _lock:
+        if _jobs is None:
+            _jobs = queue.SimpleQueue()
+            threading.Thread(
+                target=run_writer,
+                args=(_jobs,),
+                name='sqlite-writer',
+                daemon=True,
+            ).start()
+    return _jobs
+
+
+def batches(jobs):
+    while True:
+        batch = [jobs.get()]
+        deadline = time.monotonic() + settings.SQLITE_WRITE_BATCH_WAIT
+        while len(batch) < settings.SQLITE_WRITE_BATCH_SIZE:
+            try:
+                batch.append(
+                    jobs.get(timeout=max(deadline - time.monotonic(), 0))
+                )
+            except queue.Empty:
+                break
+        yield batch
+
+
+def run_jobs(batch):
+    """Выполняет записи пачки, каждую в своей точке сохранения."""
+    results = []
+    for future, func, args, kwargs in batch:
+        if not future.set_running_or_notify_cancel():
+            continue
+        try:
+            with transaction.atomic():
+                results.append((future, func(*args, **kwargs), None))
+        except Exception as error:
+            results.append((future, None, error))
+    return results
+
+
+def run_batch(batch):
+    """Выполняет пачку в одной транзакции, результаты — после коммита."""
+    try:
+        with transaction.atomic():
+            results = run_jobs(batch)
+    except Exception as error:
+        # коммит не удался: ни одна запись пачки не сохранилась
+        for future, func, args, kwargs in batch:
+            if not future.done():
+                future.set_exception(error)
+        return
+    for future, result, error in results:
+        if error is None:
+            future.set_result(result)
+        else:
+            future.set_exception(error)
+
+
+def run_writer(jobs):
+    for batch in batches(jobs):
+        # соединение писателя живет долго: пусть его проверяют, как
+        # соединения запросов
+        close_old_connections()
+        run_batch(batch)
@@ -1,5 +1,6 @@
 from django.contrib import admin
 
+from . import search
 from .models import Follow, Group, Post
 
 
@@ -11,6 +12,12 @@ class PostAdmin(admin.ModelAdmin):
     list_filter = ('pub_date',)
     empty_value_display = '-пусто-'
 
+    def get_search_results(self, request, queryset, search_term):
+        # поиск по полнотекстовому индексу вместо LIKE '%…%'
+        if not search_term:
+            return queryset, False
+        return search.filter_posts(queryset, search_term), False
+
 
 @admin.register(Follow)
 class FollowAdmin(admin.ModelAdmin):
@@ -4,3 +4,12 @@ from django.apps import AppConfig
 class PostsConfig(AppConfig):
     name = 'posts'
     verbose_name = 'Записи и сообщества'
+
+    def ready(self):
+        from django.conf import settings
+        from PIL import Image
+
+        from . import signals  # noqa: F401
+
+        # Pillow отказывается открывать картинки больше двух таких лимитов
+        Image.MAX_IMAGE_PIXELS = settings.POST_IMAGE_MAX_PIXELS
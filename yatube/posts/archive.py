@@ -0,0 +1,148 @@
+"""Архив старых постов.
+
+Посты старше POST_ARCHIVE_AGE дней вместе с комментариями команда
+archive_posts переносит пачками в отдельную базу POST_ARCHIVE. В горячих
+таблицах остаются свежие посты, и их индексы помещаются в кэш страниц.
+
+Команда переносит посты по возрастанию pub_date сразу по всем шардам:
+каждая пачка — самые старые горячие посты из любых баз. Так архивные
+посты старше горячих и в ленте группы, которая идет через все шарды,
+даже если запуск прервали; расходиться могут только посты одной пачки,
+пока ее части из разных шардов переносятся. Поэтому лента автора или
+группы — это горячие посты, за которыми идут архивные (ChainedQuerySet),
+и архив читается, только когда горячих не хватило на страницу. Главная и
+лента подписок показывают только горячие посты. Архивный пост
+открывается по старому адресу, его можно править и комментировать:
+posts.routers.ArchiveRouter держит связанные с ним записи в архиве.
+"""
+from datetime import timedelta
+from itertools import chain
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import shards
+
+
+def database():
+    return settings.POST_ARCHIVE
+
+
+def is_enabled():
+    return bool(settings.POST_ARCHIVE)
+
+
+def cutoff(days=None):
+    """Посты до этого момента считаются старыми."""
+    if days is None:
+        days = settings.POST_ARCHIVE_AGE
+    return timezone.now() - timedelta(days=days)
+
+
+def contains(obj):
+    """Прочитан ли объект из архива."""
+    return is_enabled() and obj is not None and obj._state.db == database()
+
+
+def chain_archive(hot, queryset):
+    """hot, а за ним queryset из архива; без архива — просто hot."""
+    if not is_enabled():
+        return hot
+    # пользователи и группы лежат в default, поэтому MergedQuerySet:
+    # select_related у него превращается в prefetch
+    return ChainedQuerySet(hot, shards.spread(queryset, [database()]))
+
+
+class ChainedQuerySet:
+    """Горячие записи, а за ними архивные, как одна выборка.
+
+    Умеет то, что нужно пагинаторам, get_object_or_404 и поиску. При
+    сортировке от новых к старым архив идет вторым, от старых к новым —
+    первым; вторая часть читается, только если первой не хватило.
+    """
+
+    def __init__(self, hot, archived):
+        self.hot = hot
+        self.archived = archived
+        self.model = hot.model
+        self._first_count = None
+
+    def __repr__(self):
+        return f'<ChainedQuerySet {self.hot!r}, {self.archived!r}>'
+
+    def _map(self, method, *args, **kwargs):
+        return ChainedQuerySet(
+            getattr(self.hot, method)(*args, **kwargs),
+            getattr(self.archived, method)(*args, **kwargs),
+        )
+
+    def all(self):
+        return self
+
+    def filter(self, *args, **kwargs):
+        return self._map('filter', *args, **kwargs)
+
+    def exclude(self, *args, **kwargs):
+        return self._map('exclude', *args, **kwargs)
+
+    def order_by(self, *fields):
+        return self._map('order_by', *fields)
+
+    def values_list(self, *fields, **kwargs):
+        return self._map('values_list', *fields, **kwargs)
+
+    def select_related(self, *fields):
+        return self._map('select_related', *fields)
+
+    @property
+    def ordered(self):
+        return self.hot.ordered
+
+    def _parts(self):
+        fields, reverse = self.archived._ordering()
+        if fields and not reverse:
+            return self.archived, self.hot
+        return self.hot, self.archived
+
+    def _count_first(self, first):
+        if self._first_count is None:
+            self._first_count = first.count()
+        return self._first_count
+
+    def __iter__(self):
+        return chain(*self._parts())
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        first, second = self._parts()
+        start, stop = key.start or 0, key.stop
+        rows = list(first[start:stop])
+        if stop is not None and len(rows) == stop - start:
+            return rows
+        offset = 0
+        if start and not rows:
+            offset = max(start - self._count_first(first), 0)
+        if stop is not None:
+            stop = offset + stop - start - len(rows)
+        return rows + list(second[offset:stop])
+
+    def count(self):
+        first, second = self._parts()
+        return self._count_first(first) + second.count()
+
+    def exists(self):
+        return any(part.exists() for part in self._parts())
+
+    def in_bulk(self, ids):
+        found = self.hot.in_bulk(ids)
+        missing = [pk for pk in ids if pk not in found]
+        if missing:
+            found.update(self.archived.in_bulk(missing))
+        return found
+
+    def get(self, *args, **kwargs):
+        try:
+            return self.hot.get(*args, **kwargs)
+        except self.model.DoesNotExist:
+            return self.archived.get(*args, **kwargs)
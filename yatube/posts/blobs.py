@@ -0,0 +1,53 @@
+"""Подсчет ссылок постов на файлы картинок."""
+from django.core.exceptions import SuspiciousFileOperation
+from django.db import transaction
+from django.db.models import F
+from sorl.thumbnail import default
+from sorl.thumbnail.images import ImageFile
+
+from .models import ImageBlob, Post
+
+
+def acquire(name):
+    blobs = ImageBlob.objects.filter(name=name)
+    if not blobs.update(refcount=F('refcount') + 1):
+        ImageBlob.objects.get_or_create(name=name)
+        blobs.update(refcount=F('refcount') + 1)
+
+
+def store(image):
+    """Сохраняет загруженный файл поста и сразу берет на него ссылку.
+
+    Хранилище не пишет файл, который уже есть. Проверка и ссылка идут в
+    одной транзакции записи (BEGIN IMMEDIATE), так что delete_file не
+    удалит найденный файл, пока пост на него еще не сослался.
+    """
+    with transaction.atomic():
+        image.save(image.name, image.file, save=False)
+        acquire(image.name)
+
+
+def release(name):
+    """Снимает ссылку; последний пост уносит с собой файл и превью."""
+    ImageBlob.objects.filter(name=name, refcount__gt=0).update(
+        refcount=F('refcount') - 1
+    )
+    deleted, _ = ImageBlob.objects.filter(name=name, refcount=0).delete()
+    if deleted:
+        transaction.on_commit(lambda: delete_file(name))
+
+
+def delete_file(name):
+    storage = Post._meta.get_field('image').storage
+    try:
+        storage.path(name)
+    except SuspiciousFileOperation:
+        # путь вне хранилища — не наш файл
+        return
+    # загрузка того же файла ждет блокировку в store, а ссылку, взятую до
+    # нас, видно в refcount
+    with transaction.atomic():
+        if ImageBlob.objects.filter(name=name, refcount__gt=0).exists():
+            return
+        default.kvstore.delete(ImageFile(name, storage))
+        storage.delete(name)
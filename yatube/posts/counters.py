@@ -0,0 +1,114 @@
+"""Денормализованные счетчики постов, комментариев и подписок."""
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from . import archive, shards
+from .models import Comment, Follow, Group, Post, UserStats
+
+User = get_user_model()
+
+
+def increment(model, pk, field, delta=1, using=None):
+    """Атомарно сдвигает счетчик, не опуская его ниже нуля."""
+    queryset = model.objects.using(using).filter(pk=pk)
+    if delta < 0:
+        queryset = queryset.filter(**{f'{field}__gte': -delta})
+    return queryset.update(**{field: F(field) + delta})
+
+
+def increment_user(user_id, field, delta=1):
+    if not increment(UserStats, user_id, field, delta) and delta > 0:
+        # строки еще нет: пользователь создан в обход сигналов
+        UserStats.objects.get_or_create(user_id=user_id)
+        increment(UserStats, user_id, field, delta)
+
+
+def _count(model, field):
+    counts = (
+        model.objects.filter(**{field: OuterRef('pk')})
+        .order_by()
+        .values(field)
+        .annotate(count=Count('pk'))
+        .values('count')
+    )
+    return Coalesce(Subquery(counts), 0)
+
+
+def _reconcile_posts_count(model, field, batch_size):
+    """posts_count при шардировании или с архивом: посты считаются
+    по всем базам."""
+    actual = Counter()
+    for database in shards.post_databases():
+        rows = (
+            Post.objects.using(database)
+            .order_by()
+            .values_list(field)
+            .annotate(count=Count('pk'))
+        )
+        for pk, count in rows:
+            actual[pk] += count
+    drifted = 0
+    stored = model.objects.order_by('pk').values_list('pk', 'posts_count')
+    for pk, count in stored.iterator(chunk_size=batch_size):
+        if count != actual[pk]:
+            drifted += model.objects.filter(pk=pk).update(
+                posts_count=actual[pk]
+            )
+    return drifted
+
+
+def _reconcile(model, fields, batch_size, using=None):
+    drifted = 0
+    objects = model.objects.using(using)
+    last_pk = objects.order_by('-pk').values_list('pk', flat=True)
+    last_pk = last_pk.first() or 0
+    for start in range(0, last_pk + 1, batch_size):
+        batch = objects.filter(
+            pk__gte=start, pk__lt=start + batch_size
+        ).annotate(**{f'actual_{name}': c for name, c in fields.items()})
+        for name in fields:
+            drifted += batch.exclude(**{name: F(f'actual_{name}')}).update(
+                **{name: F(f'actual_{name}')}
+            )
+    return drifted
+
+
+def reconcile(batch_size=1000):
+    """Пересчитывает все счетчики по исходным таблицам.
+
+    Обновления идут пачками по диапазонам первичного ключа, чтобы
+    не держать блокировку на всю таблицу. Возвращает число счетчиков,
+    которые разошлись с данными и были исправлены.
+    """
+    missing = User.objects.filter(stats__isnull=True).values_list(
+        'pk', flat=True
+    )
+    UserStats.objects.bulk_create(
+        [UserStats(user_id=pk) for pk in missing.iterator()],
+        batch_size=batch_size,
+        ignore_conflicts=True,
+    )
+    user_counters = {
+        'followers_count': _count(Follow, 'author'),
+        'following_count': _count(Follow, 'user'),
+    }
+    if shards.is_enabled() or archive.is_enabled():
+        # посты лежат в шардах и архиве, а группы и пользователи — в default
+        drifted = _reconcile_posts_count(Group, 'group', batch_size)
+        drifted += _reconcile_posts_count(UserStats, 'author', batch_size)
+    else:
+        user_counters['posts_count'] = _count(Post, 'author')
+        drifted = _reconcile(
+            Group, {'posts_count': _count(Post, 'group')}, batch_size
+        )
+    for database in shards.post_databases():
+        drifted += _reconcile(
+            Post,
+            {'comments_count': _count(Comment, 'post')},
+            batch_size,
+            using=database,
+        )
+    return drifted + _reconcile(UserStats, user_counters, batch_size)
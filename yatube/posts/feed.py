@@ -0,0 +1,132 @@
+"""Лента подписок: гибрид fan-out on write и чтения по запросу.
+
+Посты обычных авторов раскладываются в FeedEntry подписчиков в момент
+публикации. Для авторов, у которых подписчиков больше FEED_FANOUT_LIMIT,
+раскладка стоила бы слишком дорого, поэтому их посты подмешиваются в ленту
+при чтении.
+
+При шардировании постов (posts.shards) FeedEntry не ведется: лента
+собирается из шардов авторов, на которых подписан пользователь.
+"""
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import F, Q
+
+from . import shards
+from .models import FeedEntry, Follow, Post, UserStats
+
+
+# Поля, по которым лента сортируется и листается курсором
+CURSOR_KEY = ('feed_date', 'feed_post')
+
+
+def is_pull_author(author_id):
+    """Автор слишком популярен для раскладки постов по лентам."""
+    return UserStats.objects.filter(
+        pk=author_id, followers_count__gt=settings.FEED_FANOUT_LIMIT
+    ).exists()
+
+
+def _pull_author_ids(user):
+    return Follow.objects.filter(
+        user=user,
+        author__stats__followers_count__gt=settings.FEED_FANOUT_LIMIT,
+    ).values_list('author_id', flat=True)
+
+
+def _bulk_insert(entries):
+    # bulk_create превращает аргумент в список, поэтому режем сами
+    while True:
+        batch = list(islice(entries, settings.FEED_BATCH_SIZE))
+        if not batch:
+            return
+        FeedEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def fan_out(post):
+    """Раскладывает новый пост по лентам подписчиков автора."""
+    if shards.is_enabled() or is_pull_author(post.author_id):
+        return
+    follower_ids = Follow.objects.filter(author_id=post.author_id).values_list(
+        'user_id', flat=True
+    )
+    _bulk_insert(
+        FeedEntry(user_id=user_id, post=post, pub_date=post.pub_date)
+        for user_id in follower_ids.iterator()
+    )
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту подписчика уже опубликованные посты автора."""
+    if shards.is_enabled() or is_pull_author(author_id):
+        return
+    posts = Post.objects.filter(author_id=author_id).values_list(
+        'pk', 'pub_date'
+    )
+    _bulk_insert(
+        FeedEntry(user_id=user_id, post_id=pk, pub_date=pub_date)
+        for pk, pub_date in posts.iterator()
+    )
+
+
+def trim(user_id, author_id):
+    """Убирает посты автора из ленты бывшего подписчика."""
+    if shards.is_enabled():
+        return
+    FeedEntry.objects.filter(
+        user_id=user_id, post__author_id=author_id
+    ).delete()
+
+
+def resume_fan_out(author_id):
+    """Догружает ленты подписчиков, когда автор снова стал обычным.
+
+    Срабатывает, когда число подписчиков опустилось ровно до
+    FEED_FANOUT_LIMIT. Пока автор читался по запросу, его новые посты не
+    раскладывались, а подписавшимся тогда не догружались старые, так что
+    каждому подписчику добавляются все недостающие посты автора.
+    """
+    if shards.is_enabled() or not UserStats.objects.filter(
+        pk=author_id, followers_count=settings.FEED_FANOUT_LIMIT
+    ).exists():
+        return
+    follower_ids = Follow.objects.filter(author_id=author_id).values_list(
+        'user_id', flat=True
+    )
+    for user_id in follower_ids.iterator():
+        backfill(user_id, author_id)
+
+
+def feed_posts(user):
+    """Посты ленты подписок пользователя, от новых к старым.
+
+    Без популярных авторов страница читается из индекса FeedEntry,
+    иначе посты выбираются по списку и сортируются в памяти СУБД.
+    """
+    if shards.is_enabled():
+        author_ids = list(
+            Follow.objects.filter(user=user).values_list(
+                'author_id', flat=True
+            )
+        )
+        posts = (
+            Post.objects.spread(authors=author_ids)
+            .filter(author_id__in=author_ids)
+            .annotate(feed_date=F('pub_date'), feed_post=F('pk'))
+        )
+        return posts.order_by('-feed_date', '-feed_post')
+    pull_author_ids = list(_pull_author_ids(user))
+    if not pull_author_ids:
+        posts = Post.objects.filter(feed_entries__user=user).annotate(
+            feed_date=F('feed_entries__pub_date'),
+            feed_post=F('feed_entries__post_id'),
+        )
+    else:
+        in_feed = Q(
+            pk__in=FeedEntry.objects.filter(user=user).values('post_id')
+        )
+        posts = Post.objects.filter(
+            in_feed | Q(author_id__in=pull_author_ids)
+        ).annotate(feed_date=F('pub_date'), feed_post=F('pk'))
+    return posts.order_by('-feed_date', '-feed_post')
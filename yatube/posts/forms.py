@@ -1,5 +1,7 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
 
+from . import ingest
 from .models import Comment, Post
 
 
@@ -8,6 +10,13 @@ class PostForm(forms.ModelForm):
         model = Post
         fields = ('text', 'group', 'image')
 
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        # при редактировании без новой загрузки здесь сохраненный файл
+        if isinstance(image, UploadedFile):
+            ingest.check(image)
+        return image
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
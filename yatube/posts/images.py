@@ -0,0 +1,48 @@
+"""Метаданные картинок постов: размеры, хеш и размер файла."""
+import hashlib
+
+from PIL import Image
+
+# Поля Post, которые заполняет describe()
+METADATA_FIELDS = ('image_width', 'image_height', 'image_hash', 'image_size')
+
+
+def describe(file):
+    """Размеры, sha256 и размер файла в байтах.
+
+    Pillow читает только заголовок картинки, а хеш считается по чанкам,
+    так что файл целиком в память не попадает.
+    """
+    file.seek(0)
+    try:
+        width, height = Image.open(file).size
+    except OSError:
+        # не картинка: формы такое не пропустят, но модель сохранить можно
+        width = height = None
+    file.seek(0)
+    content_hash = getattr(file, 'content_hash', None)
+    if content_hash:
+        # посчитан обработчиком загрузки, пока файл приходил
+        size = file.size
+    else:
+        digest, size = hashlib.sha256(), 0
+        for chunk in file.chunks():
+            digest.update(chunk)
+            size += len(chunk)
+        content_hash = digest.hexdigest()
+        file.seek(0)
+    return {
+        'image_width': width,
+        'image_height': height,
+        'image_hash': content_hash,
+        'image_size': size,
+    }
+
+
+def empty():
+    return {
+        'image_width': None,
+        'image_height': None,
+        'image_hash': '',
+        'image_size': None,
+    }
@@ -0,0 +1,177 @@
+"""Прием картинок постов: проверки до декодирования и нормализация.
+
+Форма смотрит на размер файла и число пикселей по заголовку, не
+раскодируя картинку. После коммита оригинал с EXIF или слишком большой
+стороной пересохраняется без метаданных и уменьшается. С пулом
+(IMAGE_INGEST_WORKERS) это происходит в отдельных процессах, и
+веб-процесс не держит в памяти полноразмерные картинки. Превью потом
+режутся уже из нормализованного оригинала.
+"""
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from io import BytesIO
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.template.defaultfilters import filesizeformat
+from PIL import Image, ImageOps, ImageSequence
+
+from . import blobs, images, shards, thumbnails
+from .models import Post
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def check(file):
+    """Отклоняет слишком тяжелые файлы и картинки до декодирования."""
+    if file.size > settings.POST_IMAGE_MAX_SIZE:
+        raise ValidationError(
+            'Файл больше %(limit)s.',
+            params={'limit': filesizeformat(settings.POST_IMAGE_MAX_SIZE)},
+        )
+    file.seek(0)
+    # Image.open читает только заголовок
+    width, height = Image.open(file).size
+    file.seek(0)
+    if width * height > settings.POST_IMAGE_MAX_PIXELS:
+        raise ValidationError(
+            'Картинка больше %(limit)s мегапикселей.',
+            params={'limit': f'{settings.POST_IMAGE_MAX_PIXELS / 10 ** 6:g}'},
+        )
+
+
+def _reencode_animated(image, max_side):
+    """Уменьшает каждый кадр анимации, сохраняя длительности кадров."""
+    frames, durations = [], []
+    for frame in ImageSequence.Iterator(image):
+        durations.append(frame.info.get('duration', 100))
+        # кадры GIF в палитре, уменьшаются они в полном цвете
+        frame = frame.convert('RGBA')
+        frame.thumbnail((max_side, max_side))
+        frames.append(frame)
+    buffer = BytesIO()
+    frames[0].save(
+        buffer,
+        format=image.format,
+        save_all=True,
+        append_images=frames[1:],
+        duration=durations,
+        loop=image.info.get('loop', 0),
+        disposal=2,
+    )
+    return buffer.getvalue(), frames[0].width
+
+
+def _reencode(file):
+    """Пересохраняет картинку без EXIF и не больше POST_IMAGE_MAX_SIDE.
+
+    Анимация уменьшается покадрово, но пересохраняется, только если она
+    больше POST_IMAGE_MAX_SIDE. Возвращает (байты или None, если менять
+    нечего; ширину).
+    """
+    image = Image.open(file)
+    max_side = settings.POST_IMAGE_MAX_SIDE
+    too_big = max(image.size) > max_side
+    # у MPO второй кадр — превью камеры, это не анимация
+    if image.format != 'MPO' and getattr(image, 'is_animated', False):
+        if not too_big:
+            return None, image.width
+        return _reencode_animated(image, max_side)
+    if not (too_big or image.getexif()):
+        return None, image.width
+    # MPO — JPEG с телефонных камер, Pillow пишет его только как JPEG
+    format_ = 'JPEG' if image.format == 'MPO' else image.format
+    # JPEG сразу раскодируется в уменьшенном в 2-8 раз масштабе
+    image.draft('RGB', (max_side, max_side))
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((max_side, max_side))
+    buffer = BytesIO()
+    image.save(buffer, format=format_, quality=90)
+    return buffer.getvalue(), image.width
+
+
+def normalize(name):
+    """Убирает EXIF и уменьшает оригинал; возвращает (имя, ширина).
+
+    Нормализованный файл получает новое имя по хешу, и все посты со
+    старым файлом переводятся на него вместе со ссылками ImageBlob.
+    """
+    field = Post._meta.get_field('image')
+    try:
+        with field.storage.open(name) as file:
+            data, width = _reencode(file)
+        if data is None:
+            return name, width
+        content = ContentFile(data, name=os.path.basename(name))
+        metadata = images.describe(content)
+        content.content_hash = metadata['image_hash']
+        # файл и ссылки на него — под одной блокировкой записи, см.
+        # blobs.store; ссылки ImageBlob лежат в default, посты — в шардах
+        with transaction.atomic():
+            new_name = field.storage.save(
+                os.path.join(field.upload_to, content.name), content
+            )
+            for database in shards.post_databases():
+                with transaction.atomic(database):
+                    posts = Post.objects.using(database)
+                    post_ids = list(
+                        posts.filter(image=name).values_list('pk', flat=True)
+                    )
+                    posts.filter(pk__in=post_ids).update(
+                        image=new_name, **metadata
+                    )
+                    for _ in post_ids:
+                        blobs.release(name)
+                        blobs.acquire(new_name)
+        return new_name, width
+    except Exception:
+        logger.exception('Не удалось нормализовать картинку %s', name)
+        return name, None
+    finally:
+        close_old_connections()
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.IMAGE_INGEST_WORKERS,
+            mp_context=get_context('spawn'),
+            initializer=thumbnails.init_worker,
+        )
+    return _executor
+
+
+def _normalized(name, future):
+    # колбэк выполняется в служебном потоке пула процессов: не блокируем
+    # его нарезкой, а только передаем работу пулу превью
+    error = future.exception()
+    if error is not None:
+        logger.error(
+            'Не удалось нормализовать картинку %s', name, exc_info=error
+        )
+        return
+    thumbnails.get_executor().submit(thumbnails.generate, *future.result())
+
+
+def queue(post):
+    """После коммита нормализует оригинал и нарезает превью."""
+    if not post.image:
+        return
+    name = post.image.name
+
+    def ingest():
+        if settings.IMAGE_INGEST_WORKERS:
+            future = get_executor().submit(normalize, name)
+            future.add_done_callback(partial(_normalized, name))
+        else:
+            thumbnails.schedule(*normalize(name))
+
+    transaction.on_commit(ingest)
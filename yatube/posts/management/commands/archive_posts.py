@@ -0,0 +1,155 @@
+import time
+
+from core.cache import bump_cache_version
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from posts import archive, shards
+from posts.management.commands.rebalance_shards import (
+    COMMENT_COLUMNS,
+    COMMENT_TABLE,
+    FEED_TABLE,
+    POST_COLUMNS,
+    POST_TABLE,
+    placeholders,
+)
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит посты старше POST_ARCHIVE_AGE дней вместе с '
+        'комментариями в архивную базу POST_ARCHIVE, пачками'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--age',
+            type=int,
+            help='Переносить посты старше стольких дней',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Сколько постов переносить в одной транзакции',
+        )
+        parser.add_argument(
+            '--pause',
+            type=float,
+            default=0,
+            help='Пауза между пачками в секундах, чтобы пропустить запись',
+        )
+
+    def batch(self, sources, cutoff):
+        """id самых старых постов всех sources до cutoff по базам.
+
+        Пачка берется по общему pub_date, а не по одной базе за другой:
+        иначе прерванный запуск оставил бы в горячих базах посты старше
+        архивных.
+        """
+        posts = shards.spread(
+            Post.objects.filter(pub_date__lt=cutoff)
+            .order_by('pub_date', 'pk')
+            .only('pub_date'),
+            sources,
+        )[: self.batch_size]
+        ids = {}
+        for post in posts:
+            ids.setdefault(post._state.db, []).append(post.pk)
+        return ids
+
+    def move(self, source, ids):
+        """Переносит посты ids с комментариями из source в архив.
+
+        source заблокирован на запись (BEGIN IMMEDIATE) от чтения пачки
+        до удаления, так что новые комментарии не теряются. Архив
+        фиксируется первым: после сбоя между коммитами пачка лежит в обеих
+        базах, и следующий запуск перенесет ее заново.
+        """
+        target = archive.database()
+        marks = placeholders(ids)
+        with transaction.atomic(source), transaction.atomic(target):
+            with connections[source].cursor() as cursor:
+                cursor.execute(
+                    f'SELECT {", ".join(POST_COLUMNS)} FROM {POST_TABLE} '
+                    f'WHERE id IN ({marks})',
+                    ids,
+                )
+                posts = cursor.fetchall()
+                # id комментариев в архиве свои, как и при переносе шардов
+                cursor.execute(
+                    f'SELECT {", ".join(COMMENT_COLUMNS)} '
+                    f'FROM {COMMENT_TABLE} WHERE post_id IN ({marks}) '
+                    f'ORDER BY pub_date, id',
+                    ids,
+                )
+                comments = cursor.fetchall()
+            with connections[target].cursor() as cursor:
+                # пачка могла остаться в архиве после сбоя
+                cursor.execute(
+                    f'DELETE FROM {COMMENT_TABLE} WHERE post_id IN ({marks})',
+                    ids,
+                )
+                cursor.execute(
+                    f'DELETE FROM {POST_TABLE} WHERE id IN ({marks})', ids
+                )
+                cursor.executemany(
+                    f'INSERT INTO {POST_TABLE} ({", ".join(POST_COLUMNS)}) '
+                    f'VALUES ({placeholders(POST_COLUMNS)})',
+                    posts,
+                )
+                cursor.executemany(
+                    f'INSERT INTO {COMMENT_TABLE} '
+                    f'({", ".join(COMMENT_COLUMNS)}) '
+                    f'VALUES ({placeholders(COMMENT_COLUMNS)})',
+                    comments,
+                )
+            with connections[source].cursor() as cursor:
+                for table in (COMMENT_TABLE, FEED_TABLE):
+                    cursor.execute(
+                        f'DELETE FROM {table} WHERE post_id IN ({marks})',
+                        ids,
+                    )
+                cursor.execute(
+                    f'DELETE FROM {POST_TABLE} WHERE id IN ({marks})', ids
+                )
+        return len(posts), len(comments)
+
+    def handle(self, *args, **options):
+        if not archive.is_enabled():
+            raise CommandError('Архив выключен: POST_ARCHIVE не задан')
+        target = archive.database()
+        if target == DEFAULT_DB_ALIAS or target in shards.databases():
+            raise CommandError(
+                'POST_ARCHIVE должен быть отдельной базой, не default '
+                'и не шардом'
+            )
+        self.batch_size = options['batch_size']
+        self.verbosity = options['verbosity']
+        cutoff = archive.cutoff(options['age'])
+        started = time.monotonic()
+        posts = comments = 0
+        sources = [
+            source for source in shards.post_databases() if source != target
+        ]
+        batch = self.batch(sources, cutoff)
+        while batch:
+            for source, ids in batch.items():
+                moved = self.move(source, ids)
+                posts += moved[0]
+                comments += moved[1]
+            if self.verbosity > 1:
+                self.stdout.write(f'{posts} постов')
+            if options['pause']:
+                time.sleep(options['pause'])
+            batch = self.batch(sources, cutoff)
+        if posts:
+            # старые посты пропали с глубоких страниц главной
+            bump_cache_version(settings.INDEX_CACHE_PREFIX)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'В архив перенесено постов: {posts}, комментариев: '
+                f'{comments} за {time.monotonic() - started:.1f} с'
+            )
+        )
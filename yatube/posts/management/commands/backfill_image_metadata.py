@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from posts import images
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Заполняет размеры, хеш и вес картинок у старых постов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Сколько постов обновлять одним запросом',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        pending = (
+            Post.objects.exclude(image='')
+            .filter(image_hash='')
+            .only('pk', 'image')
+            .order_by('pk')
+        )
+        last_id = updated = missing = 0
+        while True:
+            batch = list(pending.filter(pk__gt=last_id)[:batch_size])
+            if not batch:
+                break
+            last_id = batch[-1].pk
+            described = []
+            for post in batch:
+                try:
+                    with post.image.open('rb') as file:
+                        metadata = images.describe(file)
+                except OSError:
+                    missing += 1
+                    continue
+                for field, value in metadata.items():
+                    setattr(post, field, value)
+                described.append(post)
+            Post.objects.bulk_update(described, images.METADATA_FIELDS)
+            updated += len(described)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Обновлено постов: {updated}, файлов не найдено: {missing}'
+            )
+        )
@@ -0,0 +1,119 @@
+from html.parser import HTMLParser
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.test import Client
+from django.urls import reverse
+
+
+def parse_srcset(value):
+    candidates = []
+    for candidate in value.split(','):
+        url, width = candidate.split()
+        candidates.append((int(width.rstrip('w')), url))
+    return sorted(candidates)
+
+
+class ImagesParser(HTMLParser):
+    """Собирает картинки страницы: src, srcset и <source> из <picture>."""
+
+    def __init__(self):
+        super().__init__()
+        self.images = []
+        self.sources = []
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'picture':
+            self.sources = []
+        elif tag == 'source':
+            self.sources.append(
+                (attrs.get('type'), parse_srcset(attrs['srcset']))
+            )
+        elif tag == 'img' and attrs.get('class', '').startswith('card-img'):
+            srcset = attrs.get('srcset')
+            self.images.append(
+                {
+                    'src': attrs['src'],
+                    'srcset': parse_srcset(srcset) if srcset else [],
+                    'sources': self.sources,
+                }
+            )
+            self.sources = []
+
+
+class Command(BaseCommand):
+    help = (
+        'Считает байты картинок на страницах главной: одно превью 500x300 '
+        'против адаптивных вариантов'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--pages', type=int, default=3)
+        parser.add_argument(
+            '--viewport',
+            type=int,
+            action='append',
+            help='Ширина экрана в CSS-пикселях; можно несколько раз',
+        )
+        parser.add_argument(
+            '--dpr', type=float, default=2, help='Плотность пикселей экрана'
+        )
+        parser.add_argument(
+            '--no-webp', action='store_true', help='Браузер без WebP'
+        )
+
+    def size(self, url):
+        name = url[len(settings.MEDIA_URL):]
+        try:
+            return default_storage.size(name)
+        except OSError:
+            self.stderr.write(f'Нет файла: {name}')
+            return 0
+
+    def choose(self, image, slot, dpr, webp):
+        """Вариант, который выберет браузер: самый узкий из достаточных."""
+        candidates = image['srcset']
+        for type_, srcset in image['sources']:
+            if webp or type_ != 'image/webp':
+                candidates = srcset
+                break
+        if not candidates:
+            return image['src']
+        wanted = slot * dpr
+        for width, url in candidates:
+            if width >= wanted:
+                return url
+        return candidates[-1][1]
+
+    def handle(self, *args, **options):
+        client = Client()
+        images = []
+        for page in range(1, options['pages'] + 1):
+            response = client.get(reverse('posts:index'), {'page': page})
+            parser = ImagesParser()
+            parser.feed(response.content.decode())
+            images.extend(parser.images)
+        before = sum(self.size(image['src']) for image in images)
+        self.stdout.write(
+            f'Страниц: {options["pages"]}, картинок: {len(images)}, '
+            f'одно превью 500x300: {before} байт'
+        )
+        for viewport in options['viewport'] or (360, 1280):
+            # тот же расчет, что в sizes="(max-width: 540px) 100vw, 500px"
+            slot = viewport if viewport <= 540 else 500
+            after = sum(
+                self.size(
+                    self.choose(
+                        image, slot, options['dpr'], not options['no_webp']
+                    )
+                )
+                for image in images
+            )
+            share = after / before * 100 if before else 0
+            self.stdout.write(
+                f'Экран {viewport}px @{options["dpr"]}x: {after} байт '
+                f'({share:.0f}% от прежнего), '
+                f'{after // max(options["pages"], 1)} байт на страницу'
+            )
@@ -0,0 +1,103 @@
+import os
+import statistics
+import tempfile
+import threading
+import time
+
+from core import writer
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import (
+    override_settings,
+    setup_databases,
+    teardown_databases,
+)
+from posts.models import Comment, Post
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = (
+        'Задержки записи комментариев из N параллельных клиентов: каждый '
+        'поток пишет сам или через поток-писатель core.writer'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=16)
+        parser.add_argument(
+            '--writes', type=int, default=100, help='Записей на клиента'
+        )
+
+    def client(self, post, author, writes, write, latencies, errors):
+        def add_comment():
+            return Comment.objects.create(
+                post=post, author=author, text='Комментарий'
+            )
+
+        for _ in range(writes):
+            started = time.perf_counter()
+            try:
+                write(add_comment)
+            except Exception as error:
+                errors.append(repr(error))
+                continue
+            latencies.append(time.perf_counter() - started)
+        connection.close()
+
+    def run(self, title, write, options):
+        author = User.objects.create_user(username=f'bench-{time.time_ns()}')
+        post = Post.objects.create(author=author, text='Пост')
+        latencies, errors = [], []
+        threads = [
+            threading.Thread(
+                target=self.client,
+                args=(
+                    post,
+                    author,
+                    options['writes'],
+                    write,
+                    latencies,
+                    errors,
+                ),
+            )
+            for _ in range(options['clients'])
+        ]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        percentiles = statistics.quantiles(latencies, n=100)
+        self.stdout.write(
+            f'{title}: {len(latencies) / elapsed:.0f} записей/с, '
+            f'p50 {percentiles[49] * 1000:.1f} мс, '
+            f'p99 {percentiles[98] * 1000:.1f} мс, '
+            f'max {max(latencies) * 1000:.1f} мс, ошибок {len(errors)}'
+        )
+
+    def handle(self, *args, **options):
+        def direct(func):
+            with transaction.atomic():
+                return func()
+
+        with tempfile.TemporaryDirectory() as directory:
+            # отдельная база в файле: в общей памяти SQLite блокирует
+            # таблицы, а не файл, и картина была бы другой
+            connection.settings_dict['TEST']['NAME'] = os.path.join(
+                directory, 'benchmark.sqlite3'
+            )
+            old_config = setup_databases(verbosity=0, interactive=False)
+            try:
+                self.stdout.write(
+                    f'Клиентов: {options["clients"]}, '
+                    f'по {options["writes"]} записей'
+                )
+                self.run('Каждый поток пишет сам', direct, options)
+                with override_settings(SQLITE_WRITE_QUEUE=True):
+                    self.run('Через поток-писатель', writer.write, options)
+            finally:
+                connection.close()
+                teardown_databases(old_config, verbosity=0)
@@ -0,0 +1,255 @@
+import os
+import posixpath
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand
+from posts import blobs
+from posts.models import ImageBlob, Post
+from sorl.thumbnail import default
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix, del_prefix
+
+
+class Throttle:
+    """Не больше rate обращений к диску в секунду; 0 — без ограничения."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self.next_at = time.monotonic()
+
+    def __call__(self):
+        if not self.interval:
+            return
+        now = time.monotonic()
+        if self.next_at > now:
+            time.sleep(self.next_at - now)
+        self.next_at = max(self.next_at, now) + self.interval
+
+
+def chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = (
+        'Удаляет картинки, на которые не ссылается ни один пост, их превью '
+        'и устаревшие записи kvstore sorl-thumbnail'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, что будет удалено',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Сколько имен проверять одним запросом',
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=200,
+            help='Обращений к диску в секунду; 0 — без ограничения',
+        )
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=3600,
+            help='Не трогать файлы моложе стольких секунд',
+        )
+
+    def scan(self, storage, directory):
+        """Файлы каталога хранилища и его подкаталогов: (имя, stat).
+
+        os.scandir отдает записи по одной, так что дерево любого размера
+        не собирается в память целиком.
+        """
+        self.throttle()
+        try:
+            entries = os.scandir(storage.path(directory))
+        except FileNotFoundError:
+            return
+        with entries:
+            for entry in entries:
+                name = posixpath.join(directory, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    yield from self.scan(storage, name)
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    if stat.st_mtime < self.deadline:
+                        yield name, stat
+
+    def used_images(self, names):
+        """Имена из names, на которые ссылаются посты."""
+        used = set(
+            Post.objects.with_archive()
+            .filter(image__in=names)
+            .values_list('image', flat=True)
+        )
+        used.update(
+            ImageBlob.objects.filter(name__in=names).values_list(
+                'name', flat=True
+            )
+        )
+        return used
+
+    def report(self, kind, name):
+        if self.dry_run or self.verbosity > 1:
+            self.stdout.write(f'{kind}: {name}')
+
+    def collect_originals(self, storage, directory):
+        """Удаляет исходники без постов вместе с их превью."""
+        deleted = freed = 0
+        for batch in chunks(self.scan(storage, directory), self.batch_size):
+            used = self.used_images([name for name, stat in batch])
+            for name, stat in batch:
+                if name in used:
+                    continue
+                self.report('Картинка', name)
+                deleted += 1
+                freed += stat.st_size
+                if self.dry_run:
+                    continue
+                # пост мог сослаться на тот же файл, пока шла проверка
+                if Post.objects.with_archive().filter(image=name).exists():
+                    continue
+                self.throttle()
+                blobs.delete_file(name)
+        return deleted, freed
+
+    def entries(self, identity):
+        """Записи kvstore одного вида пачками: [(ключ, значение)].
+
+        Ходит через методы kvstore, так что работает с любым бэкендом
+        из THUMBNAIL_KVSTORE.
+        """
+        kvstore = default.kvstore
+        keys = kvstore._find_keys_raw(add_prefix('', identity))
+        for batch in chunks(keys, self.batch_size):
+            yield [
+                (key, value)
+                for key, value in zip(batch, map(kvstore._get_raw, batch))
+                if value is not None
+            ]
+
+    def known_keys(self, keys):
+        """Ключи, которые есть в kvstore."""
+        return {key for key in keys if default.kvstore._get_raw(key)}
+
+    def collect_entries(self):
+        """Удаляет записи kvstore о пропавших и никому не нужных файлах."""
+        deleted = 0
+        for batch in self.entries('image'):
+            files = [deserialize_image_file(value) for key, value in batch]
+            used = self.used_images(
+                [
+                    image_file.name
+                    for image_file in files
+                    if not self.is_thumbnail(image_file.name)
+                ]
+            )
+            for image_file in files:
+                if self.is_thumbnail(image_file.name) or (
+                    image_file.name in used
+                ):
+                    self.throttle()
+                    if image_file.exists():
+                        continue
+                self.report('Запись kvstore', image_file.name)
+                deleted += 1
+                if not self.dry_run:
+                    # вместе с записью уходят превью исходника
+                    default.kvstore.delete(image_file)
+        for batch in self.entries('thumbnails'):
+            sources = {
+                add_prefix(del_prefix(key)): key for key, value in batch
+            }
+            known = self.known_keys(sources)
+            for source, key in sources.items():
+                if source in known:
+                    continue
+                self.report('Список превью', del_prefix(key))
+                deleted += 1
+                if not self.dry_run:
+                    default.kvstore._delete_raw(key)
+        return deleted
+
+    def collect_thumbnails(self):
+        """Удаляет файлы превью, о которых не знает kvstore."""
+        deleted = freed = 0
+        storage = default.storage
+        files = self.scan(storage, thumbnail_settings.THUMBNAIL_PREFIX)
+        for batch in chunks(files, self.batch_size):
+            keys = {
+                add_prefix(ImageFile(name, storage).key): (name, stat)
+                for name, stat in batch
+            }
+            known = self.known_keys(keys)
+            for key, (name, stat) in keys.items():
+                if key in known:
+                    continue
+                self.report('Превью', name)
+                deleted += 1
+                freed += stat.st_size
+                if not self.dry_run:
+                    self.throttle()
+                    storage.delete(name)
+        return deleted, freed
+
+    def is_thumbnail(self, name):
+        return name.startswith(thumbnail_settings.THUMBNAIL_PREFIX)
+
+    def prune_directories(self, storage, directory):
+        """Удаляет давно опустевшие каталоги шардов.
+
+        В свежий каталог загрузка может как раз класть файл, поэтому
+        опустевшие в этом запуске каталоги уберет следующий.
+        """
+        root = storage.path(directory)
+        for path, dirs, files in os.walk(root, topdown=False):
+            if path == root or files or dirs and os.listdir(path):
+                continue
+            self.throttle()
+            try:
+                if os.stat(path).st_mtime < self.deadline:
+                    os.rmdir(path)
+            except OSError:
+                continue
+
+    def handle(self, *args, **options):
+        self.dry_run = options['dry_run']
+        self.batch_size = options['batch_size']
+        self.verbosity = options['verbosity']
+        self.throttle = Throttle(options['rate'])
+        self.deadline = time.time() - options['min_age']
+        field = Post._meta.get_field('image')
+        storage = field.storage
+        directory = field.upload_to.rstrip('/')
+        started = time.monotonic()
+        images, images_bytes = self.collect_originals(storage, directory)
+        entries = self.collect_entries()
+        thumbnails, thumbnails_bytes = self.collect_thumbnails()
+        if not self.dry_run:
+            self.prune_directories(storage, directory)
+            self.prune_directories(
+                default.storage, thumbnail_settings.THUMBNAIL_PREFIX
+            )
+        verb = 'Будет удалено' if self.dry_run else 'Удалено'
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'{verb} картинок: {images}, превью: {thumbnails}, '
+                f'записей kvstore: {entries}; '
+                f'{images_bytes + thumbnails_bytes} байт '
+                f'за {time.monotonic() - started:.1f} с'
+            )
+        )
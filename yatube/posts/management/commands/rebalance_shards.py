@@ -0,0 +1,238 @@
+import time
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from posts import shards
+from posts.management.commands.collect_media_garbage import chunks
+from posts.models import AuthorShard, Comment, FeedEntry, Post, PostId
+
+User = get_user_model()
+
+POST_TABLE = Post._meta.db_table
+COMMENT_TABLE = Comment._meta.db_table
+FEED_TABLE = FeedEntry._meta.db_table
+POST_COLUMNS = [field.column for field in Post._meta.concrete_fields]
+# у комментария нет сквозного id: в новом шарде он получает свой, а
+# совпадение ищется по остальным полям
+COMMENT_COLUMNS = [
+    field.column
+    for field in Comment._meta.concrete_fields
+    if not field.primary_key
+]
+
+
+def placeholders(columns):
+    return ', '.join(['%s'] * len(columns))
+
+
+class Command(BaseCommand):
+    help = (
+        'Переносит авторов между шардами постов, не останавливая запись. '
+        'По умолчанию каждый автор едет в шард, который ему дает '
+        'posts.shards.choose'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--author',
+            action='append',
+            dest='authors',
+            help='Перенести только этого автора; можно повторять',
+        )
+        parser.add_argument('--to', help='Шард для авторов из --author')
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать, кто куда поедет',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Сколько авторов переносить за один заход',
+        )
+        parser.add_argument(
+            '--settle',
+            type=float,
+            default=5,
+            help=(
+                'Сколько секунд после переключения ждать записей, '
+                'которые успели уйти в старый шард'
+            ),
+        )
+
+    def rows(self, database, sql, params):
+        with connections[database].cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def snapshot(self, database, author_id):
+        """Посты автора по id и мультимножество комментариев к ним."""
+        posts = self.rows(
+            database,
+            f'SELECT {", ".join(POST_COLUMNS)} FROM {POST_TABLE} '
+            f'WHERE author_id = %s',
+            [author_id],
+        )
+        comments = self.rows(
+            database,
+            f'SELECT {", ".join(f"c.{c}" for c in COMMENT_COLUMNS)} '
+            f'FROM {COMMENT_TABLE} c JOIN {POST_TABLE} p '
+            f'ON p.id = c.post_id WHERE p.author_id = %s',
+            [author_id],
+        )
+        return {row[0]: row for row in posts}, Counter(comments)
+
+    def apply(self, database, base, current):
+        """Переносит в database разницу между снимками base и current."""
+        base_posts, base_comments = base
+        posts, comments = current
+        stale = [pk for pk, row in base_posts.items() if posts.get(pk) != row]
+        fresh = [row for pk, row in posts.items() if base_posts.get(pk) != row]
+        matches = ' AND '.join(f'{column} = %s' for column in COMMENT_COLUMNS)
+        with transaction.atomic(database), connections[
+            database
+        ].cursor() as cursor:
+            cursor.executemany(
+                f'DELETE FROM {COMMENT_TABLE} WHERE id = ('
+                f'SELECT id FROM {COMMENT_TABLE} WHERE {matches} LIMIT 1)',
+                list((base_comments - comments).elements()),
+            )
+            cursor.executemany(
+                f'DELETE FROM {POST_TABLE} WHERE id = %s',
+                [(pk,) for pk in stale],
+            )
+            cursor.executemany(
+                f'INSERT INTO {POST_TABLE} ({", ".join(POST_COLUMNS)}) '
+                f'VALUES ({placeholders(POST_COLUMNS)})',
+                fresh,
+            )
+            cursor.executemany(
+                f'INSERT INTO {COMMENT_TABLE} ({", ".join(COMMENT_COLUMNS)}) '
+                f'VALUES ({placeholders(COMMENT_COLUMNS)})',
+                list((comments - base_comments).elements()),
+            )
+
+    def register(self):
+        """Заводит PostId постам, у которых его нет."""
+        # архивные id тоже заняты: новые посты не должны их повторить
+        for database in shards.post_databases():
+            posts = (
+                Post.objects.using(database)
+                .order_by('pk')
+                .values_list('pk', 'author_id')
+            )
+            for batch in chunks(posts.iterator(), 1000):
+                PostId.objects.bulk_create(
+                    [PostId(pk=pk, author_id=author) for pk, author in batch],
+                    ignore_conflicts=True,
+                )
+
+    def plan(self, usernames, target):
+        """(id, имя, откуда, куда) для авторов, которых надо переселить."""
+        users = User.objects.order_by('pk')
+        if usernames:
+            users = users.filter(username__in=usernames)
+            unknown = set(usernames) - set(
+                users.values_list('username', flat=True)
+            )
+            if unknown:
+                raise CommandError(f'Нет авторов: {", ".join(unknown)}')
+        placed = dict(AuthorShard.objects.values_list('author_id', 'database'))
+        first = shards.databases()[0]
+        for author_id, username in users.values_list('pk', 'username'):
+            source = placed.get(author_id, first)
+            destination = target or shards.choose(author_id)
+            if source != destination or author_id not in placed:
+                yield author_id, username, source, destination
+
+    def switch(self, author_id, source, target):
+        """Копирует автора в target и переключает на него запись.
+
+        Основная копия снимается без блокировок. Потом source
+        блокируется на запись (BEGIN IMMEDIATE), догоняются изменения,
+        сделанные за время копирования, и меняется AuthorShard.
+        Возвращает снимок, с которого target совпадает с source.
+        """
+        copied = self.snapshot(source, author_id)
+        self.apply(target, self.snapshot(target, author_id), copied)
+        with transaction.atomic(source):
+            current = self.snapshot(source, author_id)
+            self.apply(target, copied, current)
+            AuthorShard.objects.update_or_create(
+                author_id=author_id, defaults={'database': target}
+            )
+        return current
+
+    def drain(self, author_id, source, target, switched):
+        """Доносит в target записи, ушедшие в source после переключения,
+        и удаляет автора из source."""
+        with transaction.atomic(source), connections[
+            source
+        ].cursor() as cursor:
+            self.apply(target, switched, self.snapshot(source, author_id))
+            posts = f'SELECT id FROM {POST_TABLE} WHERE author_id = %s'
+            for table in (COMMENT_TABLE, FEED_TABLE):
+                cursor.execute(
+                    f'DELETE FROM {table} WHERE post_id IN ({posts})',
+                    [author_id],
+                )
+            cursor.execute(
+                f'DELETE FROM {POST_TABLE} WHERE author_id = %s', [author_id]
+            )
+
+    def move(self, batch, settle):
+        """Переносит пачку авторов; возвращает (постов, комментариев)."""
+        switched = {}
+        for author_id, username, source, target in batch:
+            if source == target:
+                AuthorShard.objects.update_or_create(
+                    author_id=author_id, defaults={'database': target}
+                )
+                continue
+            switched[author_id] = self.switch(author_id, source, target)
+            if self.verbosity > 1:
+                self.stdout.write(f'{username}: {source} -> {target}')
+        if not switched:
+            return 0, 0
+        # запросы, выбравшие шард до переключения, еще могут писать в source
+        time.sleep(settle)
+        posts = comments = 0
+        for author_id, username, source, target in batch:
+            if author_id in switched:
+                self.drain(author_id, source, target, switched[author_id])
+                posts += len(switched[author_id][0])
+                comments += sum(switched[author_id][1].values())
+        return posts, comments
+
+    def handle(self, *args, **options):
+        if not shards.is_enabled():
+            raise CommandError('Шардирование выключено: POST_SHARDS пуст')
+        target = options['to']
+        if target and target not in shards.databases():
+            raise CommandError(f'{target} нет в POST_SHARDS')
+        if target and not options['authors']:
+            raise CommandError('--to работает только вместе с --author')
+        self.verbosity = options['verbosity']
+        started = time.monotonic()
+        self.register()
+        plan = self.plan(options['authors'], target)
+        if options['dry_run']:
+            for author_id, username, source, destination in plan:
+                self.stdout.write(f'{username}: {source} -> {destination}')
+            return
+        authors = posts = comments = 0
+        for batch in chunks(plan, options['batch_size']):
+            moved = self.move(batch, options['settle'])
+            authors += len(batch)
+            posts += moved[0]
+            comments += moved[1]
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Размещено авторов: {authors}, перенесено постов: {posts}, '
+                f'комментариев: {comments} '
+                f'за {time.monotonic() - started:.1f} с'
+            )
+        )
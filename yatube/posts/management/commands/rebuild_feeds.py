@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from posts import feed
+from posts.models import FeedEntry, Follow
+
+
+class Command(BaseCommand):
+    help = 'Пересобирает материализованные ленты подписок'
+
+    def handle(self, *args, **options):
+        user_ids = (
+            Follow.objects.order_by('user_id')
+            .values_list('user_id', flat=True)
+            .distinct()
+        )
+        rebuilt = 0
+        for user_id in user_ids.iterator():
+            author_ids = Follow.objects.filter(user_id=user_id).values_list(
+                'author_id', flat=True
+            )
+            # лента пользователя подменяется целиком в одной транзакции
+            with transaction.atomic():
+                FeedEntry.objects.filter(user_id=user_id).delete()
+                for author_id in author_ids:
+                    feed.backfill(user_id, author_id)
+            rebuilt += 1
+        self.stdout.write(self.style.SUCCESS(f'Пересобрано лент: {rebuilt}'))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from posts import search, shards
+
+
+class Command(BaseCommand):
+    help = 'Переиндексирует посты для полнотекстового поиска'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Сколько постов индексировать в одной транзакции',
+        )
+
+    def handle(self, *args, **options):
+        if not search.is_supported():
+            raise CommandError('Полнотекстовый индекс есть только в SQLite')
+        indexed = 0
+        for database in shards.post_databases():
+            search.install(connections[database])
+            indexed += search.rebuild(
+                batch_size=options['batch_size'], using=connections[database]
+            )
+        self.stdout.write(
+            self.style.SUCCESS(f'Проиндексировано постов: {indexed}')
+        )
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from posts import counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счетчики постов, комментариев и подписок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Сколько строк обновлять за один запрос',
+        )
+
+    def handle(self, *args, **options):
+        drifted = counters.reconcile(batch_size=options['batch_size'])
+        self.stdout.write(
+            self.style.SUCCESS(f'Исправлено счетчиков: {drifted}')
+        )
@@ -0,0 +1,81 @@
+import os
+
+from core.storage import file_hash, is_sharded, shard_name
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from posts import blobs
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Переносит картинки постов в каталоги по хешу содержимого'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Сколько постов переносить за одну транзакцию',
+        )
+
+    def move(self, storage, post):
+        """Переносит файл поста и возвращает новое имя или None.
+
+        Повторный запуск после сбоя безопасен: если файл уже перенесен,
+        а база еще нет, новое имя находится по сохраненному хешу.
+        """
+        old_name = post.image.name
+        content_hash = post.image_hash
+        if not content_hash:
+            if not storage.exists(old_name):
+                return None
+            with storage.open(old_name) as file:
+                content_hash = file_hash(file)
+        new_name = shard_name(old_name, content_hash)
+        if storage.exists(old_name):
+            os.makedirs(os.path.dirname(storage.path(new_name)), exist_ok=True)
+            os.replace(storage.path(old_name), storage.path(new_name))
+        elif not storage.exists(new_name):
+            return None
+        return new_name
+
+    def handle(self, *args, **options):
+        storage = Post._meta.get_field('image').storage
+        posts = Post.objects.exclude(image='').only(
+            'pk', 'image', 'image_hash'
+        )
+        last_id = moved = missing = 0
+        while True:
+            batch = list(
+                posts.filter(pk__gt=last_id).order_by('pk')[
+                    : options['batch_size']
+                ]
+            )
+            if not batch:
+                break
+            last_id = batch[-1].pk
+            changed = []
+            for post in batch:
+                if is_sharded(post.image.name):
+                    continue
+                new_name = self.move(storage, post)
+                if new_name is None:
+                    missing += 1
+                    continue
+                changed.append((post, post.image.name))
+                post.image.name = new_name
+            with transaction.atomic():
+                Post.objects.bulk_update(
+                    [post for post, old_name in changed], ['image']
+                )
+                # bulk_update не шлет сигналов, ссылки переносим сами
+                for post, old_name in changed:
+                    blobs.release(old_name)
+                    blobs.acquire(post.image.name)
+            moved += len(changed)
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Перенесено картинок: {moved}, файлов не найдено: {missing}. '
+                'Превью для новых путей нарежет warm_thumbnails.'
+            )
+        )
@@ -0,0 +1,119 @@
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from posts import thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Заранее нарезает превью для всех картинок постов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=os.cpu_count(),
+            help='Сколько процессов режут превью; 1 — без пула',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=100,
+            help='Сколько картинок отдавать процессу за раз',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            default=os.path.join(settings.BASE_DIR, 'warm_thumbnails.ckpt'),
+            help='Файл с id последнего обработанного поста',
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Начать с первого поста, не глядя на checkpoint',
+        )
+
+    def read_checkpoint(self, path):
+        try:
+            with open(path) as checkpoint:
+                return int(checkpoint.read())
+        except (OSError, ValueError):
+            return 0
+
+    def write_checkpoint(self, path, last_id):
+        # запись через временный файл, чтобы не оставить его обрезанным
+        with open(f'{path}.tmp', 'w') as checkpoint:
+            checkpoint.write(str(last_id))
+        os.replace(f'{path}.tmp', path)
+
+    def batches(self, start, batch_size):
+        # каждая пачка — отдельный короткий запрос по ключу: открытый
+        # курсор держал бы блокировку SQLite, и воркеры не смогли бы писать
+        images = Post.objects.exclude(image='').order_by('pk')
+        while True:
+            batch = list(
+                images.filter(pk__gt=start).values_list(
+                    'pk', 'image', 'image_width'
+                )[:batch_size]
+            )
+            if not batch:
+                return
+            start = batch[-1][0]
+            yield start, [(name, width) for pk, name, width in batch]
+
+    def results(self, batches, processes):
+        """Результаты пачек в порядке id, не больше 2 пачек на процесс."""
+        if processes <= 1:
+            for last_id, images in batches:
+                yield last_id, len(images), thumbnails.render_batch(images)
+            return
+        # spawn, а не fork: воркер сам настраивает Django и открывает
+        # свои соединения вместо унаследованных
+        with ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=get_context('spawn'),
+            initializer=thumbnails.init_worker,
+        ) as pool:
+            pending = deque()
+            for last_id, images in batches:
+                future = pool.submit(thumbnails.render_batch, images)
+                pending.append((last_id, len(images), future))
+                if len(pending) >= processes * 2:
+                    last_id, size, future = pending.popleft()
+                    yield last_id, size, future.result()
+            while pending:
+                last_id, size, future = pending.popleft()
+                yield last_id, size, future.result()
+
+    def handle(self, *args, **options):
+        path = options['checkpoint']
+        start = 0 if options['restart'] else self.read_checkpoint(path)
+        if start:
+            self.stdout.write(f'Продолжаем с поста id > {start}')
+        started = time.monotonic()
+        done = failed = 0
+        batches = self.batches(start, options['batch_size'])
+        for last_id, size, batch_failed in self.results(
+            batches, options['processes']
+        ):
+            done += size
+            failed += batch_failed
+            self.write_checkpoint(path, last_id)
+            elapsed = time.monotonic() - started
+            self.stdout.write(
+                f'id <= {last_id}: {done} картинок, '
+                f'{done / elapsed:.1f} в секунду'
+            )
+        if os.path.exists(path):
+            os.remove(path)
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f'Нарезано картинок: {done - failed}, ошибок: {failed}, '
+                f'за {elapsed:.1f} с'
+            )
+        )
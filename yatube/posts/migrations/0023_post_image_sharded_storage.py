@@ -0,0 +1,19 @@
+# Generated by Django 2.2.16 on 2026-10-17 06:54
+
+import core.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0022_post_image_metadata'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=core.storage.HashShardedStorage(), upload_to='posts/', verbose_name='Изображение'),
+        ),
+    ]
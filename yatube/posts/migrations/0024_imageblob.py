@@ -0,0 +1,39 @@
+# Generated by Django 2.2.16 on 2026-10-17 06:57
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_blobs(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    ImageBlob = apps.get_model('posts', 'ImageBlob')
+    refs = (
+        Post.objects.exclude(image='')
+        .exclude(image__isnull=True)
+        .order_by()
+        .values('image')
+        .annotate(refcount=Count('pk'))
+    )
+    ImageBlob.objects.bulk_create(
+        [ImageBlob(name=ref['image'], refcount=ref['refcount']) for ref in refs],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0023_post_image_sharded_storage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True, verbose_name='Путь в хранилище')),
+                ('refcount', models.PositiveIntegerField(default=0, verbose_name='Число ссылок')),
+            ],
+        ),
+        migrations.RunPython(fill_blobs, migrations.RunPython.noop),
+    ]
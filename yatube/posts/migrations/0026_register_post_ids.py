@@ -0,0 +1,48 @@
+from django.db import DEFAULT_DB_ALIAS, migrations
+
+
+def register_posts(apps, schema_editor):
+    # каталог id читается только из default
+    database = schema_editor.connection.alias
+    if database != DEFAULT_DB_ALIAS:
+        return
+    Post = apps.get_model('posts', 'Post')
+    PostId = apps.get_model('posts', 'PostId')
+    posts = Post.objects.using(database).order_by('pk').values_list(
+        'pk', 'author_id'
+    )
+    PostId.objects.using(database).bulk_create(
+        [PostId(pk=pk, author_id=author) for pk, author in posts.iterator()],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    # id удаленных постов тоже не выдаются заново
+    tables = [Post._meta.db_table, PostId._meta.db_table]
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT MAX(seq) FROM sqlite_sequence WHERE name IN (%s, %s)',
+            tables,
+        )
+        (seq,) = cursor.fetchone()
+        if seq is None:
+            return
+        cursor.execute(
+            'DELETE FROM sqlite_sequence WHERE name = %s', tables[1:]
+        )
+        cursor.execute(
+            'INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)',
+            [tables[1], seq],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0025_sharding'),
+    ]
+
+    operations = [
+        migrations.RunPython(register_posts, migrations.RunPython.noop),
+    ]
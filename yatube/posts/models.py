@@ -1,10 +1,57 @@
 from core.models import CreatedModel
+from core.storage import HashShardedStorage
 from django.contrib.auth import get_user_model
 from django.db import models
 
+from . import archive, shards
+
 User = get_user_model()
 
 
+class ShardedManager(models.Manager):
+    """Менеджер постов и комментариев, которые живут в шардах."""
+
+    def spread(self, authors=None, posts=None):
+        """Запрос к шардам с постами авторов authors или с постами из
+        posts (вместе с их комментариями); без подсказок — ко всем шардам.
+
+        Без шардирования возвращает обычный queryset.
+        """
+        queryset = self.get_queryset()
+        if archive.contains(getattr(self, 'instance', None)):
+            # комментарии архивного поста лежат в архиве вместе с ним
+            return shards.spread(queryset, [archive.database()])
+        if not shards.is_enabled():
+            return queryset
+        return shards.spread(
+            queryset, AuthorShard.objects.databases_for(authors, posts)
+        )
+
+    def with_archive(self, authors=None, posts=None):
+        """spread(), а за ним те же записи из архива (posts.archive)."""
+        return archive.chain_archive(
+            self.spread(authors, posts), self.get_queryset()
+        )
+
+    def create(self, **kwargs):
+        # QuerySet.create выбирает базу без объекта, и роутер не знает
+        # автора; save() отдает роутеру сам объект
+        if not shards.is_enabled() or self._db is not None:
+            return super().create(**kwargs)
+        obj = self.model(**kwargs)
+        obj.save(force_insert=True)
+        return obj
+
+
+class PostManager(ShardedManager):
+    def bulk_create(self, objs, *args, **kwargs):
+        # pre_save здесь не срабатывает, так что id выдает сам менеджер:
+        # иначе счетчик PostId отстанет от постов
+        objs = list(objs)
+        PostId.objects.allocate(objs)
+        return super().bulk_create(objs, *args, **kwargs)
+
+
 class Group(models.Model):
     title = models.CharField(
         max_length=200,
@@ -17,6 +64,9 @@ class Group(models.Model):
     description = models.TextField(
         verbose_name='Описание сообщества',
     )
+    posts_count = models.PositiveIntegerField(
+        'Число постов', default=0, editable=False
+    )
 
     def __str__(self) -> str:
         return self.title
@@ -42,10 +92,45 @@ class Post(CreatedModel):
         verbose_name='Автор',
     )
 
+    objects = PostManager()
+
     image = models.ImageField(
-        'Изображение', upload_to='posts/', blank=True, null=True
+        'Изображение',
+        upload_to='posts/',
+        storage=HashShardedStorage(),
+        blank=True,
+        null=True,
+    )
+    # заполняются при загрузке картинки, чтобы не читать файл при выводе
+    image_width = models.PositiveIntegerField(
+        'Ширина изображения', blank=True, null=True, editable=False
+    )
+    image_height = models.PositiveIntegerField(
+        'Высота изображения', blank=True, null=True, editable=False
+    )
+    image_hash = models.CharField(
+        'SHA-256 изображения', max_length=64, blank=True, editable=False
+    )
+    image_size = models.PositiveIntegerField(
+        'Размер изображения в байтах', blank=True, null=True, editable=False
+    )
+    comments_count = models.PositiveIntegerField(
+        'Число комментариев', default=0, editable=False
     )
 
+    class Meta(CreatedModel.Meta):
+        # Индексы по возрастанию: SQLite читает их с конца, и порядок
+        # (pub_date, rowid) совпадает с ORDER BY pub_date DESC, id DESC.
+        indexes = [
+            models.Index(fields=['pub_date'], name='post_pub_date_idx'),
+            models.Index(
+                fields=['author', 'pub_date'], name='post_author_pub_date_idx'
+            ),
+            models.Index(
+                fields=['group', 'pub_date'], name='post_group_pub_date_idx'
+            ),
+        ]
+
     def __str__(self):
         return f'{self.text[:15]}'
 
@@ -67,6 +152,15 @@ class Comment(CreatedModel):
         verbose_name='Текст', help_text='Введите текст комментария'
     )
 
+    objects = ShardedManager()
+
+    class Meta(CreatedModel.Meta):
+        indexes = [
+            models.Index(
+                fields=['post', 'pub_date'], name='comment_post_pub_date_idx'
+            ),
+        ]
+
     def __str__(self):
         return f'{self.text[:15]}'
 
@@ -88,3 +182,167 @@ class Follow(models.Model):
 
     class Meta:
         unique_together = ('user', 'author')
+        indexes = [
+            # раскладка ленты читает подписчиков автора только из индекса
+            models.Index(
+                fields=['author', 'user'], name='follow_author_user_idx'
+            ),
+        ]
+
+
+class UserStats(models.Model):
+    """Денормализованные счетчики пользователя.
+
+    Поддерживаются сигналами posts.signals, расхождения исправляет
+    команда reconcile_counters.
+    """
+
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats',
+        verbose_name='Пользователь',
+    )
+    posts_count = models.PositiveIntegerField('Число постов', default=0)
+    followers_count = models.PositiveIntegerField(
+        'Число подписчиков', default=0
+    )
+    following_count = models.PositiveIntegerField('Число подписок', default=0)
+
+    def __str__(self):
+        return f'{self.user}'
+
+
+class FeedEntry(models.Model):
+    """Пост в материализованной ленте подписчика.
+
+    Заполняется при публикации поста (fan-out on write) и при подписке,
+    чистится при отписке. Дата публикации продублирована, чтобы лента
+    читалась по индексу без обращения к таблице постов.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed',
+        verbose_name='Подписчик',
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Пост',
+    )
+    pub_date = models.DateTimeField('Дата публикации поста')
+
+    class Meta:
+        unique_together = ('user', 'post')
+        indexes = [
+            # страница ленты читается целиком из индекса, от новых к старым
+            models.Index(
+                fields=['user', 'pub_date', 'post'],
+                name='feed_user_pub_date_post_idx',
+            ),
+        ]
+
+
+class ImageBlob(models.Model):
+    """Файл картинки в хранилище и число постов, которые на него ссылаются.
+
+    Одинаковые загрузки ложатся в один файл, поэтому файл и его превью
+    удаляются только вместе с последним ссылающимся постом.
+    """
+
+    name = models.CharField('Путь в хранилище', max_length=100, unique=True)
+    refcount = models.PositiveIntegerField('Число ссылок', default=0)
+
+    def __str__(self):
+        return self.name
+
+
+class AuthorShardManager(models.Manager):
+    def database_for(self, author_id):
+        """Шард, в котором лежат посты автора."""
+        database = (
+            self.filter(author_id=author_id)
+            .values_list('database', flat=True)
+            .first()
+        )
+        return database or shards.databases()[0]
+
+    def databases_for(self, authors=None, posts=None):
+        """Шарды с постами авторов authors и постами с id из posts."""
+        if authors is None and posts is None:
+            return shards.databases()
+        author_ids = set(authors or ())
+        posts = set(posts or ())
+        found = dict(
+            PostId.objects.filter(pk__in=posts).values_list('pk', 'author_id')
+        )
+        author_ids.update(found.values())
+        placed = dict(
+            self.filter(author_id__in=author_ids).values_list(
+                'author_id', 'database'
+            )
+        )
+        databases = set(placed.values())
+        if len(placed) < len(author_ids) or len(found) < len(posts):
+            # автор без записи или пост из времен до шардирования
+            databases.add(shards.databases()[0])
+        return sorted(databases)
+
+
+class AuthorShard(models.Model):
+    """Шард, в котором лежат посты и комментарии к ним (posts.shards)."""
+
+    author = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='shard',
+        verbose_name='Автор',
+    )
+    database = models.CharField('База данных', max_length=100)
+
+    objects = AuthorShardManager()
+
+    def __str__(self):
+        return f'{self.author_id}: {self.database}'
+
+
+class PostIdManager(models.Manager):
+    def allocate(self, posts):
+        """Выдает id постам без него, а заданные вручную (loaddata,
+        bulk_create) заносит в таблицу, чтобы новые id их не повторили."""
+        self.bulk_create(
+            [
+                self.model(pk=post.pk, author_id=post.author_id)
+                for post in posts
+                if post.pk is not None
+            ],
+            ignore_conflicts=True,
+        )
+        for post in posts:
+            if post.pk is None:
+                post.pk = self.create(author_id=post.author_id).pk
+
+
+class PostId(models.Model):
+    """Сквозной id поста и автор, по которому ищется шард.
+
+    Строка появляется раньше самого поста, так что id не повторяются
+    в разных шардах.
+    """
+
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор',
+    )
+
+    objects = PostIdManager()
+
+    def __str__(self):
+        return f'{self.pk}'
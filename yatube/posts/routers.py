@@ -0,0 +1,89 @@
+from core import routers
+from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from . import archive, shards
+from .models import AuthorShard, Comment, Post, PostId
+
+User = get_user_model()
+
+# Таблицы баз с 'POSTS_ONLY': True (шарды и архив). FeedEntry там пуст,
+# но команды переноса чистят его в каждой базе-источнике
+POST_MODELS = {'post', 'comment', 'feedentry'}
+
+
+class ArchiveRouter:
+    """Записи, связанные с архивным постом, остаются в архиве.
+
+    Комментарии поста из архива, новый комментарий к нему и его
+    сохранение идут в базу POST_ARCHIVE, а не в шард автора.
+    """
+
+    def _archived(self, instance):
+        if isinstance(instance, Comment) and Comment.post.is_cached(instance):
+            instance = instance.post
+        return archive.contains(instance)
+
+    def db_for_read(self, model, **hints):
+        if model in (Post, Comment) and self._archived(hints.get('instance')):
+            return archive.database()
+        return None
+
+    def db_for_write(self, model, **hints):
+        database = self.db_for_read(model, **hints)
+        if database is not None:
+            routers.mark_write()
+        return database
+
+
+class ShardRouter:
+    """Посты и комментарии — в шард автора поста.
+
+    Шард определяется по объекту из подсказки: посту, комментарию или
+    автору (author.posts). Запросы без такой подсказки уходят дальше по
+    цепочке, то есть в default; читать все шарды сразу — через
+    Post.objects.spread(). Каталог шардов читается только из default:
+    реплика может отстать от переноса автора.
+    """
+
+    def _author_id(self, instance):
+        if isinstance(instance, Post):
+            return instance.author_id
+        if isinstance(instance, Comment):
+            if Comment.post.is_cached(instance):
+                return instance.post.author_id
+            return (
+                PostId.objects.filter(pk=instance.post_id)
+                .values_list('author_id', flat=True)
+                .first()
+            )
+        if isinstance(instance, User):
+            return instance.pk
+        return None
+
+    def db_for_read(self, model, **hints):
+        if model in (AuthorShard, PostId):
+            return DEFAULT_DB_ALIAS
+        if not shards.is_enabled() or model not in (Post, Comment):
+            return None
+        author_id = self._author_id(hints.get('instance'))
+        if author_id is None:
+            return None
+        return AuthorShard.objects.database_for(author_id)
+
+    def db_for_write(self, model, **hints):
+        database = self.db_for_read(model, **hints)
+        if database is not None:
+            routers.mark_write()
+        return database
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        """В шарды и архив идут только таблицы постов.
+
+        Миграции данных (RunPython) там не запускаются: они пишут в
+        default; индекс поиска ставит posts.search.install.
+        """
+        if not settings.DATABASES[db].get('POSTS_ONLY'):
+            return None
+        return app_label == 'posts' and model_name in POST_MODELS
@@ -0,0 +1,200 @@
+"""Полнотекстовый поиск по постам на SQLite FTS5.
+
+Индекс posts_post_fts — внешняя таблица FTS5 поверх posts_post, с ней его
+синхронизируют триггеры. SQLite теряет триггеры, когда Django пересоздает
+таблицу в миграциях, поэтому они ставятся заново после каждого migrate.
+На других СУБД поиск откатывается к LIKE. У каждого шарда постов свой
+индекс, результаты шардов сливаются по (rank, rowid).
+"""
+import base64
+import binascii
+import heapq
+import re
+
+from core.utils import CursorPage
+from django.core.paginator import Paginator
+from django.db import connection, connections, transaction
+from django.db.models.expressions import RawSQL
+
+from . import shards
+from .models import Post
+
+FTS_TABLE = 'posts_post_fts'
+# NUL обрывает строку запроса FTS5, остальные управляющие символы тоже
+# нечего искать
+CONTROL_CHARS = re.compile(r'[\x00-\x1f\x7f]')
+
+CREATE_TABLE = (
+    f'CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} '
+    f"USING fts5(text, content='posts_post', content_rowid='id')"
+)
+
+TRIGGERS = (
+    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai '
+    f'AFTER INSERT ON posts_post BEGIN '
+    f'INSERT INTO {FTS_TABLE}(rowid, text) VALUES (new.id, new.text); '
+    f'END',
+    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad '
+    f'AFTER DELETE ON posts_post BEGIN '
+    f'INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text) '
+    f"VALUES ('delete', old.id, old.text); "
+    f'END',
+    f'CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au '
+    f'AFTER UPDATE OF text ON posts_post BEGIN '
+    f'INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text) '
+    f"VALUES ('delete', old.id, old.text); "
+    f'INSERT INTO {FTS_TABLE}(rowid, text) VALUES (new.id, new.text); '
+    f'END',
+)
+
+
+def is_supported(using=connection):
+    return using.vendor == 'sqlite'
+
+
+def install(using=connection):
+    """Создает индекс и триггеры, если их еще нет."""
+    if not is_supported(using):
+        return
+    with using.cursor() as cursor:
+        cursor.execute(CREATE_TABLE)
+        for trigger in TRIGGERS:
+            cursor.execute(trigger)
+
+
+def rebuild(batch_size=1000, using=connection):
+    """Переиндексирует все посты пачками по возрастанию id.
+
+    Каждая пачка пишется в своей транзакции, чтобы не держать
+    блокировку записи на все время переиндексации. Возвращает
+    число проиндексированных постов.
+    """
+    with using.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('delete-all')"
+        )
+    last_id, indexed = 0, 0
+    while True:
+        ids = list(
+            Post.objects.using(using.alias)
+            .filter(pk__gt=last_id)
+            .order_by('pk')
+            .values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            return indexed
+        with transaction.atomic(using.alias), using.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {FTS_TABLE}(rowid, text) '
+                f'SELECT id, text FROM posts_post '
+                f'WHERE id > %s AND id <= %s',
+                [last_id, ids[-1]],
+            )
+        last_id = ids[-1]
+        indexed += len(ids)
+
+
+def match_expression(query):
+    """Превращает пользовательский ввод в запрос FTS5.
+
+    Управляющие символы становятся пробелами. Каждое слово берется в
+    кавычки, чтобы операторы FTS5 в тексте не ломали запрос; слова
+    объединяются через AND.
+    """
+    words = CONTROL_CHARS.sub(' ', query).split()
+    return ' '.join('"{}"'.format(word.replace('"', '""')) for word in words)
+
+
+def filter_posts(queryset, query):
+    """Оставляет в queryset только посты, подходящие под запрос."""
+    expression = match_expression(query)
+    if not expression:
+        return queryset.none()
+    if not is_supported():
+        return queryset.filter(text__icontains=query)
+    matches = RawSQL(
+        f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+        [expression],
+    )
+    return queryset.filter(pk__in=matches)
+
+
+def encode_rank_cursor(post):
+    raw = f'{post.search_rank!r}|{post.pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_rank_cursor(token):
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        rank, pk = raw.decode().split('|')
+        return float(rank), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        return None
+
+
+class SearchPaginator(Paginator):
+    """Листает результаты поиска по ключу (bm25, id) без COUNT и OFFSET."""
+
+    cursor = True
+
+    def __init__(self, query, per_page):
+        super().__init__(Post.objects.none(), per_page)
+        self.query = query
+
+    def _ranked_ids(self, after, using):
+        sql = (
+            f'SELECT rowid, rank FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s'
+        )
+        params = [match_expression(self.query)]
+        if after is not None:
+            sql += ' AND (rank > %s OR (rank = %s AND rowid > %s))'
+            params += [after[0], after[0], after[1]]
+        sql += ' ORDER BY rank, rowid LIMIT %s'
+        params.append(self.per_page + 1)
+        with using.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def _fallback_ids(self, after):
+        posts = filter_posts(Post.objects.all(), self.query)
+        if after is not None:
+            posts = posts.filter(pk__gt=after[1])
+        ids = posts.order_by('pk').values_list('pk', flat=True)
+        return [(pk, 0.0) for pk in ids[: self.per_page + 1]]
+
+    def get_cursor_page(self, after=None):
+        if not match_expression(self.query):
+            return CursorPage([], self, False, False)
+        if is_supported():
+            ranked = [
+                self._ranked_ids(after, connections[database])
+                for database in shards.post_databases()
+            ]
+            rows = list(heapq.merge(*ranked, key=lambda row: row[::-1]))
+            rows = rows[: self.per_page + 1]
+        else:
+            rows = self._fallback_ids(after)
+        has_next = len(rows) > self.per_page
+        rows = rows[: self.per_page]
+        ids = [pk for pk, rank in rows]
+        posts = (
+            Post.objects.with_archive(posts=ids)
+            .select_related('author', 'group')
+            .in_bulk(ids)
+        )
+        results = []
+        for pk, rank in rows:
+            if pk in posts:
+                posts[pk].search_rank = rank
+                results.append(posts[pk])
+        return CursorPage(
+            results,
+            self,
+            has_next,
+            after is not None,
+            encode=encode_rank_cursor,
+        )
@@ -0,0 +1,203 @@
+"""Шардирование постов по авторам.
+
+Посты и комментарии автора лежат в одной из баз POST_SHARDS, какой
+именно — записано в AuthorShard. Авторы без записи живут в первом шарде,
+там, где посты лежали до шардирования. Пользователи, группы, подписки и
+остальные таблицы остаются в default. id постов выдает общая таблица
+PostId, поэтому они не пересекаются между шардами и не меняются, когда
+rebalance_shards переносит автора. PostId выдает id и без шардирования,
+так что после включения POST_SHARDS новые посты не повторяют старые id.
+
+Запросы сразу к нескольким шардам собирает MergedQuerySet: шарды читаются
+параллельно, уже отсортированные ответы сливаются через heapq.merge.
+Без POST_SHARDS чтение идет как раньше, через обычные QuerySet.
+Разовые команды для картинок (backfill_image_metadata, shard_post_images,
+warm_thumbnails) обходят только default: их запускают до шардирования.
+"""
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain, islice
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
+from django.db.models import Model, prefetch_related_objects
+
+_executor = None
+
+
+def databases():
+    return list(settings.POST_SHARDS)
+
+
+def is_enabled():
+    return bool(settings.POST_SHARDS)
+
+
+def post_databases():
+    """Базы, в которых лежат посты: шарды или одна default, и архив."""
+    post_databases = databases() or [DEFAULT_DB_ALIAS]
+    if settings.POST_ARCHIVE:
+        post_databases.append(settings.POST_ARCHIVE)
+    return post_databases
+
+
+def choose(author_id):
+    """Шард, в который автор попадает по умолчанию."""
+    shards = databases()
+    return shards[author_id % len(shards)]
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.POST_SHARD_THREADS,
+            thread_name_prefix='post-shards',
+        )
+    return _executor
+
+
+def _call(function, queryset):
+    close_old_connections()
+    return function(queryset)
+
+
+def fetch(querysets, function=list):
+    """function(queryset) для каждого запроса, по возможности параллельно.
+
+    Внутри транзакции другие потоки не видят ее изменений, поэтому тогда
+    шарды читаются по очереди в текущем потоке.
+    """
+    if len(querysets) < 2 or any(
+        connections[queryset.db].in_atomic_block for queryset in querysets
+    ):
+        return [function(queryset) for queryset in querysets]
+    executor = get_executor()
+    futures = [
+        executor.submit(_call, function, queryset) for queryset in querysets
+    ]
+    return [future.result() for future in futures]
+
+
+class MergedQuerySet:
+    """Один и тот же запрос к нескольким шардам.
+
+    Умеет то, что нужно представлениям и пагинаторам. Строки шардов
+    сливаются в порядке order_by (все поля — в одном направлении), а
+    select_related превращается в prefetch_related_objects по уже
+    слитой странице: пользователи и группы лежат в default. Глубокие
+    номерные страницы дороги — каждый шард отдает все строки до конца
+    страницы, — так что для общих лент лучше курсорный режим.
+    """
+
+    def __init__(self, querysets, related=()):
+        self.querysets = querysets
+        self.related = related
+        self.model = querysets[0].model
+
+    def __repr__(self):
+        return f'<MergedQuerySet {self.querysets!r}>'
+
+    def _map(self, method, *args, **kwargs):
+        return MergedQuerySet(
+            [
+                getattr(queryset, method)(*args, **kwargs)
+                for queryset in self.querysets
+            ],
+            self.related,
+        )
+
+    def all(self):
+        return self
+
+    def filter(self, *args, **kwargs):
+        return self._map('filter', *args, **kwargs)
+
+    def exclude(self, *args, **kwargs):
+        return self._map('exclude', *args, **kwargs)
+
+    def annotate(self, *args, **kwargs):
+        return self._map('annotate', *args, **kwargs)
+
+    def order_by(self, *fields):
+        return self._map('order_by', *fields)
+
+    def values_list(self, *fields, **kwargs):
+        return self._map('values_list', *fields, **kwargs)
+
+    def select_related(self, *fields):
+        return MergedQuerySet(self.querysets, self.related + fields)
+
+    @property
+    def ordered(self):
+        return self.querysets[0].ordered
+
+    def _ordering(self):
+        query = self.querysets[0].query
+        ordering = query.order_by or (
+            self.model._meta.ordering if query.default_ordering else ()
+        )
+        fields = [field.lstrip('-') for field in ordering]
+        return fields, bool(ordering) and ordering[0].startswith('-')
+
+    def _merge(self, results, start, stop):
+        fields, reverse = self._ordering()
+        first = next(chain.from_iterable(results), None)
+        # values_list отдает кортежи, их порядок не важен
+        if fields and isinstance(first, Model):
+            rows = heapq.merge(
+                *results,
+                key=lambda row: [getattr(row, field) for field in fields],
+                reverse=reverse,
+            )
+        else:
+            rows = chain.from_iterable(results)
+        rows = list(islice(rows, start, stop))
+        if self.related:
+            prefetch_related_objects(rows, *self.related)
+        return rows
+
+    def __iter__(self):
+        return iter(self._merge(fetch(self.querysets), 0, None))
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0]
+        start, stop = key.start or 0, key.stop
+        if len(self.querysets) == 1:
+            results = fetch([self.querysets[0][key]])
+            return self._merge(results, 0, None)
+        querysets = self.querysets
+        if stop is not None:
+            querysets = [queryset[:stop] for queryset in querysets]
+        return self._merge(fetch(querysets), start, stop)
+
+    def count(self):
+        return sum(fetch(self.querysets, lambda queryset: queryset.count()))
+
+    def exists(self):
+        return any(fetch(self.querysets, lambda queryset: queryset.exists()))
+
+    def in_bulk(self, ids):
+        return {obj.pk: obj for obj in self.filter(pk__in=ids).order_by()}
+
+    def get(self, *args, **kwargs):
+        rows = self.filter(*args, **kwargs).order_by()[:2]
+        if not rows:
+            raise self.model.DoesNotExist(
+                f'{self.model._meta.object_name} matching query does not '
+                'exist.'
+            )
+        if len(rows) > 1:
+            raise self.model.MultipleObjectsReturned(
+                f'get() returned more than one {self.model._meta.object_name}'
+            )
+        return rows[0]
+
+
+def spread(queryset, databases):
+    """queryset в каждой из баз databases одним MergedQuerySet."""
+    return MergedQuerySet(
+        [queryset.using(database) for database in databases]
+        or [queryset.none()]
+    )
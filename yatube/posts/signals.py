@@ -0,0 +1,205 @@
+from core.cache import bump_cache_version
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models.signals import (
+    post_delete,
+    post_migrate,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+
+from . import blobs, counters, feed, images, search, shards
+from .models import (
+    AuthorShard,
+    Comment,
+    Follow,
+    Group,
+    Post,
+    PostId,
+    UserStats,
+)
+
+User = get_user_model()
+
+
+@receiver([post_save, post_delete], sender=Post)
+@receiver([post_save, post_delete], sender=Group)
+def bump_index_cache(sender, **kwargs):
+    """Главная страница показывает посты, группы и авторов."""
+    bump_cache_version(settings.INDEX_CACHE_PREFIX)
+
+
+@receiver(post_migrate)
+def install_search_index(sender, using, **kwargs):
+    if sender.name == 'posts':
+        search.install(connections[using])
+
+
+@receiver([post_save, post_delete], sender=User)
+def bump_index_cache_on_user(sender, update_fields=None, **kwargs):
+    # при каждом входе обновляется last_login, на главной его не видно
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    bump_cache_version(settings.INDEX_CACHE_PREFIX)
+
+
+@receiver(post_save, sender=User)
+def create_user_stats(sender, instance, created, **kwargs):
+    if created:
+        UserStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=User)
+def place_author(sender, instance, created, **kwargs):
+    if created and shards.is_enabled():
+        AuthorShard.objects.get_or_create(
+            author=instance, defaults={'database': shards.choose(instance.pk)}
+        )
+
+
+@receiver(pre_delete, sender=User)
+def delete_sharded_content(sender, instance, **kwargs):
+    # каскад из default не достает до строк в других шардах и в архиве
+    for database in shards.post_databases():
+        if database != DEFAULT_DB_ALIAS:
+            Comment.objects.using(database).filter(author=instance).delete()
+            Post.objects.using(database).filter(author=instance).delete()
+
+
+@receiver(pre_delete, sender=Group)
+def ungroup_sharded_posts(sender, instance, **kwargs):
+    for database in shards.post_databases():
+        if database != DEFAULT_DB_ALIAS:
+            Post.objects.using(database).filter(group=instance).update(
+                group=None
+            )
+
+
+@receiver(pre_save, sender=Post)
+def allocate_post_id(sender, instance, **kwargs):
+    # и без шардов: после их включения id продолжаются, а не начинаются с 1
+    if instance.pk is None or kwargs['raw']:
+        PostId.objects.allocate([instance])
+
+
+@receiver(pre_save, sender=Post)
+def store_image_metadata(sender, instance, **kwargs):
+    instance._acquired_image = None
+    # только что загруженный файл еще не сохранен в хранилище
+    if not instance.image:
+        metadata = images.empty()
+    elif not instance.image._committed:
+        metadata = images.describe(instance.image.file)
+        # хранилище раскладывает файл по этому хешу, второй раз не считаем
+        instance.image.file.content_hash = metadata['image_hash']
+        blobs.store(instance.image)
+        instance._acquired_image = instance.image.name
+    else:
+        return
+    for field, value in metadata.items():
+        setattr(instance, field, value)
+
+
+@receiver(pre_save, sender=Post)
+def remember_post_state(sender, instance, using, **kwargs):
+    instance._previous_group_id = instance._previous_image = None
+    if not instance._state.adding:
+        instance._previous_group_id, instance._previous_image = (
+            Post.objects.using(using)
+            .filter(pk=instance.pk)
+            .values_list('group_id', 'image')
+            .first()
+        ) or (None, None)
+
+
+@receiver(post_save, sender=Post)
+def count_saved_post(sender, instance, created, **kwargs):
+    if created:
+        counters.increment_user(instance.author_id, 'posts_count')
+    elif instance._previous_group_id == instance.group_id:
+        return
+    elif instance._previous_group_id:
+        counters.increment(
+            Group, instance._previous_group_id, 'posts_count', -1
+        )
+    if instance.group_id:
+        counters.increment(Group, instance.group_id, 'posts_count')
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_post(sender, instance, **kwargs):
+    counters.increment_user(instance.author_id, 'posts_count', -1)
+    if instance.group_id:
+        counters.increment(Group, instance.group_id, 'posts_count', -1)
+
+
+@receiver(post_save, sender=Post)
+def count_saved_image(sender, instance, **kwargs):
+    image = instance.image.name or None
+    # на новый файл ссылку уже взял store_image_metadata
+    acquired = instance._acquired_image
+    if image == (instance._previous_image or None):
+        if acquired:
+            blobs.release(acquired)
+        return
+    if instance._previous_image:
+        blobs.release(instance._previous_image)
+    if image and image != acquired:
+        blobs.acquire(image)
+
+
+@receiver(post_delete, sender=Post)
+def count_deleted_image(sender, instance, **kwargs):
+    if instance.image:
+        blobs.release(instance.image.name)
+
+
+@receiver(post_save, sender=Comment)
+def count_saved_comment(sender, instance, created, using, **kwargs):
+    # комментарий лежит в одном шарде со своим постом
+    if created:
+        counters.increment(
+            Post, instance.post_id, 'comments_count', using=using
+        )
+
+
+@receiver(post_delete, sender=Comment)
+def count_deleted_comment(sender, instance, using, **kwargs):
+    counters.increment(
+        Post, instance.post_id, 'comments_count', -1, using=using
+    )
+
+
+@receiver(post_save, sender=Follow)
+def count_saved_follow(sender, instance, created, **kwargs):
+    if created:
+        counters.increment_user(instance.author_id, 'followers_count')
+        counters.increment_user(instance.user_id, 'following_count')
+
+
+@receiver(post_delete, sender=Follow)
+def count_deleted_follow(sender, instance, **kwargs):
+    counters.increment_user(instance.author_id, 'followers_count', -1)
+    counters.increment_user(instance.user_id, 'following_count', -1)
+
+
+# Лента подписок: после счетчиков, ей нужно актуальное число подписчиков
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, **kwargs):
+    if created:
+        feed.fan_out(instance)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_feed(sender, instance, created, **kwargs):
+    if created:
+        feed.backfill(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def trim_feed(sender, instance, **kwargs):
+    feed.trim(instance.user_id, instance.author_id)
+    feed.resume_fan_out(instance.author_id)
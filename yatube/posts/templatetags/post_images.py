@@ -0,0 +1,49 @@
+from django import template
+from posts import thumbnails
+
+register = template.Library()
+
+# Ширина слота картинки в карточке поста для атрибута sizes
+SIZES = '(max-width: 540px) 100vw, 500px'
+
+
+def srcset(candidates):
+    return ', '.join(f'{url} {width}w' for width, url in candidates)
+
+
+@register.inclusion_tag('posts/includes/post_image.html')
+def post_image(post, preset='card'):
+    """Картинка поста: готовые превью или исходный файл, без нарезки.
+
+    Размеры берутся из полей поста, так что для атрибутов <img> не нужно
+    ни читать файл, ни ходить в kvstore.
+    """
+    if not post.image:
+        return {}
+    geometry = thumbnails.PRESETS[preset][0]
+    if post.image_width and post.image_height:
+        width, height = thumbnails.thumbnail_size(
+            post.image_width, post.image_height, preset
+        )
+    else:
+        width, height = geometry.split('x')
+    context = {
+        'image': post.image,
+        'width': width,
+        'height': height,
+        'sizes': SIZES,
+    }
+    variants = thumbnails.lookup_variants(
+        post.image, preset, post.image_width
+    )
+    if variants is None:
+        context['thumbnail'] = thumbnails.lookup(post.image, preset)
+        return context
+    fallback = variants.pop('JPEG')
+    context['sources'] = [
+        (thumbnails.MIME_TYPES[format_], srcset(candidates))
+        for format_, candidates in variants.items()
+    ]
+    context['src'] = dict(fallback)[int(geometry.split('x')[0])]
+    context['srcset'] = srcset(fallback)
+    return context
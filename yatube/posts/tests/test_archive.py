@@ -0,0 +1,179 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from posts import counters
+from posts.management.commands.archive_posts import Command
+from posts.models import AuthorShard, Comment, Group, Post, UserStats
+
+User = get_user_model()
+
+
+def create_post(author, days_ago, **fields):
+    post = Post.objects.create(
+        author=author, text=f'Пост {days_ago}', **fields
+    )
+    # pub_date ставится при создании, состариваем пост вручную
+    post.pub_date = timezone.now() - timedelta(days=days_ago)
+    Post.objects.using(post._state.db).filter(pk=post.pk).update(
+        pub_date=post.pub_date
+    )
+    return post
+
+
+@override_settings(
+    POST_ARCHIVE='archive', POST_ARCHIVE_AGE=30, PAGINATE_LIMIT=3
+)
+class ArchiveTest(TestCase):
+    databases = {'default', 'archive'}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.group = Group.objects.create(
+            title='Группа', slug='group', description='Описание'
+        )
+        cls.author = User.objects.create_user(username='author')
+        cls.reader = User.objects.create_user(username='reader')
+        # два свежих поста и три старых, от новых к старым
+        cls.posts = [
+            create_post(cls.author, days_ago, group=cls.group)
+            for days_ago in (1, 2, 40, 50, 60)
+        ]
+        Comment.objects.create(
+            post=cls.posts[2], author=cls.reader, text='Старый'
+        )
+        call_command('archive_posts', batch_size=2, stdout=StringIO())
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def test_old_posts_moved_to_archive(self):
+        """Старые посты переезжают в архив вместе с комментариями"""
+        self.assertEqual(list(Post.objects.all()), self.posts[:2])
+        self.assertEqual(
+            list(Post.objects.using('archive').all()), self.posts[2:]
+        )
+        self.assertFalse(Comment.objects.exists())
+        comment = Comment.objects.using('archive').get()
+        self.assertEqual(comment.post_id, self.posts[2].pk)
+        self.assertEqual(
+            Post.objects.using('archive').get(pk=comment.post_id)
+            .comments_count,
+            1,
+        )
+
+    def test_deep_pages_read_archive(self):
+        """Лента автора и группы продолжается архивными постами"""
+        urls = (
+            reverse('posts:profile', kwargs={'username': 'author'}),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                page = self.client.get(url).context['page_obj']
+                self.assertEqual(page.paginator.count, 5)
+                self.assertEqual(list(page), self.posts[:3])
+                self.assertEqual(page[2].author.username, 'author')
+                page = self.client.get(url, {'page': 2}).context['page_obj']
+                self.assertEqual(list(page), self.posts[3:])
+                with override_settings(PAGINATE_CURSOR=True):
+                    page = self.client.get(url).context['page_obj']
+                    after = page.next_cursor()
+                    page = self.client.get(url, {'after': after})
+                    self.assertEqual(
+                        list(page.context['page_obj']), self.posts[3:]
+                    )
+                    before = page.context['page_obj'].previous_cursor()
+                    page = self.client.get(url, {'before': before})
+                self.assertEqual(
+                    list(page.context['page_obj']), self.posts[:3]
+                )
+
+    def test_archived_post_detail(self):
+        """Старый адрес поста открывается, комментарии пишутся в архив"""
+        post = self.posts[2]
+        self.client.post(
+            reverse('posts:add_comment', kwargs={'post_id': post.pk}),
+            {'text': 'Новый'},
+        )
+        self.assertFalse(Comment.objects.exists())
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': post.pk})
+        )
+        self.assertEqual(response.context['post'], post)
+        self.assertEqual(response.context['post'].comments_count, 2)
+        self.assertEqual(response.context['post'].group, self.group)
+        self.assertEqual(
+            [comment.text for comment in response.context['comments']],
+            ['Новый', 'Старый'],
+        )
+        missing = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': 0})
+        )
+        self.assertEqual(missing.status_code, 404)
+
+    def test_reconcile_and_search_include_archive(self):
+        """Счетчики и поиск учитывают архивные посты"""
+        UserStats.objects.update(posts_count=0)
+        Group.objects.update(posts_count=0)
+        Post.objects.using('archive').update(comments_count=0)
+        counters.reconcile()
+        self.assertEqual(
+            UserStats.objects.get(user=self.author).posts_count, 5
+        )
+        self.assertEqual(Group.objects.get().posts_count, 5)
+        self.assertEqual(
+            Post.objects.using('archive').get(pk=self.posts[2].pk)
+            .comments_count,
+            1,
+        )
+        response = self.client.get(reverse('posts:search'), {'q': 'Пост 50'})
+        self.assertEqual(list(response.context['page_obj']), [self.posts[3]])
+
+
+@override_settings(
+    POST_SHARDS=['default', 'shard1'],
+    POST_ARCHIVE='archive',
+    POST_ARCHIVE_AGE=30,
+)
+class ShardedArchiveTest(TestCase):
+    databases = {'default', 'shard1', 'archive'}
+
+    def test_interrupted_run_keeps_archive_oldest(self):
+        """Прерванный перенос не оставляет в шардах постов старше архивных"""
+        home = User.objects.create_user(username='home')
+        away = User.objects.create_user(username='away')
+        for author, database in ((home, 'default'), (away, 'shard1')):
+            AuthorShard.objects.update_or_create(
+                author=author, defaults={'database': database}
+            )
+        # посты шардов чередуются во времени
+        posts = [
+            create_post(away if days % 20 else home, days)
+            for days in (40, 50, 60, 70)
+        ]
+        move = Command.move
+        moves = []
+
+        def interrupted_move(command, source, ids):
+            # запуск обрывается после первой пачки
+            if len(moves) == 2:
+                raise RuntimeError
+            moves.append(source)
+            return move(command, source, ids)
+
+        with mock.patch.object(Command, 'move', interrupted_move):
+            with self.assertRaises(RuntimeError):
+                call_command('archive_posts', batch_size=2, stdout=StringIO())
+        self.assertEqual(
+            set(Post.objects.using('archive').all()), set(posts[2:])
+        )
+        self.assertEqual(set(Post.objects.spread()), set(posts[:2]))
@@ -0,0 +1,181 @@
+import os
+import shutil
+import tempfile
+import time
+
+from core.cache import PAGE_CACHE_L1
+from core.cache_backends import MemoryCache, SQLiteCache
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.test import Client, SimpleTestCase, TestCase
+from django.urls import reverse
+from posts.models import Post
+
+User = get_user_model()
+
+
+class SQLiteCacheTest(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(dir=settings.BASE_DIR)
+        self.path = os.path.join(self.directory, 'cache.sqlite3')
+        self.cache = SQLiteCache(self.path, {})
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_processes_share_cache(self):
+        """Запись одного процесса видна другому, сброс — тоже"""
+        other = SQLiteCache(self.path, {})
+        self.cache.set('version', 1, None)
+        self.assertEqual(other.get('version'), 1)
+        other.set('version', 2, None)
+        self.assertEqual(self.cache.get('version'), 2)
+        other.delete('version')
+        self.assertIsNone(self.cache.get('version'))
+
+    def test_timeouts(self):
+        """Просроченная запись не отдается и не мешает add"""
+        self.cache.set('key', 'old', 0.01)
+        time.sleep(0.02)
+        self.assertIsNone(self.cache.get('key'))
+        self.assertFalse(self.cache.has_key('key'))
+        self.assertTrue(self.cache.add('key', 'new'))
+        self.assertFalse(self.cache.add('key', 'newer'))
+        self.assertEqual(self.cache.get('key'), 'new')
+
+    def test_incr_and_many(self):
+        """incr, get_many и delete_many работают по всем ключам"""
+        self.cache.set_many({'a': 1, 'b': 2})
+        self.assertEqual(self.cache.incr('a', 10), 11)
+        self.assertEqual(
+            self.cache.get_many(['a', 'b', 'c']), {'a': 11, 'b': 2}
+        )
+        self.cache.delete_many(['a', 'b'])
+        self.assertEqual(self.cache.get_many(['a', 'b']), {})
+        with self.assertRaises(ValueError):
+            self.cache.incr('a')
+
+    def test_least_recently_read_evicted(self):
+        """При переполнении вытесняются давно не читанные записи"""
+        backend = SQLiteCache(self.path, {'OPTIONS': {'MAX_ENTRIES': 2}})
+        backend.set('old', 1)
+        backend.set('read', 2)
+        backend._connection.execute(
+            "UPDATE cache SET accessed = 0 WHERE key LIKE '%old'"
+        )
+        backend.set('new', 3)
+        self.assertEqual(
+            backend.get_many(['old', 'read', 'new']), {'read': 2, 'new': 3}
+        )
+
+    def test_hit_does_not_wait_for_writer(self):
+        """Попадание не ждет чужую запись, чтобы обновить время чтения"""
+        self.cache.set('key', 'value')
+        self.cache._connection.execute("UPDATE cache SET accessed = 0")
+        other = SQLiteCache(self.path, {})
+        other._connection.execute('BEGIN IMMEDIATE')
+        try:
+            started = time.monotonic()
+            self.assertEqual(self.cache.get('key'), 'value')
+            self.assertLess(time.monotonic() - started, 1)
+        finally:
+            other._connection.execute('ROLLBACK')
+        self.cache.set('other', 1)
+        self.assertEqual(self.cache.get('key'), 'value')
+
+
+class MemoryCacheTest(SimpleTestCase):
+    def make_cache(self, name, **options):
+        backend = MemoryCache(name, {'OPTIONS': options})
+        backend.clear()
+        return backend
+
+    def test_byte_budget_evicts_least_recently_read(self):
+        """Записи вытесняются по байтам, начиная с давно не читанных"""
+        backend = self.make_cache('budget', MAX_BYTES=3000)
+        backend.set('page.a', b'a' * 1000)
+        backend.set('page.b', b'b' * 1000)
+        backend.get('page.a')
+        backend.set('page.c', b'c' * 1000)
+        self.assertIsNone(backend.get('page.b'))
+        self.assertIsNotNone(backend.get('page.a'))
+        self.assertIsNotNone(backend.get('page.c'))
+        backend.set('page.huge', b'x' * 4000)
+        self.assertIsNone(backend.get('page.huge'))
+        stats = backend.stats()['page']
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['rejected'], 1)
+        self.assertEqual(stats['entries'], 2)
+        self.assertLessEqual(stats['bytes'], 3000)
+
+    def test_large_values_compressed(self):
+        """Большие значения сжимаются и читаются обратно"""
+        plain = self.make_cache('plain')
+        packed = self.make_cache('packed', COMPRESS_MIN_SIZE=1024)
+        value = 'строка ' * 2000
+        for backend in (plain, packed):
+            backend.set('page.big', value)
+            self.assertEqual(backend.get('page.big'), value)
+        self.assertLess(
+            packed.stats()['page']['bytes'],
+            plain.stats()['page']['bytes'] / 10,
+        )
+
+    def test_stats_by_prefix(self):
+        """Попадания и промахи считаются по префиксу ключа"""
+        backend = self.make_cache('stats')
+        backend.set('index_page.1.abc', 'page')
+        backend.get('index_page.1.abc')
+        backend.get('index_page.2.abc')
+        backend.get('template.backend.missing')
+        stats = backend.stats()
+        self.assertEqual(stats['index_page']['hits'], 1)
+        self.assertEqual(stats['index_page']['misses'], 1)
+        self.assertEqual(stats['index_page']['hit_rate'], 0.5)
+        self.assertEqual(stats['template']['misses'], 1)
+
+    def test_expiry_and_incr(self):
+        """Срок жизни соблюдается, incr его не сбрасывает"""
+        backend = self.make_cache('expiry')
+        backend.set('counter', 1, 0.01)
+        time.sleep(0.02)
+        self.assertTrue(backend.add('counter', 1, 60))
+        self.assertEqual(backend.incr('counter'), 2)
+        self.assertTrue(backend.has_key('counter'))
+        backend.delete('counter')
+        self.assertFalse(backend.has_key('counter'))
+
+
+class PageCacheTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.staff = User.objects.create_user(username='staff', is_staff=True)
+        Post.objects.create(author=cls.staff, text='Тестовый пост')
+
+    def setUp(self):
+        cache.clear()
+        caches[PAGE_CACHE_L1].clear()
+
+    def test_index_page_served_from_l1(self):
+        """Повторный запрос главной берет страницу из памяти воркера"""
+        client = Client()
+        client.get(reverse('posts:index'))
+        # соседний воркер положил страницу в общий кэш, а L1 у него пуст
+        caches[PAGE_CACHE_L1].clear()
+        client.get(reverse('posts:index'))
+        client.get(reverse('posts:index'))
+        stats = caches[PAGE_CACHE_L1].stats()[settings.INDEX_CACHE_PREFIX]
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['entries'], 1)
+        staff_client = Client()
+        staff_client.force_login(self.staff)
+        response = staff_client.get(reverse('cache_stats'))
+        self.assertEqual(
+            response.json()['caches']['local'][settings.INDEX_CACHE_PREFIX][
+                'hits'
+            ],
+            1,
+        )
+        self.assertEqual(Client().get(reverse('cache_stats')).status_code, 302)
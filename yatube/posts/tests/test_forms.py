@@ -1,20 +1,36 @@
+import hashlib
+import os
 import shutil
 import tempfile
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
 from http import HTTPStatus
+from io import BytesIO
+from unittest import mock
 
+from core.storage import shard_name
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import transaction
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
-from posts.models import Comment, Group, Post
+from PIL import Image
+from posts import ingest, thumbnails
+from posts.models import Comment, Group, ImageBlob, Post
+from posts.tests.utils import SMALL_GIF
 
 User = get_user_model()
 
+ORIENTATION = 0x0112
+
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+TEMP_KVSTORE_PATH = os.path.join(TEMP_MEDIA_ROOT, 'thumbnails.sqlite3')
 
 
-@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+@override_settings(
+    MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_KVSTORE_PATH=TEMP_KVSTORE_PATH
+)
 class PostCreateFormTests(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -45,16 +61,8 @@ class PostCreateFormTests(TestCase):
 
     def test_authorized_user_can_create_post(self):
         """Валидная форма авторизованного пользователя создает запись"""
-        small_gif = (
-            b'\x47\x49\x46\x38\x39\x61\x02\x00'
-            b'\x01\x00\x80\x00\x00\x00\x00\x00'
-            b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
-            b'\x00\x00\x00\x2C\x00\x00\x00\x00'
-            b'\x02\x00\x01\x00\x00\x02\x02\x0C'
-            b'\x0A\x00\x3B'
-        )
         uploaded = SimpleUploadedFile(
-            name='small.gif', content=small_gif, content_type='image/gif'
+            name='small.gif', content=SMALL_GIF, content_type='image/gif'
         )
         posts_count = Post.objects.count()
         form_data = {
@@ -69,8 +77,10 @@ class PostCreateFormTests(TestCase):
             response, Post.objects.first(), form_data, posts_count
         )
         self.assertEqual(Post.objects.first().group.id, form_data['group'])
+        content_hash = hashlib.sha256(SMALL_GIF).hexdigest()
         self.assertEqual(
-            Post.objects.first().image, f"posts/{str(form_data['image'])}"
+            Post.objects.first().image,
+            shard_name('posts/small.gif', content_hash),
         )
 
     def test_authorized_user_can_create_post_without_group(self):
@@ -102,7 +112,9 @@ class PostCreateFormTests(TestCase):
         self.assertEqual(Post.objects.count(), 0)  # не создалась ли запись
 
 
-@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+@override_settings(
+    MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_KVSTORE_PATH=TEMP_KVSTORE_PATH
+)
 class PostEditFormTests(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -141,16 +153,8 @@ class PostEditFormTests(TestCase):
     def test_author_user_can_edit_post(self):
         """Валидная форма, отправленная автором редактирует запись."""
         posts_count = Post.objects.count()
-        small_gif = (
-            b'\x47\x49\x46\x38\x39\x61\x02\x00'
-            b'\x01\x00\x80\x00\x00\x00\x00\x00'
-            b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
-            b'\x00\x00\x00\x2C\x00\x00\x00\x00'
-            b'\x02\x00\x01\x00\x00\x02\x02\x0C'
-            b'\x0A\x00\x3B'
-        )
         uploaded = SimpleUploadedFile(
-            name='small.gif', content=small_gif, content_type='image/gif'
+            name='small.gif', content=SMALL_GIF, content_type='image/gif'
         )
         form_data = {
             'text': 'this text was changed',
@@ -166,8 +170,10 @@ class PostEditFormTests(TestCase):
         self.merge_same_asserts(
             response, Post.objects.first(), form_data, posts_count
         )
+        content_hash = hashlib.sha256(SMALL_GIF).hexdigest()
         self.assertEqual(
-            Post.objects.first().image, f"posts/{str(form_data['image'])}"
+            Post.objects.first().image,
+            shard_name('posts/small.gif', content_hash),
         )
 
     def test_author_user_can_edit_post_without_group(self):
@@ -207,6 +213,197 @@ class PostEditFormTests(TestCase):
         self.assertEqual(Post.objects.first().group.id, self.group.id)
 
 
+@override_settings(
+    MEDIA_ROOT=TEMP_MEDIA_ROOT,
+    THUMBNAIL_KVSTORE_PATH=TEMP_KVSTORE_PATH,
+    THUMBNAIL_WORKERS=0,
+    IMAGE_INGEST_WORKERS=0,
+)
+class PostImageDedupTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def create_post(self, text):
+        form_data = {
+            'text': text,
+            'image': SimpleUploadedFile('meme.gif', SMALL_GIF),
+        }
+        self.authorized_client.post(
+            reverse('posts:post_create'), data=form_data
+        )
+        return Post.objects.get(text=text)
+
+    def test_same_image_stored_once(self):
+        """Повторная загрузка той же картинки ссылается на тот же файл"""
+        first = self.create_post('Первый')
+        second = self.create_post('Второй')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(
+            first.image_hash, hashlib.sha256(SMALL_GIF).hexdigest()
+        )
+        self.assertEqual(len(os.listdir(os.path.dirname(first.image.path))), 1)
+        blob = ImageBlob.objects.get(name=first.image.name)
+        self.assertEqual(blob.refcount, 2)
+
+    def test_shared_image_deleted_with_last_post(self):
+        """Файл удаляется только вместе с последним постом"""
+        first = self.create_post('Первый')
+        second = self.create_post('Второй')
+        path = first.image.path
+        with mock.patch.object(transaction, 'on_commit', lambda f: f()):
+            first.delete()
+            self.assertTrue(os.path.exists(path))
+            second.delete()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(ImageBlob.objects.exists())
+
+    def test_reupload_survives_pending_delete(self):
+        """Загрузка того же файла до удаления по on_commit его сохраняет"""
+        first = self.create_post('Первый')
+        path = first.image.path
+        with mock.patch.object(transaction, 'on_commit') as on_commit:
+            first.delete()
+        self.create_post('Второй')
+        on_commit.call_args[0][0]()
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(ImageBlob.objects.get().refcount, 1)
+
+
+@override_settings(
+    MEDIA_ROOT=TEMP_MEDIA_ROOT,
+    THUMBNAIL_KVSTORE_PATH=TEMP_KVSTORE_PATH,
+    THUMBNAIL_WORKERS=0,
+    IMAGE_INGEST_WORKERS=0,
+)
+class PostImageIngestTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def upload(self, content, name='photo.jpg'):
+        form_data = {
+            'text': 'Пост с фото',
+            'image': SimpleUploadedFile(name, content),
+        }
+        with mock.patch.object(transaction, 'on_commit', lambda f: f()):
+            return self.authorized_client.post(
+                reverse('posts:post_create'), data=form_data
+            )
+
+    def photo(self, size=(300, 200)):
+        exif = Image.Exif()
+        exif[ORIENTATION] = 6
+        buffer = BytesIO()
+        Image.new('RGB', size, 'red').save(
+            buffer, 'JPEG', exif=exif.tobytes()
+        )
+        return buffer.getvalue()
+
+    @override_settings(IMAGE_INGEST_WORKERS=2)
+    def test_ingest_pool_hands_off_thumbnails(self):
+        """Колбэк пула нормализации не режет превью сам и пишет ошибки
+        в лог"""
+        with mock.patch.object(ingest, 'get_executor') as pool:
+            self.upload(self.photo())
+        (callback,) = [
+            call[0][0] for call in pool().submit.return_value
+            .add_done_callback.call_args_list
+        ]
+        done = Future()
+        done.set_result(('posts/photo.jpg', 300))
+        with mock.patch.object(thumbnails, 'get_executor') as executor:
+            callback(done)
+        executor().submit.assert_called_once_with(
+            thumbnails.generate, 'posts/photo.jpg', 300
+        )
+        failed = Future()
+        failed.set_exception(BrokenProcessPool())
+        with self.assertLogs('posts.ingest', 'ERROR'):
+            callback(failed)
+
+    @override_settings(POST_IMAGE_MAX_SIZE=100)
+    def test_large_file_rejected(self):
+        """Слишком тяжелый файл не принимается"""
+        response = self.upload(self.photo())
+        self.assertFormError(
+            response, 'form', 'image', 'Файл больше 100\xa0байт.'
+        )
+        self.assertFalse(Post.objects.exists())
+
+    @override_settings(POST_IMAGE_MAX_PIXELS=1000)
+    def test_too_many_pixels_rejected(self):
+        """Картинка с большим числом пикселей не принимается"""
+        response = self.upload(self.photo())
+        self.assertFormError(
+            response, 'form', 'image', 'Картинка больше 0.001 мегапикселей.'
+        )
+        self.assertFalse(Post.objects.exists())
+
+    @override_settings(POST_IMAGE_MAX_SIDE=100)
+    def test_original_normalized(self):
+        """Оригинал поворачивается по EXIF, уменьшается и теряет EXIF"""
+        content = self.photo()
+        self.upload(content)
+        post = Post.objects.get()
+        self.assertEqual((post.image_width, post.image_height), (67, 100))
+        with Image.open(post.image.path) as image:
+            self.assertEqual(image.size, (67, 100))
+            self.assertFalse(image.getexif())
+        self.assertNotEqual(
+            post.image_hash, hashlib.sha256(content).hexdigest()
+        )
+        self.assertEqual(ImageBlob.objects.get().name, post.image.name)
+        original = shard_name(
+            'posts/photo.jpg', hashlib.sha256(content).hexdigest()
+        )
+        self.assertFalse(post.image.storage.exists(original))
+
+    @override_settings(POST_IMAGE_MAX_SIDE=100)
+    def test_animated_original_downsized(self):
+        """Анимация уменьшается покадрово и остается анимацией"""
+        frames = [
+            Image.new('RGB', (300, 200), color) for color in ('red', 'blue')
+        ]
+        buffer = BytesIO()
+        frames[0].save(
+            buffer,
+            'GIF',
+            save_all=True,
+            append_images=frames[1:],
+            duration=[50, 150],
+            loop=0,
+        )
+        self.upload(buffer.getvalue(), 'anim.gif')
+        post = Post.objects.get()
+        self.assertEqual((post.image_width, post.image_height), (100, 67))
+        with Image.open(post.image.path) as image:
+            self.assertEqual(image.size, (100, 67))
+            self.assertEqual(image.n_frames, 2)
+            image.seek(1)
+            self.assertEqual(image.info['duration'], 150)
+
+
 class PostCommentFormTest(TestCase):
     @classmethod
     def setUpClass(cls):
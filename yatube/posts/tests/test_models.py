@@ -1,10 +1,28 @@
+import hashlib
+import os
+import shutil
+import tempfile
+from io import StringIO
+
+from core.kvstore import KVStore
+from core.storage import is_sharded
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from posts import thumbnails
+from sorl.thumbnail import default
 
-from ..models import Group, Post
+from ..models import Comment, Follow, Group, Post, UserStats
+from .utils import SMALL_GIF
 
 User = get_user_model()
 
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+TEMP_KVSTORE_PATH = os.path.join(TEMP_MEDIA_ROOT, 'thumbnails.sqlite3')
+
 
 class PostModelTest(TestCase):
     @classmethod
@@ -67,3 +85,229 @@ class PostModelTest(TestCase):
             with self.subTest(label=label):
                 verbose = self.post._meta.get_field(label).help_text
                 self.assertEqual(verbose, expected_help_text)
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test',
+            description='Тестовое описание',
+        )
+        cls.group_second = Group.objects.create(
+            title='Вторая группа',
+            slug='second',
+            description='Тестовое описание',
+        )
+
+    def refresh(self, *objects):
+        for obj in objects:
+            obj.refresh_from_db()
+
+    def test_post_counters(self):
+        """Счетчики постов автора и группы следуют за постами"""
+        post = Post.objects.create(
+            author=self.user, text='Пост', group=self.group
+        )
+        self.refresh(self.user.stats, self.group)
+        self.assertEqual(self.user.stats.posts_count, 1)
+        self.assertEqual(self.group.posts_count, 1)
+        post.group = self.group_second
+        post.save()
+        self.refresh(self.group, self.group_second)
+        self.assertEqual(self.group.posts_count, 0)
+        self.assertEqual(self.group_second.posts_count, 1)
+        post.delete()
+        self.refresh(self.user.stats, self.group_second)
+        self.assertEqual(self.user.stats.posts_count, 0)
+        self.assertEqual(self.group_second.posts_count, 0)
+
+    def test_comment_and_follow_counters(self):
+        """Счетчики комментариев и подписок следуют за данными"""
+        post = Post.objects.create(author=self.user, text='Пост')
+        comment = Comment.objects.create(
+            post=post, author=self.reader, text='Комментарий'
+        )
+        follow = Follow.objects.create(user=self.reader, author=self.user)
+        self.refresh(post, self.user.stats, self.reader.stats)
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(self.user.stats.followers_count, 1)
+        self.assertEqual(self.reader.stats.following_count, 1)
+        comment.delete()
+        follow.delete()
+        self.refresh(post, self.user.stats, self.reader.stats)
+        self.assertEqual(post.comments_count, 0)
+        self.assertEqual(self.user.stats.followers_count, 0)
+        self.assertEqual(self.reader.stats.following_count, 0)
+
+    def test_reconcile_counters(self):
+        """Команда reconcile_counters исправляет расхождения"""
+        Post.objects.bulk_create(
+            Post(author=self.user, text=str(i), group=self.group)
+            for i in range(3)
+        )
+        UserStats.objects.filter(user=self.reader).delete()
+        call_command('reconcile_counters', batch_size=1, stdout=StringIO())
+        self.refresh(self.user.stats, self.group)
+        self.assertEqual(self.user.stats.posts_count, 3)
+        self.assertEqual(self.group.posts_count, 3)
+        self.assertTrue(UserStats.objects.filter(user=self.reader).exists())
+
+
+@override_settings(
+    MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_KVSTORE_PATH=TEMP_KVSTORE_PATH
+)
+class ImageMetadataTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def tearDown(self):
+        # одинаковые картинки из разных тестов не должны мешать друг другу
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def create_post(self):
+        return Post.objects.create(
+            author=self.user,
+            text='Пост с картинкой',
+            image=SimpleUploadedFile('small.gif', SMALL_GIF),
+        )
+
+    def test_metadata_stored_on_upload(self):
+        """Размеры, хеш и вес картинки сохраняются при загрузке"""
+        post = self.create_post()
+        post.refresh_from_db()
+        self.assertEqual((post.image_width, post.image_height), (2, 1))
+        self.assertEqual(post.image_size, len(SMALL_GIF))
+        self.assertEqual(
+            post.image_hash, hashlib.sha256(SMALL_GIF).hexdigest()
+        )
+        post.image = None
+        post.save()
+        post.refresh_from_db()
+        self.assertEqual(post.image_hash, '')
+        self.assertIsNone(post.image_width)
+
+    def test_backfill_image_metadata(self):
+        """Команда заполняет метаданные старых постов"""
+        post = self.create_post()
+        Post.objects.filter(pk=post.pk).update(
+            image_width=None, image_height=None, image_hash='', image_size=None
+        )
+        out = StringIO()
+        call_command('backfill_image_metadata', batch_size=1, stdout=out)
+        post.refresh_from_db()
+        self.assertEqual((post.image_width, post.image_height), (2, 1))
+        self.assertEqual(post.image_size, len(SMALL_GIF))
+        self.assertIn('Обновлено постов: 1', out.getvalue())
+
+    def test_images_sharded_by_hash(self):
+        """Картинка лежит в каталоге по префиксу своего хеша"""
+        post = self.create_post()
+        content_hash = hashlib.sha256(SMALL_GIF).hexdigest()
+        self.assertEqual(
+            post.image.name,
+            f'posts/{content_hash[:2]}/{content_hash[2:4]}/'
+            f'{content_hash}.gif',
+        )
+        self.assertTrue(post.image.storage.exists(post.image.name))
+        self.assertTrue(is_sharded(self.create_post().image.name))
+
+    def test_shard_post_images(self):
+        """Команда переносит старые картинки и переживает повторный запуск"""
+        post = self.create_post()
+        sharded_name = post.image.name
+        storage = post.image.storage
+        os.replace(storage.path(sharded_name), storage.path('posts/old.gif'))
+        Post.objects.filter(pk=post.pk).update(image='posts/old.gif')
+        call_command('shard_post_images', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.image.name, sharded_name)
+        self.assertTrue(storage.exists(sharded_name))
+        self.assertFalse(storage.exists('posts/old.gif'))
+        # файл перенесли, а до базы дело не дошло
+        Post.objects.filter(pk=post.pk).update(image='posts/old.gif')
+        call_command('shard_post_images', stdout=StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.image.name, sharded_name)
+
+    def test_collect_media_garbage(self):
+        """Сборщик удаляет файлы и превью без постов, а нужные оставляет"""
+        post = self.create_post()
+        storage = post.image.storage
+        # та же картинка с другим цветом палитры — другой хеш
+        orphan = storage.save(
+            'posts/orphan.gif',
+            ContentFile(SMALL_GIF.replace(b'\x80\x00\x00', b'\x80\x01\x00')),
+        )
+        thumbnails.render(post.image.name)
+        thumbnails.render(orphan)
+        kept = thumbnails.lookup(post.image, 'card')
+        dropped = thumbnails.lookup(thumbnails.source_file(orphan), 'card')
+        stray = default.storage.save(
+            'cache/00/00/stray.jpg', ContentFile(b'1')
+        )
+        for path, dirs, files in os.walk(TEMP_MEDIA_ROOT):
+            for file in files:
+                os.utime(os.path.join(path, file), (0, 0))
+        out = StringIO()
+        call_command('collect_media_garbage', dry_run=True, stdout=out)
+        self.assertIn(orphan, out.getvalue())
+        self.assertIn(stray, out.getvalue())
+        self.assertTrue(storage.exists(orphan))
+        call_command('collect_media_garbage', rate=0, stdout=StringIO())
+        self.assertFalse(storage.exists(orphan))
+        self.assertFalse(default.storage.exists(dropped.name))
+        self.assertIsNone(
+            thumbnails.lookup(thumbnails.source_file(orphan), 'card')
+        )
+        self.assertFalse(default.storage.exists(stray))
+        self.assertTrue(storage.exists(post.image.name))
+        self.assertTrue(default.storage.exists(kept.name))
+        self.assertEqual(thumbnails.lookup(post.image, 'card').name, kept.name)
+
+
+@override_settings(
+    MEDIA_ROOT=TEMP_MEDIA_ROOT,
+    THUMBNAIL_KVSTORE_PATH=TEMP_KVSTORE_PATH,
+    THUMBNAIL_KVSTORE_LRU_SIZE=2,
+    THUMBNAIL_KVSTORE_RECHECK=0,
+)
+class ThumbnailKVStoreTest(TestCase):
+    def tearDown(self):
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def test_processes_share_kvstore_file(self):
+        """Записи одного процесса видны другому, несмотря на его LRU"""
+        writer, reader = KVStore(), KVStore()
+        self.assertIsNone(reader._get_raw('key'))
+        writer._set_raw('key', 'value')
+        self.assertEqual(reader._get_raw('key'), 'value')
+        writer._delete_raw('key')
+        self.assertIsNone(reader._get_raw('key'))
+
+    def test_lru_is_bounded(self):
+        """LRU держит не больше THUMBNAIL_KVSTORE_LRU_SIZE ключей"""
+        kvstore = KVStore()
+        for key in 'abc':
+            kvstore._set_raw(key, key)
+        self.assertEqual(list(kvstore._lru), ['b', 'c'])
+        self.assertEqual(kvstore._get_raw('a'), 'a')
+        self.assertEqual(list(kvstore._find_keys_raw('')), ['a', 'b', 'c'])
+
+    def test_kvstore_follows_deleted_file(self):
+        """Удаленный файл kvstore не оставляет записей в LRU"""
+        kvstore = KVStore()
+        kvstore._set_raw('key', 'value')
+        shutil.rmtree(TEMP_MEDIA_ROOT)
+        self.assertIsNone(kvstore._get_raw('key'))
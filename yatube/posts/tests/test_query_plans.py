@@ -0,0 +1,98 @@
+import re
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from posts.models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+FULL_SCAN = re.compile(r'^SCAN (TABLE )?\S+( AS \S+)?$')
+TEMP_SORT = 'USE TEMP B-TREE'
+
+
+class QueryPlansTest(TestCase):
+    """Запросы страниц со списками постов обслуживаются индексами.
+
+    Каждый запрос к таблицам posts_* прогоняется через EXPLAIN QUERY PLAN.
+    Полный просмотр таблицы вместе с сортировкой во временном B-дереве
+    значит, что под запрос нет подходящего индекса.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='auth')
+        cls.follower = User.objects.create_user(username='follower')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        Follow.objects.create(user=cls.follower, author=cls.author)
+        for i in range(15):
+            cls.post = Post.objects.create(
+                author=cls.author, text=f'{i} Test', group=cls.group
+            )
+        for i in range(3):
+            Comment.objects.create(
+                post=cls.post, author=cls.follower, text=f'{i} Comment'
+            )
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(self.follower)
+
+    def explain(self, sql):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assert_plans_use_indexes(self, url, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, data)
+        self.assertEqual(response.status_code, 200)
+        for query in queries.captured_queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT') or 'posts_' not in sql:
+                continue
+            plan = self.explain(sql)
+            full_scan = any(FULL_SCAN.match(step) for step in plan)
+            temp_sort = any(TEMP_SORT in step for step in plan)
+            self.assertFalse(
+                full_scan and temp_sort, f'{url}: {sql}\n{plan}'
+            )
+        return response
+
+    def test_list_views_query_plans(self):
+        """Списки постов не сортируют всю таблицу"""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': 'auth'}),
+            reverse('posts:follow_index'),
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk}),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                self.assert_plans_use_indexes(url)
+                self.assert_plans_use_indexes(url, {'page': 2})
+
+    @override_settings(PAGINATE_CURSOR=True)
+    def test_cursor_query_plans(self):
+        """Курсорные страницы не сортируют всю таблицу"""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': 'auth'}),
+            reverse('posts:follow_index'),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                response = self.assert_plans_use_indexes(url)
+                cursor = response.context['page_obj'].next_cursor()
+                self.assert_plans_use_indexes(url, {'after': cursor})
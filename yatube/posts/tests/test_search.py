@@ -0,0 +1,85 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase
+from django.urls import reverse
+from posts import search
+from posts.models import Post
+
+User = get_user_model()
+
+
+class SearchTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+        cls.posts = [
+            Post.objects.create(author=cls.user, text=f'{i} котики и собаки')
+            for i in range(12)
+        ]
+        cls.best = Post.objects.create(
+            author=cls.user, text='котики котики котики'
+        )
+        Post.objects.create(author=cls.user, text='только собаки')
+
+    def setUp(self):
+        self.client = Client()
+
+    def search(self, query, **data):
+        return self.client.get(reverse('posts:search'), {'q': query, **data})
+
+    def test_search_ranks_and_paginates(self):
+        """Поиск сортирует по релевантности и листается курсором"""
+        response = self.search('котики')
+        page_obj = response.context['page_obj']
+        self.assertEqual(len(page_obj), 10)
+        self.assertEqual(page_obj[0], self.best)
+        self.assertTrue(page_obj.has_next())
+        response = self.search('котики', after=page_obj.next_cursor())
+        rest = response.context['page_obj']
+        self.assertEqual(len(rest), 3)
+        self.assertFalse(rest.has_next())
+        self.assertFalse(set(page_obj) & set(rest))
+
+    def test_search_index_follows_edits(self):
+        """Индекс обновляется при правке и удалении поста"""
+        post = self.posts[0]
+        post.text = 'черепахи'
+        post.save()
+        found = self.search('черепахи').context['page_obj']
+        self.assertEqual(list(found), [post])
+        post.delete()
+        self.assertFalse(self.search('черепахи').context['page_obj'])
+
+    def test_search_operators_are_literal(self):
+        """Операторы FTS5 в запросе не ломают поиск"""
+        for query in ('котики AND', '"котики', 'NEAR(', 'text:'):
+            with self.subTest(query=query):
+                self.assertEqual(self.search(query).status_code, 200)
+
+    def test_control_characters_ignored(self):
+        """NUL и другие управляющие символы не роняют поиск"""
+        for query in ('\x00', 'котики\x00', '\x07котики'):
+            with self.subTest(query=query):
+                self.assertEqual(self.search(query).status_code, 200)
+
+    def test_admin_uses_search_index(self):
+        """Поиск в админке идет через индекс"""
+        posts = search.filter_posts(Post.objects.all(), 'только')
+        self.assertEqual(posts.count(), 1)
+
+    def test_rebuild_search_index(self):
+        """Команда заново собирает индекс"""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {search.FTS_TABLE}({search.FTS_TABLE}) "
+                f"VALUES ('delete-all')"
+            )
+        self.assertFalse(self.search('котики').context['page_obj'])
+        out = StringIO()
+        call_command('rebuild_search_index', batch_size=5, stdout=out)
+        self.assertIn('14', out.getvalue())
+        self.assertEqual(len(self.search('котики').context['page_obj']), 10)
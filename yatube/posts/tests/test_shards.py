@@ -0,0 +1,278 @@
+from datetime import timedelta
+from importlib import import_module
+from io import StringIO
+from types import SimpleNamespace
+from unittest import mock
+
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, router
+from django.test import (
+    Client,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.urls import reverse
+from django.utils import timezone
+from posts import counters
+from posts.models import (
+    AuthorShard,
+    Comment,
+    Follow,
+    Group,
+    Post,
+    PostId,
+    UserStats,
+)
+
+User = get_user_model()
+
+SHARDS = ['default', 'shard1']
+
+
+def create_author(username, database):
+    author = User.objects.create_user(username=username)
+    AuthorShard.objects.update_or_create(
+        author=author, defaults={'database': database}
+    )
+    return author
+
+
+def create_post(author, minutes_ago, **fields):
+    post = Post.objects.create(author=author, text='Пост', **fields)
+    # pub_date ставится при создании, двигаем его, чтобы перемешать шарды
+    post.pub_date = timezone.now() - timedelta(minutes=minutes_ago)
+    Post.objects.using(post._state.db).filter(pk=post.pk).update(
+        pub_date=post.pub_date
+    )
+    return post
+
+
+@override_settings(POST_SHARDS=SHARDS, PAGINATE_LIMIT=3)
+class ShardedViewsTest(TestCase):
+    databases = {'default', 'shard1'}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.group = Group.objects.create(
+            title='Группа', slug='group', description='Описание'
+        )
+        cls.home = create_author('home', 'default')
+        cls.away = create_author('away', 'shard1')
+        cls.reader = User.objects.create_user(username='reader')
+        Follow.objects.create(user=cls.reader, author=cls.home)
+        Follow.objects.create(user=cls.reader, author=cls.away)
+        # посты авторов чередуются во времени: 1 — самый свежий
+        cls.posts = [
+            create_post(
+                cls.away if minutes % 2 else cls.home,
+                minutes,
+                group=cls.group,
+            )
+            for minutes in range(1, 7)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def test_posts_stored_in_author_shard(self):
+        """Посты лежат в шарде автора, id не повторяются"""
+        self.assertEqual(
+            Post.objects.using('shard1').filter(author=self.away).count(), 3
+        )
+        self.assertFalse(
+            Post.objects.using('default').filter(author=self.away).exists()
+        )
+        self.assertEqual(len({post.pk for post in self.posts}), 6)
+
+    def test_global_pages_merge_shards(self):
+        """Общие ленты сливают шарды по дате, номерные и курсорные"""
+        urls = (
+            reverse('posts:index'),
+            reverse('posts:group_list', kwargs={'slug': self.group.slug}),
+            reverse('posts:follow_index'),
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                page = self.client.get(url).context['page_obj']
+                self.assertEqual(page.paginator.count, 6)
+                self.assertEqual(list(page), self.posts[:3])
+                self.assertEqual(
+                    page[0].author.username, self.posts[0].author.username
+                )
+                page = self.client.get(url, {'page': 2}).context['page_obj']
+                self.assertEqual(list(page), self.posts[3:])
+                with override_settings(PAGINATE_CURSOR=True):
+                    page = self.client.get(url).context['page_obj']
+                    after = page.next_cursor()
+                    page = self.client.get(url, {'after': after})
+                self.assertEqual(
+                    list(page.context['page_obj']), self.posts[3:]
+                )
+
+    def test_post_pages_use_author_shard(self):
+        """Профиль, пост и комментарии работают с шардом автора"""
+        post = self.posts[0]
+        response = self.client.get(
+            reverse('posts:profile', kwargs={'username': 'away'})
+        )
+        self.assertEqual(response.context['page_obj'].paginator.count, 3)
+        self.client.post(
+            reverse('posts:add_comment', kwargs={'post_id': post.pk}),
+            {'text': 'Комментарий'},
+        )
+        comment = Comment.objects.using('shard1').get(post=post)
+        self.assertEqual(comment.author, self.reader)
+        response = self.client.get(
+            reverse('posts:post_detail', kwargs={'post_id': post.pk})
+        )
+        self.assertEqual(response.context['post'].comments_count, 1)
+        self.assertEqual(list(response.context['comments']), [comment])
+        self.assertEqual(
+            response.context['comments'][0].author.username, 'reader'
+        )
+
+    def test_reconcile_counts_all_shards(self):
+        """Пересчет счетчиков учитывает посты во всех шардах"""
+        UserStats.objects.update(posts_count=0)
+        Group.objects.update(posts_count=0)
+        counters.reconcile()
+        self.assertEqual(
+            UserStats.objects.get(user=self.away).posts_count, 3
+        )
+        self.assertEqual(Group.objects.get().posts_count, 6)
+
+
+class MigrateRouterTest(SimpleTestCase):
+    def test_post_databases_get_post_tables_only(self):
+        """В шарды и архив migrate ставит только таблицы постов"""
+        for database in ('shard1', 'archive'):
+            with self.subTest(database=database):
+                self.assertTrue(
+                    router.allow_migrate(database, 'posts', model_name='post')
+                )
+                self.assertFalse(
+                    router.allow_migrate(database, 'posts', model_name='group')
+                )
+                self.assertFalse(
+                    router.allow_migrate(database, 'auth', model_name='user')
+                )
+                self.assertFalse(router.allow_migrate(database, 'posts'))
+        self.assertTrue(
+            router.allow_migrate('default', 'auth', model_name='user')
+        )
+
+
+class EnableShardingTest(TestCase):
+    databases = {'default', 'shard1'}
+
+    def setUp(self):
+        self.author = User.objects.create_user(username='author')
+        self.posts = [
+            Post.objects.create(author=self.author, text='Старый')
+            for _ in range(2)
+        ]
+
+    def test_ids_continue_after_enabling(self):
+        """После включения шардов новые посты не повторяют старые id"""
+        with override_settings(POST_SHARDS=SHARDS):
+            away = create_author('away', 'shard1')
+            post = Post.objects.create(author=away, text='Новый')
+            Comment.objects.create(
+                post=self.posts[0], author=away, text='Комментарий'
+            )
+        self.assertGreater(post.pk, self.posts[-1].pk)
+        self.assertEqual(Post.objects.using('shard1').get(), post)
+        self.assertEqual(
+            Comment.objects.using('default').get().post, self.posts[0]
+        )
+
+    def test_create_after_bulk_create(self):
+        """Посты из bulk_create и loaddata не мешают выдавать новые id"""
+        Post.objects.bulk_create(
+            [Post(author=self.author, text='Пачка') for _ in range(3)]
+        )
+        Post.objects.bulk_create(
+            [Post(pk=100, author=self.author, text='Свой id')]
+        )
+        # так сохраняет loaddata
+        fixture = Post(pk=200, author=self.author, pub_date=timezone.now())
+        fixture.save_base(raw=True)
+        post = Post.objects.create(author=self.author, text='Новый')
+        self.assertGreater(post.pk, 200)
+        self.assertEqual(Post.objects.count(), 8)
+
+    def test_migration_registers_existing_posts(self):
+        """Миграция заводит PostId постам, созданным до нее, и не выдает
+        id удаленных постов заново"""
+        deleted = Post.objects.create(author=self.author, text='Удаленный')
+        deleted_id = deleted.pk
+        deleted.delete()
+        # так выглядела база до миграции
+        PostId.objects.all().delete()
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM sqlite_sequence WHERE name = %s',
+                [PostId._meta.db_table],
+            )
+        migration = import_module('posts.migrations.0026_register_post_ids')
+        migration.register_posts(apps, SimpleNamespace(connection=connection))
+        self.assertEqual(
+            set(PostId.objects.values_list('pk', 'author')),
+            {(post.pk, self.author.pk) for post in self.posts},
+        )
+        with override_settings(POST_SHARDS=SHARDS):
+            post = Post.objects.create(author=self.author, text='Новый')
+        self.assertGreater(post.pk, deleted_id)
+
+
+@override_settings(POST_SHARDS=SHARDS)
+class RebalanceShardsTest(TransactionTestCase):
+    databases = {'default', 'shard1'}
+
+    def test_author_moved_online(self):
+        """Автор переезжает со всеми постами и комментариями, включая
+        записи, попавшие в старый шард после переключения"""
+        author = create_author('author', 'default')
+        reader = User.objects.create_user(username='reader')
+        posts = [create_post(author, minutes) for minutes in range(3)]
+        Comment.objects.create(post=posts[0], author=reader, text='Первый')
+
+        def late_write(seconds):
+            # запрос выбрал шард до переключения и записал уже после
+            Comment.objects.using('default').create(
+                post=posts[1], author=reader, text='Запоздалый'
+            )
+
+        with mock.patch('time.sleep', late_write):
+            call_command(
+                'rebalance_shards',
+                authors=['author'],
+                to='shard1',
+                stdout=StringIO(),
+            )
+        self.assertEqual(
+            AuthorShard.objects.get(author=author).database, 'shard1'
+        )
+        self.assertFalse(Post.objects.using('default').exists())
+        self.assertFalse(Comment.objects.using('default').exists())
+        moved = Post.objects.using('shard1').order_by('-pub_date')
+        self.assertEqual(list(moved), posts)
+        self.assertEqual(moved[0].comments_count, 1)
+        self.assertEqual(
+            set(
+                Comment.objects.using('shard1').values_list('post', 'text')
+            ),
+            {(posts[0].pk, 'Первый'), (posts[1].pk, 'Запоздалый')},
+        )
+        # параллельное чтение двух шардов видит переехавшие посты
+        create_post(reader, 10)
+        merged = Post.objects.spread().order_by('-pub_date', '-pk')
+        self.assertEqual(merged.count(), 4)
+        self.assertEqual(list(merged[:3]), posts)
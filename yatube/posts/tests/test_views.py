@@ -1,21 +1,46 @@
+import hashlib
+import os
 import shutil
 import tempfile
+import threading
+from concurrent.futures import Future
+from io import StringIO
+from unittest import mock, skipUnless
 
+from core import writer
+from core.storage import shard_name
+from core.utils import page_window
 from django import forms
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
-from django.test import Client, TestCase, override_settings
+from django.core.management import call_command
+from django.core.paginator import Paginator
+from django.db import connection, transaction
+from django.test import (
+    Client,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from posts.models import Follow, Group, Post
+from PIL import features
+from posts import thumbnails
+from posts.models import Comment, FeedEntry, Follow, Group, Post
+from posts.tests.utils import SMALL_GIF
+from sorl.thumbnail.conf import settings as sorl_settings
 
 User = get_user_model()
 
 TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+TEMP_KVSTORE_PATH = os.path.join(TEMP_MEDIA_ROOT, 'thumbnails.sqlite3')
 
 
-@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+@override_settings(
+    MEDIA_ROOT=TEMP_MEDIA_ROOT, THUMBNAIL_KVSTORE_PATH=TEMP_KVSTORE_PATH
+)
 class PostsPagesTests(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -31,16 +56,8 @@ class PostsPagesTests(TestCase):
             slug='test-slug-second',
             description='some text',
         )
-        cls.small_gif = (
-            b'\x47\x49\x46\x38\x39\x61\x02\x00'
-            b'\x01\x00\x80\x00\x00\x00\x00\x00'
-            b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
-            b'\x00\x00\x00\x2C\x00\x00\x00\x00'
-            b'\x02\x00\x01\x00\x00\x02\x02\x0C'
-            b'\x0A\x00\x3B'
-        )
         cls.uploaded = SimpleUploadedFile(
-            name='small.gif', content=cls.small_gif, content_type='image/gif'
+            name='small.gif', content=SMALL_GIF, content_type='image/gif'
         )
         cls.post = Post.objects.create(
             author=cls.user,
@@ -87,7 +104,12 @@ class PostsPagesTests(TestCase):
         self.assertEqual(post_object.text, self.post.text),
         self.assertEqual(post_object.author, self.post.author),
         self.assertEqual(post_object.group, self.group),
-        self.assertEqual(post_object.image, f'posts/{str(self.uploaded)}'),
+        self.assertEqual(
+            post_object.image,
+            shard_name(
+                'posts/small.gif', hashlib.sha256(SMALL_GIF).hexdigest()
+            ),
+        )
 
     def test_index_page_show_correct_context(self):
         """Шаблон index сформирован с правильным контекстом."""
@@ -220,6 +242,231 @@ class PaginatorViewsTest(TestCase):
                     len(response.context['page_obj'].object_list), lengths
                 )
 
+    def test_cursor_paginate(self):
+        """Курсорная пагинация листает вперед и назад без пропусков"""
+        url = reverse('posts:group_list', kwargs={'slug': self.group.slug})
+        with self.settings(PAGINATE_CURSOR=True):
+            first_page = self.client.get(url).context['page_obj']
+            self.assertEqual(len(first_page), 10)
+            self.assertFalse(first_page.has_previous())
+            response = self.client.get(
+                url, {'after': first_page.next_cursor()}
+            )
+        second_page = response.context['page_obj']
+        self.assertEqual(len(second_page), 3)
+        self.assertFalse(second_page.has_next())
+        seen = [post.pk for post in first_page]
+        seen += [post.pk for post in second_page]
+        self.assertCountEqual(seen, Post.objects.values_list('pk', flat=True))
+        response = self.client.get(
+            url, {'before': second_page.previous_cursor()}
+        )
+        self.assertEqual(
+            list(response.context['page_obj']), list(first_page)
+        )
+
+    def test_page_links_keep_other_parameters(self):
+        """Ссылки пагинатора сохраняют остальные GET-параметры"""
+        url = reverse('posts:group_list', kwargs={'slug': self.group.slug})
+        response = self.client.get(url, {'page': 2, 'ref': 'x'})
+        self.assertContains(response, 'href="?ref=x&amp;page=1"')
+        with self.settings(PAGINATE_CURSOR=True):
+            after = self.client.get(url).context['page_obj'].next_cursor()
+            response = self.client.get(url, {'after': after, 'ref': 'x'})
+        self.assertContains(response, 'href="?ref=x">Первая</a>')
+        before = response.context['page_obj'].previous_cursor()
+        self.assertContains(response, f'href="?ref=x&amp;before={before}"')
+
+    def test_cursor_paginate_without_count(self):
+        """Курсорная страница не выполняет COUNT(*)"""
+        url = reverse('posts:group_list', kwargs={'slug': self.group.slug})
+        first_page = self.client.get(url, {'after': 'broken'})
+        cursor = first_page.context['page_obj'].next_cursor()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url, {'after': cursor})
+        for query in queries.captured_queries:
+            self.assertNotIn('COUNT(', query['sql'])
+            self.assertNotIn('OFFSET', query['sql'])
+
+    def test_page_window(self):
+        """В пагинаторе выводится только окно номеров вокруг текущей"""
+        paginator = Paginator(range(100), 1)
+        windows = (
+            (1, [1, 2, 3, None, 100]),
+            (4, [1, 2, 3, 4, 5, 6, None, 100]),
+            (50, [1, None, 48, 49, 50, 51, 52, None, 100]),
+            (99, [1, None, 97, 98, 99, 100]),
+        )
+        for number, expected in windows:
+            with self.subTest(number=number):
+                page = paginator.page(number)
+                self.assertEqual(page_window(page, 2), expected)
+
+
+class PostDetailViewsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='auth')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(
+            author=cls.author, text='Тестовый пост', group=cls.group
+        )
+        for i in range(25):
+            commentator = User.objects.create_user(username=f'user{i}')
+            Comment.objects.create(
+                post=cls.post, author=commentator, text=f'Комментарий {i}'
+            )
+
+    def test_post_detail_fixed_number_of_queries(self):
+        """Пост, автор, группа и комментаторы грузятся двумя запросами"""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        comments = response.context['comments']
+        self.assertEqual(len(comments), settings.COMMENTS_PAGINATE_LIMIT)
+        self.assertContains(response, 'Комментарий 24')
+        self.assertNotIn(
+            'Комментарий 4', [comment.text for comment in comments]
+        )
+
+    def test_post_detail_load_more_comments(self):
+        """Ссылка «показать еще» отдает следующие комментарии"""
+        url = reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        comments = self.client.get(url).context['comments']
+        self.assertTrue(comments.has_next())
+        response = self.client.get(url, {'after': comments.next_cursor()})
+        more_comments = response.context['comments']
+        self.assertEqual(len(more_comments), 5)
+        self.assertFalse(more_comments.has_next())
+        self.assertContains(response, 'Комментарий 0')
+
+
+@override_settings(
+    MEDIA_ROOT=TEMP_MEDIA_ROOT,
+    THUMBNAIL_KVSTORE_PATH=TEMP_KVSTORE_PATH,
+    THUMBNAIL_WORKERS=0,
+    IMAGE_INGEST_WORKERS=0,
+)
+class ThumbnailViewsTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='auth')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        self.post = Post.objects.create(
+            author=self.user,
+            text='Пост с картинкой',
+            image=SimpleUploadedFile('thumb.gif', SMALL_GIF),
+        )
+
+    def tearDown(self):
+        # превью из одного теста не должны попасть в проверки другого
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def thumbnail_dir(self):
+        return os.path.join(TEMP_MEDIA_ROOT, sorl_settings.THUMBNAIL_PREFIX)
+
+    def test_page_does_not_resize_images(self):
+        """Без готового превью страница отдает исходную картинку"""
+        response = self.authorized_client.get(reverse('posts:index'))
+        self.assertContains(response, self.post.image.url)
+        self.assertContains(response, 'height="300" width="500"')
+        self.assertFalse(os.path.exists(self.thumbnail_dir()))
+
+    def test_page_uses_generated_thumbnail(self):
+        """После нарезки страница отдает превью"""
+        thumbnails.generate(self.post.image.name)
+        thumbnail = thumbnails.lookup(self.post.image, 'card')
+        self.assertEqual((thumbnail.width, thumbnail.height), (500, 300))
+        response = self.authorized_client.get(reverse('posts:index'))
+        self.assertContains(response, thumbnail.url)
+        self.assertNotContains(response, self.post.image.url)
+
+    def test_page_uses_responsive_variants(self):
+        """Превью отдаются через <picture> со srcset не шире исходника"""
+        thumbnails.generate(self.post.image.name, self.post.image_width)
+        response = self.authorized_client.get(reverse('posts:index'))
+        self.assertContains(response, '<picture>')
+        self.assertContains(response, ' 250w, ')
+        self.assertContains(response, ' 500w"')
+        self.assertNotContains(response, '1000w')
+        self.assertContains(response, 'loading="lazy"')
+
+    def test_benchmark_image_bytes(self):
+        """Бенчмарк считает байты картинок на страницах главной"""
+        thumbnails.generate(self.post.image.name, self.post.image_width)
+        out = StringIO()
+        call_command(
+            'benchmark_image_bytes', pages=1, viewport=[360], stdout=out
+        )
+        self.assertIn('картинок: 1', out.getvalue())
+        self.assertIn('Экран 360px', out.getvalue())
+
+    @skipUnless(features.check('webp'), 'Pillow собран без WebP')
+    def test_page_offers_webp(self):
+        """Браузерам с WebP предлагается WebP-вариант"""
+        thumbnails.generate(self.post.image.name, self.post.image_width)
+        response = self.authorized_client.get(reverse('posts:index'))
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, '.webp 500w')
+
+    def create_post_on_commit(self):
+        """Создает пост через форму и возвращает его on_commit-хук."""
+        form_data = {
+            'text': 'Еще пост',
+            'image': SimpleUploadedFile('new.gif', SMALL_GIF),
+        }
+        with mock.patch.object(transaction, 'on_commit') as on_commit:
+            self.authorized_client.post(
+                reverse('posts:post_create'), data=form_data
+            )
+        return Post.objects.get(text='Еще пост'), on_commit.call_args[0][0]
+
+    @override_settings(THUMBNAIL_WORKERS=2)
+    def test_post_create_queues_thumbnails(self):
+        """Создание поста ставит нарезку в очередь после коммита"""
+        post, on_commit = self.create_post_on_commit()
+        with mock.patch.object(thumbnails, 'get_executor') as executor:
+            on_commit()
+        executor().submit.assert_called_once_with(
+            thumbnails.generate, post.image.name, post.image_width
+        )
+
+    def test_post_create_renders_thumbnails_without_pool(self):
+        """Без пула превью режутся сразу после коммита"""
+        post, on_commit = self.create_post_on_commit()
+        self.assertIsNone(thumbnails.lookup(post.image, 'card'))
+        on_commit()
+        self.assertIsNotNone(thumbnails.lookup(post.image, 'card'))
+
+    def test_warm_thumbnails_resumes_from_checkpoint(self):
+        """warm_thumbnails режет превью и продолжает с checkpoint"""
+        checkpoint = os.path.join(TEMP_MEDIA_ROOT, 'warm.ckpt')
+        with open(checkpoint, 'w') as file:
+            file.write(str(self.post.pk))
+        options = {'processes': 1, 'checkpoint': checkpoint}
+        call_command('warm_thumbnails', stdout=StringIO(), **options)
+        self.assertIsNone(thumbnails.lookup(self.post.image, 'card'))
+        self.assertFalse(os.path.exists(checkpoint))
+        out = StringIO()
+        call_command('warm_thumbnails', stdout=out, **options)
+        self.assertIsNotNone(thumbnails.lookup(self.post.image, 'card'))
+        self.assertIn('Нарезано картинок: 1', out.getvalue())
+
 
 class CacheViewsTest(TestCase):
     @classmethod
@@ -232,6 +479,7 @@ class CacheViewsTest(TestCase):
         )
 
     def setUp(self):
+        cache.clear()
         self.guest_client = Client()
 
     def test_cache_index_page(self):
@@ -239,8 +487,8 @@ class CacheViewsTest(TestCase):
         # делаем запрос к главной странице, запоминаем контент
         response = self.guest_client.get(reverse('posts:index'))
         content = response.content
-        # удаляем пост, и проверяем остался ли он в контенте
-        Post.objects.first().delete()
+        # меняем пост в обход сигналов, страница должна остаться в кэше
+        Post.objects.filter(pk=self.post.pk).update(text='Другой текст')
         response_last = self.guest_client.get(reverse('posts:index'))
         content_last = response_last.content
         self.assertEqual(content, content_last)
@@ -250,6 +498,42 @@ class CacheViewsTest(TestCase):
         content_last = response_last.content
         self.assertNotEqual(content, content_last)
 
+    def test_cache_index_page_invalidation(self):
+        """Создание, изменение и удаление поста сбрасывают кэш главной"""
+        self.guest_client.get(reverse('posts:index'))
+        new_post = Post.objects.create(author=self.user, text='Новый пост')
+        response = self.guest_client.get(reverse('posts:index'))
+        self.assertContains(response, 'Новый пост')
+        new_post.text = 'Исправленный пост'
+        new_post.save()
+        response = self.guest_client.get(reverse('posts:index'))
+        self.assertContains(response, 'Исправленный пост')
+        new_post.delete()
+        response = self.guest_client.get(reverse('posts:index'))
+        self.assertNotContains(response, 'Исправленный пост')
+
+    def test_cache_index_page_shared_between_anonymous(self):
+        """Анонимы с разными cookie получают одну копию главной"""
+        content = self.guest_client.get(reverse('posts:index')).content
+        Post.objects.filter(pk=self.post.pk).update(text='Другой текст')
+        other_client = Client()
+        other_client.cookies['some_cookie'] = 'value'
+        response = other_client.get(reverse('posts:index'))
+        self.assertEqual(response.content, content)
+
+    def test_cache_index_page_authorized(self):
+        """Авторизованный видит свою шапку и закэшированный список"""
+        self.guest_client.get(reverse('posts:index'))
+        Post.objects.filter(pk=self.post.pk).update(text='Другой текст')
+        authorized_client = Client()
+        authorized_client.force_login(self.user)
+        with self.assertNumQueries(2):
+            # сессия и пользователь, сам список взят из кэша фрагмента
+            response = authorized_client.get(reverse('posts:index'))
+        self.assertContains(response, f'Пользователь: {self.user.username}')
+        self.assertContains(response, self.post.text)
+        self.assertNotContains(response, 'Другой текст')
+
 
 class FollowViewsTest(TestCase):
     @classmethod
@@ -317,3 +601,152 @@ class FollowViewsTest(TestCase):
         # проверяем корректность записи в БД
         self.assertEqual(Follow.objects.first().user, self.follower)
         self.assertEqual(Follow.objects.first().author, self.author)
+
+    def test_feed_fan_out_on_write(self):
+        """Новый пост раскладывается по лентам подписчиков"""
+        Follow.objects.create(user=self.follower, author=self.author)
+        new_post = Post.objects.create(author=self.author, text='Новый пост')
+        self.assertTrue(
+            self.follower.feed.filter(post=new_post).exists()
+        )
+        self.assertFalse(FeedEntry.objects.filter(user=self.user).exists())
+
+    def test_feed_backfill_and_trim(self):
+        """Подписка заполняет ленту старыми постами, отписка чистит ее"""
+        self.follower_client.get(
+            reverse(
+                'posts:profile_follow',
+                kwargs={'username': self.author.username},
+            )
+        )
+        self.assertEqual(
+            list(self.follower.feed.values_list('post', flat=True)),
+            [self.post.pk],
+        )
+        self.follower_client.get(
+            reverse(
+                'posts:profile_unfollow',
+                kwargs={'username': self.author.username},
+            )
+        )
+        self.assertFalse(self.follower.feed.exists())
+
+    def test_unfollow_keeps_other_followers(self):
+        """Отписка удаляет только свою подписку"""
+        Follow.objects.create(user=self.user, author=self.author)
+        Follow.objects.create(user=self.follower, author=self.author)
+        self.follower_client.get(
+            reverse(
+                'posts:profile_unfollow',
+                kwargs={'username': self.author.username},
+            )
+        )
+        self.assertTrue(
+            Follow.objects.filter(user=self.user, author=self.author).exists()
+        )
+        self.assertTrue(self.user.feed.exists())
+
+    @override_settings(FEED_FANOUT_LIMIT=0)
+    def test_feed_pull_for_popular_authors(self):
+        """Посты популярных авторов подмешиваются в ленту при чтении"""
+        Follow.objects.create(user=self.follower, author=self.author)
+        Post.objects.create(author=self.author, text='Новый пост')
+        self.assertFalse(FeedEntry.objects.exists())
+        response = self.follower_client.get(reverse('posts:follow_index'))
+        self.assertEqual(len(response.context['page_obj']), 2)
+
+    @override_settings(FEED_FANOUT_LIMIT=1)
+    def test_feed_resumes_fan_out_below_limit(self):
+        """Когда автор снова раскладывает посты, в ленты попадают и
+        посты, опубликованные при чтении по запросу"""
+        Follow.objects.create(user=self.follower, author=self.author)
+        Follow.objects.create(user=self.user, author=self.author)
+        pulled = Post.objects.create(author=self.author, text='Новый пост')
+        self.assertFalse(FeedEntry.objects.filter(post=pulled).exists())
+        Follow.objects.filter(user=self.user).delete()
+        self.assertEqual(
+            set(self.follower.feed.values_list('post', flat=True)),
+            {self.post.pk, pulled.pk},
+        )
+        self.assertFalse(self.user.feed.exists())
+
+    @override_settings(FEED_FANOUT_LIMIT=2)
+    def test_feed_resume_backfills_pull_mode_followers(self):
+        """Подписавшийся при чтении по запросу получает старые посты
+        автора, когда тот снова раскладывает посты"""
+        Follow.objects.create(user=self.follower, author=self.author)
+        Follow.objects.create(user=self.user, author=self.author)
+        late = User.objects.create_user(username='late')
+        Follow.objects.create(user=late, author=self.author)
+        self.assertFalse(late.feed.exists())
+        Follow.objects.filter(user=self.user).delete()
+        self.assertEqual(
+            list(late.feed.values_list('post', flat=True)), [self.post.pk]
+        )
+
+
+@override_settings(SQLITE_WRITE_QUEUE=True)
+class WriteQueueViewsTest(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='auth')
+        self.user = User.objects.create_user(username='jack')
+        self.post = Post.objects.create(author=self.author, text='Пост')
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def test_writes_go_through_writer_thread(self):
+        """Пост, комментарий и подписки пишет поток-писатель"""
+        threads = set()
+        write = writer.write
+
+        def spy(func, *args, **kwargs):
+            def job():
+                threads.add(threading.current_thread().name)
+                return func(*args, **kwargs)
+
+            return write(job)
+
+        with mock.patch('core.writer.write', spy):
+            self.client.post(
+                reverse('posts:post_create'), {'text': 'Новый пост'}
+            )
+            self.client.post(
+                reverse('posts:add_comment', args=[self.post.pk]),
+                {'text': 'Комментарий'},
+            )
+            self.client.get(
+                reverse('posts:profile_follow', args=[self.author.username])
+            )
+            self.assertTrue(
+                Follow.objects.filter(
+                    user=self.user, author=self.author
+                ).exists()
+            )
+            self.client.get(
+                reverse('posts:profile_unfollow', args=[self.author.username])
+            )
+        self.assertEqual(threads, {'sqlite-writer'})
+        self.assertTrue(Post.objects.filter(text='Новый пост').exists())
+        self.assertTrue(Comment.objects.filter(text='Комментарий').exists())
+        self.assertFalse(Follow.objects.exists())
+
+    def test_failed_write_does_not_roll_back_batch(self):
+        """Ошибка одной записи пачки не откатывает соседние"""
+
+        def fail():
+            Group.objects.create(title='Откатится', slug='rolled-back')
+            raise ValueError('ошибка записи')
+
+        batch = [
+            (Future(), Group.objects.create, (), {'title': 'A', 'slug': 'a'}),
+            (Future(), fail, (), {}),
+            (Future(), Group.objects.create, (), {'title': 'B', 'slug': 'b'}),
+        ]
+        writer.run_batch(batch)
+        self.assertEqual(batch[0][0].result().slug, 'a')
+        with self.assertRaisesMessage(ValueError, 'ошибка записи'):
+            batch[1][0].result()
+        self.assertEqual(
+            list(Group.objects.values_list('slug', flat=True)), ['a', 'b']
+        )
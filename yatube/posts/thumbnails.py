@@ -0,0 +1,194 @@
+"""Нарезка превью картинок постов заранее, а не при показе.
+
+Превью для известных геометрий режутся после сохранения поста: сразу в
+запросе загрузки или в пуле потоков (THUMBNAIL_WORKERS), а шаблоны только
+читают готовый результат из kvstore sorl-thumbnail. Пока превью нет,
+показывается исходная картинка, так что страницы никогда не ждут Pillow.
+Pillow отпускает GIL на декодировании и ресайзе, а потоки делят
+с веб-процессом настройки, кеш и базу.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from core.cache import bump_cache_version
+from django.apps import apps
+from django.conf import settings
+from django.db import close_old_connections
+from PIL import features
+from sorl.thumbnail import default
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as thumbnail_defaults
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile
+from sorl.thumbnail.parsers import parse_geometry
+
+logger = logging.getLogger(__name__)
+
+# Геометрии, в которых картинки постов выводятся на страницах
+PRESETS = {
+    'card': ('500x300', {'crop': 'center', 'upscale': True}),
+}
+# Ширины адаптивных вариантов превью для srcset; шире исходника не режем
+VARIANT_WIDTHS = (250, 500, 750, 1000)
+# WebP есть не в каждой сборке Pillow; JPEG идет последним как запасной
+VARIANT_FORMATS = ('WEBP', 'JPEG') if features.check('webp') else ('JPEG',)
+MIME_TYPES = {'WEBP': 'image/webp', 'JPEG': 'image/jpeg'}
+
+_executor = None
+
+
+class LookupBackend(ThumbnailBackend):
+    """Бэкенд sorl-thumbnail, который умеет искать превью без нарезки."""
+
+    def get_options(self, source, options):
+        # те же значения по умолчанию, что и в get_thumbnail, иначе
+        # имя файла превью не совпадет
+        options = dict(options)
+        if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(thumbnail_settings, attr)
+            if value != getattr(thumbnail_defaults, attr):
+                options.setdefault(key, value)
+        return options
+
+    def thumbnail_name(self, file_, geometry_string, options):
+        source = ImageFile(file_)
+        options = self.get_options(source, options)
+        return self._get_thumbnail_filename(source, geometry_string, options)
+
+    def lookup(self, file_, geometry_string, **options):
+        """Готовое превью или None, если его еще не нарезали."""
+        name = self.thumbnail_name(file_, geometry_string, options)
+        return default.kvstore.get(ImageFile(name, default.storage))
+
+
+backend = LookupBackend()
+
+
+def lookup(image, preset):
+    geometry, options = PRESETS[preset]
+    return backend.lookup(image, geometry, **options)
+
+
+def variants(preset, source_width=None):
+    """Варианты превью пресета: (формат, ширина, геометрия, опции).
+
+    Порядок постоянный: нарезка идет по нему, и готовность последнего
+    варианта означает, что готовы все.
+    """
+    geometry, options = PRESETS[preset]
+    x, y = (int(side) for side in geometry.split('x'))
+    widths = sorted(
+        width
+        for width in set(VARIANT_WIDTHS) | {x}
+        if width <= x or source_width is None or width <= source_width
+    )
+    for format_ in VARIANT_FORMATS:
+        for width in widths:
+            yield (
+                format_,
+                width,
+                f'{width}x{round(y * width / x)}',
+                {**options, 'format': format_},
+            )
+
+
+def lookup_variants(image, preset, source_width=None):
+    """Адреса готовых вариантов по форматам: {формат: [(ширина, url)]}.
+
+    В kvstore проверяется только последний вариант, адреса остальных
+    вычисляются по имени. Пока варианты не нарезаны, возвращает None.
+    """
+    found = list(variants(preset, source_width))
+    format_, width, geometry, options = found[-1]
+    if backend.lookup(image, geometry, **options) is None:
+        return None
+    urls = {}
+    for format_, width, geometry, options in found:
+        name = backend.thumbnail_name(image, geometry, options)
+        urls.setdefault(format_, []).append(
+            (width, default.storage.url(name))
+        )
+    return urls
+
+
+def thumbnail_size(width, height, preset):
+    """Размер превью по размерам исходника, как его посчитает sorl."""
+    geometry, options = PRESETS[preset]
+    x, y = parse_geometry(geometry, width / height)
+    factors = (x / width, y / height)
+    factor = max(factors) if options.get('crop') else min(factors)
+    if not options.get('upscale'):
+        factor = min(factor, 1)
+    width, height = round(width * factor), round(height * factor)
+    if options.get('crop'):
+        width, height = min(width, x), min(height, y)
+    return width, height
+
+
+def source_file(name):
+    # ключ превью в kvstore зависит от хранилища исходника, поэтому
+    # картинку нужно открыть через хранилище поля Post.image
+    storage = apps.get_model('posts', 'Post')._meta.get_field('image').storage
+    return ImageFile(name, storage)
+
+
+def render(name, source_width=None):
+    """Нарезает все превью для картинки, возвращает успех."""
+    try:
+        for preset in PRESETS:
+            for _, _, geometry, options in variants(preset, source_width):
+                backend.get_thumbnail(source_file(name), geometry, **options)
+    except Exception:
+        logger.exception('Не удалось нарезать превью для %s', name)
+        return False
+    return True
+
+
+def generate(name, source_width=None):
+    """Нарезает превью после сохранения поста; выполняется в пуле."""
+    try:
+        if render(name, source_width):
+            # главная могла закэшироваться с исходной картинкой
+            bump_cache_version(settings.INDEX_CACHE_PREFIX)
+    finally:
+        close_old_connections()
+
+
+def init_worker():
+    """Инициализация процесса-воркера, запущенного через spawn."""
+    import django
+
+    django.setup()
+
+
+def render_batch(images):
+    """Нарезает превью пачки картинок (имя, ширина) в процессе-воркере.
+
+    Возвращает число картинок, которые не удалось обработать.
+    """
+    failed = sum(not render(name, width) for name, width in images)
+    close_old_connections()
+    return failed
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            # ingest отдает сюда нарезку и при THUMBNAIL_WORKERS = 0
+            max_workers=settings.THUMBNAIL_WORKERS or 1,
+            thread_name_prefix='thumbnails',
+        )
+    return _executor
+
+
+def schedule(name, source_width=None):
+    """Нарезает превью сразу или отдает нарезку в пул потоков."""
+    if settings.THUMBNAIL_WORKERS:
+        get_executor().submit(generate, name, source_width)
+    else:
+        generate(name, source_width)
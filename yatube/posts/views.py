@@ -1,27 +1,41 @@
+from core import writer
+from core.cache import anonymous_cache_page, get_cache_version
 from core.utils import paginate
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
 from django.shortcuts import get_object_or_404, redirect, render
-from django.views.decorators.cache import cache_page
+from django.utils.functional import SimpleLazyObject
 
+from . import ingest
+from .feed import CURSOR_KEY, feed_posts
 from .forms import CommentForm, PostForm
 from .models import Follow, Group, Post
+from .search import SearchPaginator, decode_rank_cursor
 
 User = get_user_model()
 
 
-@cache_page(20, key_prefix='index_page')
+@anonymous_cache_page(
+    settings.INDEX_CACHE_TIMEOUT,
+    key_prefix=settings.INDEX_CACHE_PREFIX,
+    browser_timeout=settings.INDEX_BROWSER_CACHE_TIMEOUT,
+)
 def index(request):
-    posts = Post.objects.select_related('group', 'author')
+    posts = Post.objects.spread().select_related('group', 'author')
     context = {
-        'page_obj': paginate(posts, request),
+        # список постов кэшируется в шаблоне, при попадании в кэш
+        # запросы к базе за страницей не нужны
+        'page_obj': SimpleLazyObject(lambda: paginate(posts, request)),
+        'cache_version': get_cache_version(settings.INDEX_CACHE_PREFIX),
+        'cache_timeout': settings.INDEX_CACHE_TIMEOUT,
     }
     return render(request, 'posts/index.html', context)
 
 
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.select_related('author')
+    posts = group.posts.with_archive().select_related('author')
     context = {
         'group': group,
         'page_obj': paginate(posts, request),
@@ -30,8 +44,12 @@ def group_posts(request, slug):
 
 
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    posts = author.posts.select_related('group')
+    author = get_object_or_404(
+        User.objects.select_related('stats'), username=username
+    )
+    posts = author.posts.with_archive(authors=[author.pk]).select_related(
+        'group'
+    )
     following = (
         request.user.is_authenticated
         and Follow.objects.filter(user=request.user)
@@ -47,21 +65,45 @@ def profile(request, username):
 
 
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
+    posts = Post.objects.with_archive(posts=[post_id])
+    post = get_object_or_404(
+        posts.select_related('author__stats', 'group'), id=post_id
+    )
+    comments = post.comments.spread(authors=[post.author_id]).select_related(
+        'author'
+    )
     context = {
         'post': post,
+        'comments': paginate(
+            comments,
+            request,
+            cursor=True,
+            per_page=settings.COMMENTS_PAGINATE_LIMIT,
+        ),
         'form': CommentForm(),
     }
     return render(request, 'posts/post_detail.html', context)
 
 
+def search(request):
+    query = request.GET.get('q', '').strip()
+    paginator = SearchPaginator(query, settings.PAGINATE_LIMIT)
+    after = decode_rank_cursor(request.GET.get('after'))
+    context = {
+        'query': query,
+        'page_obj': paginator.get_cursor_page(after=after),
+    }
+    return render(request, 'posts/search.html', context)
+
+
 @login_required
 def post_create(request):
     form = PostForm(request.POST or None, files=request.FILES or None)
     if form.is_valid():
         post = form.save(commit=False)
         post.author = request.user
-        post.save()
+        writer.write(post.save)
+        ingest.queue(post)
         return redirect('posts:profile', request.user.username)
     context = {'form': form}
     return render(request, 'posts/create_post.html', context)
@@ -69,7 +111,9 @@ def post_create(request):
 
 @login_required
 def post_edit(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
+    post = get_object_or_404(
+        Post.objects.with_archive(posts=[post_id]), id=post_id
+    )
     if post.author != request.user:
         return redirect('posts:post_detail', post_id)
     form = PostForm(
@@ -77,6 +121,8 @@ def post_edit(request, post_id):
     )
     if form.is_valid():
         form.save()
+        if 'image' in form.changed_data:
+            ingest.queue(post)
         return redirect('posts:post_detail', post.id)
     context = {'form': form, 'is_edit': True}
     return render(request, 'posts/create_post.html', context)
@@ -85,22 +131,20 @@ def post_edit(request, post_id):
 @login_required
 def add_comment(request, post_id):
     form = CommentForm(request.POST or None)
-    post = Post.objects.get(id=post_id)
+    post = Post.objects.with_archive(posts=[post_id]).get(id=post_id)
     if form.is_valid():
         comment = form.save(commit=False)
         comment.author = request.user
         comment.post = post
-        comment.save()
+        writer.write(comment.save)
     return redirect('posts:post_detail', post_id=post_id)
 
 
 @login_required
 def follow_index(request):
-    posts = Post.objects.filter(
-        author__following__user=request.user
-    ).select_related('author', 'group')
+    posts = feed_posts(request.user).select_related('author', 'group')
     context = {
-        'page_obj': paginate(posts, request),
+        'page_obj': paginate(posts, request, key=CURSOR_KEY),
     }
     return render(request, 'posts/follow.html', context)
 
@@ -108,16 +152,10 @@ def follow_index(request):
 @login_required
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
-    # проверка, юзер не подписывается на себя и автора, которого уже подписан
-    if (
-        request.user != author
-        and not Follow.objects.filter(user=request.user)
-        .filter(author=author)
-        .exists()
-    ):
-        Follow.objects.create(
-            user=request.user,
-            author=author,
+    # юзер не подписывается на себя, повторная подписка ничего не меняет
+    if request.user != author:
+        writer.write(
+            Follow.objects.get_or_create, user=request.user, author=author
         )
     return redirect('posts:follow_index')
 
@@ -125,6 +163,7 @@ def profile_follow(request, username):
 @login_required
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
-    record_id = get_object_or_404(Follow, author=author).pk
-    Follow.objects.filter(pk=record_id).delete()
+    writer.write(
+        Follow.objects.filter(user=request.user, author=author).delete
+    )
     return redirect('posts:follow_index')
@@ -42,6 +42,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.ReplicaMiddleware',
     'debug_toolbar.middleware.DebugToolbarMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -78,10 +79,80 @@ WSGI_APPLICATION = 'yatube.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        # стандартный sqlite3, но транзакции начинаются с BEGIN IMMEDIATE
+        'ENGINE': 'core.sqlite',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+        # соединение живет между запросами воркера, PRAGMA ставятся раз
+        'CONN_MAX_AGE': 60,
+    },
+    # копия default, которую обновляет python manage.py sync_replica
+    'replica': {
+        'ENGINE': 'core.sqlite',
+        'NAME': os.path.join(BASE_DIR, 'db.replica.sqlite3'),
+        'CONN_MAX_AGE': 60,
+        'TEST': {'MIRROR': 'default'},
+    },
+    # шард постов: работает, только если перечислен в POST_SHARDS;
+    # схема создается python manage.py migrate --database=shard1
+    'shard1': {
+        'ENGINE': 'core.sqlite',
+        'NAME': os.path.join(BASE_DIR, 'db.shard1.sqlite3'),
+        'CONN_MAX_AGE': 60,
+        # посты ссылаются на пользователей и группы из default
+        'FOREIGN_KEYS': False,
+        # migrate создает здесь только таблицы постов (posts.routers)
+        'POSTS_ONLY': True,
+    },
+    # архив старых постов: работает, только если указан в POST_ARCHIVE;
+    # схема создается python manage.py migrate --database=archive
+    'archive': {
+        'ENGINE': 'core.sqlite',
+        'NAME': os.path.join(BASE_DIR, 'db.archive.sqlite3'),
+        'CONN_MAX_AGE': 60,
+        'FOREIGN_KEYS': False,
+        'POSTS_ONLY': True,
+    },
 }
+DATABASE_ROUTERS = [
+    'posts.routers.ArchiveRouter',
+    'posts.routers.ShardRouter',
+    'core.routers.ReplicaRouter',
+]
+# Откуда GET-запросы читают данные (см. core.routers); None — из default,
+# 'replica' — после первого sync_replica. После записи пользователь еще
+# столько секунд читает только из default
+DATABASE_READ_REPLICA = None
+REPLICA_STICKY_SECONDS = 15
+# Базы, по которым посты и комментарии раскладываются по авторам (см.
+# posts.shards), например ['default', 'shard1']. Пустой список — все в
+# default. Первым идет default: авторы без AuthorShard остаются там.
+# После включения и после добавления шарда запускается
+# python manage.py rebalance_shards
+POST_SHARDS = []
+# Сколько шардов читать одновременно в общих лентах
+POST_SHARD_THREADS = 4
+# База, в которую python manage.py archive_posts переносит посты старше
+# POST_ARCHIVE_AGE дней (см. posts.archive), например 'archive'; None —
+# архива нет, все посты в горячих таблицах
+POST_ARCHIVE = None
+POST_ARCHIVE_AGE = 365
+
+# PRAGMA для каждого нового соединения с SQLite, см. core.db. В режиме WAL
+# synchronous=NORMAL не портит базу при сбое питания, но может потерять
+# последние транзакции; cache_size в минус-килобайтах
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+}
+# Записи постов, комментариев и подписок можно пропускать через один
+# поток-писатель на процесс (core.writer): он коммитит их пачками до
+# SQLITE_WRITE_BATCH_SIZE штук, подождав соседей SQLITE_WRITE_BATCH_WAIT с
+SQLITE_WRITE_QUEUE = False
+SQLITE_WRITE_BATCH_SIZE = 64
+SQLITE_WRITE_BATCH_WAIT = 0.002
 
 
 # Password validation
@@ -127,6 +198,15 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static/')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Файлы крупнее мегабайта при загрузке пишутся на диск, а не в память
+FILE_UPLOAD_MAX_MEMORY_SIZE = 1024 * 1024
+
+# sha256 загружаемых файлов считается, пока они приходят из запроса
+FILE_UPLOAD_HANDLERS = [
+    'core.uploadhandler.HashingMemoryFileUploadHandler',
+    'core.uploadhandler.HashingTemporaryFileUploadHandler',
+]
+
 
 LOGIN_URL = 'users:login'
 LOGIN_REDIRECT_URL = 'posts:index'
@@ -142,11 +222,68 @@ INTERNAL_IPS = [
 
 # Задаем лимит пагинации
 PAGINATE_LIMIT = 10
+# Курсорная пагинация (?after=/?before=) вместо номеров страниц
+PAGINATE_CURSOR = False
+# Комментарии под постом подгружаются порциями по курсору
+COMMENTS_PAGINATE_LIMIT = 20
+# Сколько соседних номеров страниц показывать вокруг текущей
+PAGINATE_WINDOW = 2
+
+# Посты авторов с большим числом подписчиков не раскладываются по лентам,
+# а подмешиваются в ленту при чтении
+FEED_FANOUT_LIMIT = 10000
+FEED_BATCH_SIZE = 1000
+
+# Превью картинок постов режутся после коммита поста в пуле из стольких
+# фоновых потоков; 0 — сразу в запросе загрузки (так работают тесты)
+THUMBNAIL_WORKERS = 2
+# Записи о нарезанных превью лежат не в основной базе, а в файле SQLite,
+# общем для всех процессов; не в MEDIA_ROOT, чтобы его не раздавал
+# веб-сервер. Перед ним в каждом процессе LRU, который сверяется с файлом
+# раз в THUMBNAIL_KVSTORE_RECHECK секунд
+THUMBNAIL_KVSTORE = 'core.kvstore.KVStore'
+THUMBNAIL_KVSTORE_PATH = os.path.join(BASE_DIR, 'thumbnails.sqlite3')
+THUMBNAIL_KVSTORE_LRU_SIZE = 10000
+THUMBNAIL_KVSTORE_RECHECK = 1
+
+# Ограничения на картинки постов; число пикселей проверяется по заголовку
+POST_IMAGE_MAX_SIZE = 10 * 1024 * 1024
+POST_IMAGE_MAX_PIXELS = 40 * 10 ** 6
+# Оригиналы с большей стороной уменьшаются, EXIF у всех удаляется. Это
+# делает пул из стольких процессов, чтобы веб-процесс не держал в памяти
+# полноразмерные картинки; 0 — сразу в запросе загрузки (так работают тесты)
+POST_IMAGE_MAX_SIDE = 2560
+IMAGE_INGEST_WORKERS = 2
 
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
+# Главная страница кэшируется надолго: новые и измененные посты
+# сбрасывают версию кэша сигналами posts.signals
+INDEX_CACHE_PREFIX = 'index_page'
+INDEX_CACHE_TIMEOUT = 60 * 60 * 6
+INDEX_BROWSER_CACHE_TIMEOUT = 20
+
+# Кэш в файле SQLite общий для всех воркеров на машине, так что сброс
+# версии главной доходит до каждого. Сравнение с LocMemCache и файловым
+# кэшем: python manage.py benchmark_cache
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+        'BACKEND': 'core.cache_backends.SQLiteCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache.sqlite3'),
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+    # L1 в памяти воркера для целых страниц: бюджет в байтах, а не
+    # в записях, большие страницы сжимаются. Статистика попаданий по
+    # префиксам ключей — /cache-stats/ для персонала
+    'local': {
+        'BACKEND': 'core.cache_backends.MemoryCache',
+        'LOCATION': 'pages',
+        'OPTIONS': {
+            'MAX_BYTES': 32 * 1024 * 1024,
+            'COMPRESS_MIN_SIZE': 16 * 1024,
+        },
+    },
 }
+
+# Тесты держат кэш во временной папке, чтобы не трогать cache.sqlite3
+TEST_RUNNER = 'core.test_runner.TempCacheRunner'
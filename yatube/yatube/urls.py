@@ -1,3 +1,4 @@
+from core.views import cache_stats
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
@@ -9,6 +10,7 @@ urlpatterns = [
     path('auth/', include('users.urls')),
     path('auth/', include('django.contrib.auth.urls')),
     path('about/', include('about.urls', namespace='about')),
+    path('cache-stats/', cache_stats, name='cache_stats'),
 ]
 
 if settings.DEBUG: